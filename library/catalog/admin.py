@@ -6,7 +6,13 @@ from .models import Author, Book, BookInstance, Genre, Language
 
 @admin.register(Book)
 class BookAdmin(admin.ModelAdmin):
-    list_display = ("title", "author", "display_genre")
+    list_display = (
+        "title",
+        "author",
+        "display_genre",
+        "copies_available",
+        "copies_total",
+    )
 
     # cannot display many-to-many field in list_display because of performance on large DBs, so we
     # create a callable (maybe not recommended, but using for example)
@@ -5,3 +5,7 @@ class CatalogConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     # define name of app
     name = 'catalog'
+
+    def ready(self) -> None:
+        # connects the signal receivers (must be imported once the app registry is ready)
+        from . import signals  # noqa: F401
@@ -0,0 +1,189 @@
+"""Async versions of the read-only catalog pages, which catalog.urls serves instead of
+catalog.views' when the site runs under ASGI (settings.ASYNC_VIEWS, see library.asgi).
+
+They query through the async ORM, so the worker's event loop carries on serving other connections
+(e.g. slow clients) while a page waits on the database. Templates, cards and the page cache still
+run synchronously, in a thread, since they may follow relations; the pages, their caching and
+validators are the same as the sync views'.
+
+The exports are served here too, so a download is streamed chunk by chunk rather than read into
+memory first (see exports.achunks)."""
+
+import time
+from typing import Any
+
+from asgiref.sync import sync_to_async
+from django.http import HttpRequest, HttpResponse
+from django.shortcuts import aget_object_or_404, render
+
+from core.replicas import read_from_replicas
+
+from .cards import AUTHOR_BOOK_CARD, BOOK_CARD, render_cards
+from .conditional import (
+    author_detail_version,
+    author_list_version,
+    book_detail_version,
+    book_list_version,
+    conditional_page,
+    index_version,
+)
+from .exports import achunks
+from .metrics import observe_since, search_seconds
+from .models import Author, Book, LibraryStats
+from .page_cache import cache_anonymous_page, tag_page
+from .pagination import apaginate, apaginate_by_cursor
+from .search import fuzzy_authors, fuzzy_books, search_books
+from .views import (
+    AuthorDetailView,
+    AuthorListView,
+    BookDetailView,
+    BookListView,
+    author_books,
+    book_copies,
+    book_copies_context,
+)
+from .views import export as sync_export
+
+
+async def render_page(request: HttpRequest, template_name: str, context: dict) -> HttpResponse:
+    return await sync_to_async(render)(request, template_name, context)
+
+
+async def list_page(request: HttpRequest, queryset, ordering, page_size: int) -> dict[str, Any]:
+    """The pagination context a ListView with CursorPaginationMixin gives, cursor-paginated on
+    `ordering` unless it's None or a page number is asked for."""
+    if ordering and "page" not in request.GET:
+        page = await apaginate_by_cursor(queryset, ordering, page_size, request.GET.get("cursor"))
+        paginator = None
+    else:
+        page = await apaginate(queryset, page_size, request.GET.get("page") or 1)
+        paginator = page.paginator
+    return {
+        "paginator": paginator,
+        "page_obj": page,
+        "is_paginated": page.has_other_pages(),
+        "object_list": page.object_list,
+        "cursor_paginated": paginator is None,
+    }
+
+
+@read_from_replicas
+@cache_anonymous_page
+@conditional_page(index_version)
+async def index(request):
+    # maintained counters instead of COUNT(*) over each table
+    stats = await LibraryStats.aload()
+    tag_page(request, "stats")
+    return await render_page(
+        request,
+        "catalog/index.html",
+        {
+            "num_books": stats.num_books,
+            "num_instances": stats.copies_total,
+            "num_instances_available": stats.copies_available,
+            "num_authors": stats.num_authors,
+        },
+    )
+
+
+@read_from_replicas
+@cache_anonymous_page
+@conditional_page(book_list_version)
+async def book_list(request):
+    start = time.perf_counter()
+    books, fuzzy = Book.objects.all(), False
+    if search := request.GET.get("search", "").strip():
+        # as BookListView: ranked full-text search, falling back to the closest titles and names
+        books = search_books(books, search)
+        if not await books.aexists():
+            fuzzy = True
+            # looks up the similar authors as it builds the query
+            books = await sync_to_async(fuzzy_books)(Book.objects.all(), search)
+    context = await list_page(
+        request,
+        books if search else books.order_by("pk"),
+        None if search else BookListView.cursor_ordering,
+        BookListView.paginate_by,
+    )
+    page = context["object_list"]
+    tag_page(
+        request,
+        "search" if search else "books",
+        *(f"book:{book.pk}" for book in page),
+        *(f"author:{book.author_id}" for book in page),
+    )
+    cards = await sync_to_async(render_cards)(BOOK_CARD, page)
+    if search:
+        observe_since(search_seconds, start, "books", "fuzzy" if fuzzy else "fulltext")
+    context.update(book_list=page, search=search, fuzzy=fuzzy, cards=list(zip(page, cards)))
+    return await render_page(request, "catalog/book_list.html", context)
+
+
+@read_from_replicas
+@cache_anonymous_page
+@conditional_page(book_detail_version)
+async def book_detail(request, pk: int):
+    # the book, author and language, then the genres (prefetched as the rows are iterated)
+    book = await aget_object_or_404(BookDetailView.queryset, pk=pk)
+    context = book_copies_context(request, book)
+    context.update(
+        object=book,
+        book=book,
+        copies=await apaginate_by_cursor(
+            book_copies(book, context["copy_status"]),
+            ("pk",),
+            BookDetailView.copies_per_page,
+            request.GET.get("cursor"),
+        ),
+    )
+    return await render_page(request, "catalog/book_detail.html", context)
+
+
+@read_from_replicas
+@cache_anonymous_page
+@conditional_page(author_list_version)
+async def author_list(request):
+    start = time.perf_counter()
+    if search := request.GET.get("search", "").strip():
+        # looks up the closest names as it builds the query
+        authors, ordering = await sync_to_async(fuzzy_authors)(search), None
+    else:
+        authors, ordering = AuthorListView.queryset, AuthorListView.cursor_ordering
+    context = await list_page(request, authors, ordering, AuthorListView.paginate_by)
+    page = context["object_list"]
+    if search:
+        observe_since(search_seconds, start, "authors", "fuzzy")
+    tag_page(request, "authors", *(f"author:{author.pk}" for author in page))
+    context.update(author_list=page, search=search)
+    return await render_page(request, "catalog/author_list.html", context)
+
+
+@read_from_replicas
+@conditional_page(author_detail_version)
+async def author_detail(request, pk: int):
+    author = await aget_object_or_404(Author, pk=pk)
+    books = await apaginate_by_cursor(
+        author_books(author),
+        ("title", "pk"),
+        AuthorDetailView.books_per_page,
+        request.GET.get("cursor"),
+    )
+    paginated = books.has_other_pages()
+    context = {
+        "object": author,
+        "author": author,
+        "books": books,
+        "book_cards": await sync_to_async(render_cards)(AUTHOR_BOOK_CARD, books),
+        "page_obj": books,
+        "is_paginated": paginated,
+        "cursor_paginated": paginated,
+    }
+    return await render_page(request, "catalog/author_detail.html", context)
+
+
+async def export(request, name: str, export_format: str):
+    """catalog.views.export, with the live export's (or snapshot's) chunks read as they're sent."""
+    response = await sync_to_async(sync_export)(request, name, export_format)
+    if response.streaming:
+        response.streaming_content = achunks(response.streaming_content)
+    return response
@@ -0,0 +1,123 @@
+"""Fragment cache of the book cards on the book list and author pages.
+
+Each card is cached under its object's id along with the versions of everything it shows (the book,
+its author, its genres); saving or deleting any of those gives it a new version, a random id and
+the time it was made (see catalog.signals), which makes every card showing it stale. A page's cards
+and the current versions are all fetched with one get_many, and the cards that were missing or
+stale are rendered and stored with one set_many.
+
+Cards are rendered without the request, so they're the same for every user; anything that depends
+on the user (e.g. the update/delete buttons) or changes without a save (the copy counters) is
+rendered around them, by the page.
+
+Reads from a lagging replica (see core.replicas) may still show an object as it was before its
+last save, so while reading from one, cards depending on a version newer than the replica lag
+allowed are rendered but not stored."""
+
+import time
+import uuid
+from collections.abc import Callable, Iterable, Sequence
+from dataclasses import dataclass
+from typing import Any
+
+from django.core.cache import caches
+from django.db.models import Model
+from django.template.loader import render_to_string
+from django.utils.safestring import SafeString, mark_safe
+
+from core.replicas import staleness
+
+from .models import Author, Book, Genre
+
+# alias of the cache holding the cards and versions, which must be shared by every worker process
+# (see CACHES)
+CARD_CACHE = "fragments"
+# the versions already keep cards fresh, this just lets unused ones expire; it also bounds how long
+# a card rendered from a row read just before a concurrent save can outlive it
+CARD_TIMEOUT = 60 * 60
+
+Dependency = tuple[type[Model], object]
+
+
+@dataclass(frozen=True)
+class Card:
+    name: str
+    template_name: str
+    # objects the card shows, as (model, pk)
+    dependencies: Callable[[Any], Iterable[Dependency]]
+    context_object_name: str = "object"
+
+
+def book_dependencies(book: Book) -> list[Dependency]:
+    return [(Book, book.pk), (Author, book.author_id)]  # type: ignore
+
+
+def author_book_dependencies(book: Book) -> list[Dependency]:
+    # requires the book's genres to be prefetched
+    return [(Book, book.pk), *((Genre, genre.pk) for genre in book.genre.all())]
+
+
+BOOK_CARD = Card("book", "catalog/cards/book.html", book_dependencies, "book")
+AUTHOR_BOOK_CARD = Card(
+    "author_book", "catalog/cards/author_book.html", author_book_dependencies, "book"
+)
+
+
+def version_key(model: type[Model], pk) -> str:
+    return f"card-version:{model._meta.label_lower}:{pk}"
+
+
+def new_version() -> tuple[float, str]:
+    # random rather than a counter, so a version that was evicted never comes back; the time is
+    # when it was made
+    return (time.time(), uuid.uuid4().hex)
+
+
+def bump_versions(model: type[Model], pks: Iterable) -> None:
+    """Makes every card showing these objects stale."""
+    if versions := {version_key(model, pk): new_version() for pk in pks}:
+        caches[CARD_CACHE].set_many(versions, timeout=None)
+
+
+def render_cards(card: Card, objects: Sequence[Model]) -> list[SafeString]:
+    """The card of each object, from the cache where it's fresh."""
+    cache = caches[CARD_CACHE]
+    card_keys = [f"card:{card.name}:{obj.pk}" for obj in objects]
+    dependency_keys = [
+        [version_key(model, pk) for model, pk in card.dependencies(obj) if pk is not None]
+        for obj in objects
+    ]
+    versioned = list({key: None for keys in dependency_keys for key in keys})
+    found = cache.get_many(card_keys + versioned)
+
+    # objects without a version yet get one; if another request or a save got there first, cards
+    # showing them aren't stored this time, since they may have been read before that save
+    unversioned = set()
+    for key in {key for key in versioned if key not in found}:
+        version = new_version()
+        if cache.add(key, version, timeout=None):
+            found[key] = version
+        else:
+            unversioned.add(key)
+
+    # versions the rows read from a replica may predate
+    if lag := staleness():
+        recent = time.time() - lag
+        unversioned |= {
+            key for key, version in found.items() if key in versioned and version[0] > recent
+        }
+
+    cards, rendered = [], {}
+    for obj, card_key, keys in zip(objects, card_keys, dependency_keys):
+        versions = tuple(found.get(key) for key in keys)
+        cached = found.get(card_key)
+        if cached is not None and cached[0] == versions:
+            cards.append(mark_safe(cached[1]))
+            continue
+        html = render_to_string(card.template_name, {card.context_object_name: obj})
+        if unversioned.isdisjoint(keys):
+            rendered[card_key] = (versions, str(html))
+        cards.append(html)
+    if rendered:
+        cache.set_many(rendered, timeout=CARD_TIMEOUT)
+    return cards
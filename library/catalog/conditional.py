@@ -0,0 +1,128 @@
+"""Conditional GETs of the catalog pages: ETag and Last-Modified headers from the updated_at of what
+each page shows, so a revisit of an unchanged page gets a 304 without the page being rendered.
+
+Each page's version comes from one query over the updated_at indexes (or, for the home page, the
+stats it shows), selecting (last modified, anything else the version depends on). The ETag
+also covers everything else a page varies on: the page parameters and nav menu cookie (as for
+catalog.page_cache), the user, and the date (which the checkout form's default due date depends
+on)."""
+
+import datetime
+import hashlib
+from collections.abc import Callable
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction
+from django.db.models import CharField, DateTimeField, OuterRef, QuerySet, Subquery, Sum, Value
+from django.db.models.functions import Concat, Greatest
+from django.http import HttpRequest
+from django.views.decorators.http import condition
+
+from .models import Author, Book, BookInstance, Genre, LibraryStats
+from .page_cache import page_key
+
+# the first row of a version query, or None if there's no page to version
+Version = tuple[datetime.datetime | None, object] | None
+
+
+def latest_change(queryset) -> Subquery:
+    """updated_at of the latest change in `queryset` (a backward scan of an updated_at index)."""
+    return Subquery(queryset.order_by("-updated_at").values("updated_at")[:1])
+
+
+def conditional_page(version: Callable[..., QuerySet]) -> Callable:
+    """condition() with the ETag and Last-Modified of the page's version, the first row of
+    `version(request, *args, **kwargs)`, which is only queried once per request (with the async ORM
+    for async views)."""
+
+    def page_version(request: HttpRequest, *args, **kwargs) -> Version:
+        if not hasattr(request, "page_version"):
+            request.page_version = version(request, *args, **kwargs).first()  # type: ignore
+        return request.page_version  # type: ignore
+
+    def etag(request: HttpRequest, *args, **kwargs) -> str | None:
+        if (current := page_version(request, *args, **kwargs)) is None:
+            return None
+        last_modified, key = current
+        variant = (
+            f"{page_key(request)}:{request.user.pk}:{datetime.date.today()}:"
+            f"{last_modified.isoformat() if last_modified else ''}:{key}"
+        )
+        return hashlib.md5(variant.encode()).hexdigest()
+
+    def last_modified(request: HttpRequest, *args, **kwargs) -> datetime.datetime | None:
+        current = page_version(request, *args, **kwargs)
+        return current[0] if current else None
+
+    def decorator(view: Callable) -> Callable:
+        conditional = condition(etag_func=etag, last_modified_func=last_modified)(view)
+        if not iscoroutinefunction(view):
+            return conditional
+
+        @wraps(view)
+        async def wrapper(request: HttpRequest, *args, **kwargs):
+            # condition() computes the validators synchronously, so they're queried beforehand
+            request.user = await request.auser()  # type: ignore
+            request.page_version = await version(request, *args, **kwargs).afirst()  # type: ignore
+            return await conditional(request, *args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def index_version(request: HttpRequest) -> QuerySet:
+    # the home page only shows the stats counters
+    return LibraryStats.totals().values_list(
+        Value(None, output_field=DateTimeField()),
+        Concat(
+            Sum("num_books"),
+            Value("-"),
+            Sum("num_authors"),
+            Value("-"),
+            Sum("copies_total"),
+            Value("-"),
+            Sum("copies_available"),
+            output_field=CharField(),
+        ),
+    )
+
+
+def book_list_version(request: HttpRequest) -> QuerySet:
+    # book rows carry their copy counters; the count catches deletions
+    return LibraryStats.totals().values_list(
+        Greatest(
+            latest_change(Book.objects.all()),
+            latest_change(Author.objects.all()),
+            latest_change(Genre.objects.all()),
+        ),
+        Sum("num_books"),
+    )
+
+
+def author_list_version(request: HttpRequest) -> QuerySet:
+    return LibraryStats.totals().values_list(
+        latest_change(Author.objects.all()), Sum("num_authors")
+    )
+
+
+def book_detail_version(request: HttpRequest, pk: int) -> QuerySet:
+    # the book (its counters and genres included), its author and language, its copies (through
+    # bookinstance_book_updated_idx) and genre names
+    return Book.objects.filter(pk=pk).values_list(
+        Greatest(
+            "updated_at",
+            "author__updated_at",
+            "language__updated_at",
+            latest_change(BookInstance.objects.filter(book=OuterRef("pk"))),
+            latest_change(Genre.objects.all()),
+        ),
+        Value(""),
+    )
+
+
+def author_detail_version(request: HttpRequest, pk: int) -> QuerySet:
+    # the author's updated_at also moves when their books change (see catalog.signals)
+    return Author.objects.filter(pk=pk).values_list(
+        Greatest("updated_at", latest_change(Genre.objects.all())), Value("")
+    )
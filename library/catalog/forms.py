@@ -1,10 +1,13 @@
 import datetime
+import re
 
 from core.forms import CrispyForm
 from django import forms
+from django.urls import reverse_lazy
 from django.utils.translation import gettext_lazy as _
 
 from .models import Author, Book, BookInstance
+from .search import fuzzy_authors
 
 
 class RenewBookModelForm(forms.ModelForm):
@@ -33,6 +36,25 @@ class RenewBookModelForm(forms.ModelForm):
 
 # form is not meant for visual; just easy way to update the book instance
 class BorrowOrReturnBookInstanceModelForm(forms.ModelForm):
+    def clean(self):
+        cleaned_data = super().clean()
+        status = cleaned_data.get("status")
+        if status == BookInstance.LOAN_STATUS.OnLoan:
+            today = datetime.date.today()
+            due_back = cleaned_data.get("due_back") or today + datetime.timedelta(weeks=3)
+            if not today <= due_back <= today + datetime.timedelta(weeks=4):
+                self.add_error(
+                    "due_back", _("Invalid date - must be between now and 4 weeks ahead")
+                )
+            cleaned_data["due_back"] = due_back
+        elif status == BookInstance.LOAN_STATUS.Available:
+            # returned copies have no borrower or due date, whatever was posted
+            cleaned_data["borrower"] = None
+            cleaned_data["due_back"] = None
+        else:
+            self.add_error("status", _("Copies can only be borrowed or returned here"))
+        return cleaned_data
+
     class Meta:
         model = BookInstance
         fields = ["borrower", "due_back", "status"]
@@ -44,7 +66,81 @@ class CreateBookInstanceModelForm(forms.ModelForm):
         fields = ["book"]
 
 
+def author_label(author: Author) -> str:
+    # the pk keeps authors with the same name distinguishable
+    return f"{author} (#{author.pk})"
+
+
+class AuthorLookupInput(forms.TextInput):
+    """Text input with a datalist that catalog/js/author-lookup.js fills from the fuzzy lookup."""
+
+    template_name = "catalog/widgets/author_lookup.html"
+
+    def __init__(self, attrs=None):
+        super().__init__(
+            {
+                "autocomplete": "off",
+                "data-lookup-url": reverse_lazy("catalog:author_lookup"),
+                **(attrs or {}),
+            }
+        )
+
+    def get_context(self, name, value, attrs):
+        context = super().get_context(name, value, attrs)
+        attrs = context["widget"]["attrs"]
+        attrs["list"] = f"{attrs.get('id', name)}-suggestions"
+        return context
+
+
+class AuthorLookupField(forms.ModelChoiceField):
+    """Author chosen by typing a name instead of picking from a <select> of every author (which
+    doesn't scale past a few thousand authors). Misspelled names fail validation with the closest
+    matches as suggestions."""
+
+    widget = AuthorLookupInput
+    LABEL_PK = re.compile(r"\(#(\d+)\)\s*$")
+
+    def __init__(self, **kwargs):
+        super().__init__(Author.objects.all(), **kwargs)
+
+    def prepare_value(self, value):
+        if isinstance(value, Author):
+            return author_label(value)
+        if isinstance(value, int) or (isinstance(value, str) and value.isdigit()):
+            author = self.queryset.filter(pk=value).first()
+            return author_label(author) if author else value
+        return value
+
+    def to_python(self, value):
+        if value in self.empty_values:
+            return None
+        value = str(value).strip()
+        if match := self.LABEL_PK.search(value):
+            return super().to_python(match.group(1))
+
+        last_name, _comma, first_name = value.partition(",")
+        exact = list(
+            self.queryset.filter(
+                last_name__iexact=last_name.strip(), first_name__iexact=first_name.strip()
+            )[:2]
+        )
+        if len(exact) == 1:
+            return exact[0]
+
+        suggestions = "; ".join(author_label(a) for a in fuzzy_authors(value, limit=3))
+        raise forms.ValidationError(
+            _("No single author matches “%(value)s”.")
+            + (_(" Did you mean: %(suggestions)s?") if suggestions else ""),
+            code="invalid_choice",
+            params={"value": value, "suggestions": suggestions},
+        )
+
+
 class BookForm(CrispyForm):
+    author = AuthorLookupField(
+        help_text=_("Start typing a name (“Last, First”) and pick a suggestion.")
+    )
+
     class Meta:
         model = Book
         fields = [
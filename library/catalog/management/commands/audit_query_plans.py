@@ -0,0 +1,143 @@
+import json
+import uuid
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import reverse
+
+from catalog.management.seed import WORDS, seed_catalog
+from catalog.models import Author, Book
+
+
+def plan_nodes(plan: dict):
+    yield plan
+    for child in plan.get("Plans", []):
+        yield from plan_nodes(child)
+
+
+class Command(BaseCommand):
+    help = (
+        "Requests each catalog page, runs EXPLAIN (ANALYZE, BUFFERS) on every SELECT it issued and "
+        "reports sequential scans over large tables. Exits with an error if any are found, so "
+        "missing indexes are caught before they reach production. Run against a scratch database, "
+        "e.g. seeded with --seed 100000."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--seed",
+            type=int,
+            default=0,
+            help="Insert this many synthetic books (with copies and borrowers) first.",
+        )
+        parser.add_argument(
+            "--min-rows",
+            type=int,
+            default=1000,
+            help="Only report sequential scans reading at least this many rows (small lookup "
+            "tables are cheaper to scan than to index).",
+        )
+        parser.add_argument(
+            "--verbose-plans",
+            action="store_true",
+            help="Print the full plan of every query with a reported sequential scan.",
+        )
+
+    def handle(self, *args, seed: int, min_rows: int, verbose_plans: bool, **options):
+        if seed:
+            User = get_user_model()
+            run = uuid.uuid4().hex[:6]
+            borrowers = User.objects.bulk_create(
+                User(username=f"seed-reader-{run}-{i}") for i in range(50)
+            )
+            seed_catalog(seed, copies_per_book=3, borrowers=borrowers, stdout=self.stdout)
+            with connection.cursor() as cursor:
+                cursor.execute("ANALYZE catalog_book, catalog_author, catalog_bookinstance")
+
+        findings = 0
+        # every query goes to the primary (rather than some to replicas the capture wouldn't see),
+        # and the throwaway user, its login and any session writes are rolled back
+        with override_settings(DATABASE_REPLICAS=[]), transaction.atomic():
+            client = self.logged_in_client()
+            for url in self.urls():
+                findings += self.audit(client, url, min_rows, verbose_plans)
+            transaction.set_rollback(True)
+
+        if findings:
+            raise CommandError(f"{findings} sequential scan(s) over {min_rows}+ rows")
+        self.stdout.write(self.style.SUCCESS("No sequential scans over large tables"))
+
+    def logged_in_client(self) -> Client:
+        # a superuser of its own, so the staff pages are audited too without touching (and
+        # locking) a real user's row; a seq scan for its loans reads the whole table all the same
+        user = get_user_model().objects.create(
+            username=f"audit-{uuid.uuid4().hex[:6]}", is_superuser=True
+        )
+        # secure/allowed host, so SECURE_SSL_REDIRECT and ALLOWED_HOSTS don't short-circuit views
+        client = Client(HTTP_HOST="127.0.0.1")
+        client.force_login(user)  # type: ignore
+        return client
+
+    def urls(self) -> list[str]:
+        urls = [
+            reverse("catalog:index"),
+            reverse("catalog:books"),
+            reverse("catalog:authors"),
+            reverse("catalog:my_borrowed"),
+            reverse("catalog:all_borrowed"),
+            reverse("catalog:overdue"),
+            reverse("catalog:books") + f"?search={WORDS[100]}",
+            reverse("catalog:authors") + f"?search={WORDS[100].title()}",
+            reverse("catalog:all_borrowed") + f"?search={WORDS[100]}",
+        ]
+        # the book with the most copies and an author with books, for the detail pages
+        book = Book.objects.order_by("-copies_total").first()
+        if book:
+            urls.append(book.get_absolute_url())
+        author = Author.objects.filter(book__isnull=False).first()
+        if author:
+            urls.append(author.get_absolute_url())
+        return urls
+
+    def audit(self, client: Client, url: str, min_rows: int, verbose_plans: bool) -> int:
+        with CaptureQueriesContext(connection) as captured:
+            response = client.get(url, secure=True)
+        if response.status_code != 200:
+            raise CommandError(f"GET {url} returned {response.status_code}")
+
+        selects = [
+            query["sql"]
+            for query in captured.captured_queries
+            if query["sql"].lstrip().upper().startswith("SELECT")
+        ]
+        total_ms = 0.0
+        scans = []
+        with connection.cursor() as cursor:
+            for sql in selects:
+                cursor.execute(f"EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) {sql}")
+                explained = cursor.fetchone()[0]
+                if isinstance(explained, str):
+                    explained = json.loads(explained)
+                total_ms += explained[0]["Execution Time"]
+                for node in plan_nodes(explained[0]["Plan"]):
+                    if node["Node Type"] != "Seq Scan":
+                        continue
+                    read = node["Actual Rows"] + node.get("Rows Removed by Filter", 0)
+                    if read >= min_rows:
+                        scans.append((node, read, sql, explained))
+
+        self.stdout.write(f"{url}: {len(selects)} queries, {total_ms:.2f} ms")
+        for node, read, sql, explained in scans:
+            self.stdout.write(
+                self.style.WARNING(
+                    f"  Seq Scan on {node['Relation Name']}: {read} rows read, "
+                    f"{node['Shared Hit Blocks'] + node['Shared Read Blocks']} buffers"
+                )
+            )
+            self.stdout.write(f"    {sql}")
+            if verbose_plans:
+                self.stdout.write(json.dumps(explained, indent=2))
+        return len(scans)
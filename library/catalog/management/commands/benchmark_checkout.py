@@ -0,0 +1,132 @@
+import datetime
+import random
+import threading
+import time
+import uuid
+from collections import Counter
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from catalog.models import Book, BookInstance
+
+
+class Command(BaseCommand):
+    help = (
+        "Has many threads race to borrow (and then return) the copies of one popular book, and "
+        "reports throughput, conflicts and double loans (a copy lent to someone else while its "
+        "borrower still held it, found when the borrower can't return it). --naive runs the old "
+        "read-check-save flow for comparison. Run against a scratch database."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--threads", type=int, default=16)
+        parser.add_argument("--copies", type=int, default=4, help="Copies of the book.")
+        parser.add_argument(
+            "--seconds", type=float, default=5, help="How long the threads hammer the book."
+        )
+        parser.add_argument(
+            "--naive",
+            action="store_true",
+            help="Check the status in Python and save() the whole row, as the checkout view "
+            "used to.",
+        )
+
+    def handle(self, *args, threads: int, copies: int, seconds: float, naive: bool, **options):
+        run = uuid.uuid4().hex[:6]
+        User = get_user_model()
+        users = User.objects.bulk_create(
+            User(username=f"bench-borrower-{run}-{i}") for i in range(threads)
+        )
+        book = Book.objects.create(title=f"Benchmark {run}", summary="")
+        copy_pks = [
+            copy.pk
+            for copy in BookInstance.objects.bulk_create(
+                BookInstance(book=book) for _ in range(copies)
+            )
+        ]
+
+        totals: Counter[str] = Counter()
+        totals_lock = threading.Lock()
+        deadline = time.perf_counter() + seconds
+        checkout = self.naive_checkout if naive else self.checkout
+
+        def borrower(user):
+            rng = random.Random(user.pk)
+            counts: Counter[str] = Counter()
+            try:
+                while time.perf_counter() < deadline:
+                    pk = rng.choice(copy_pks)
+                    if not checkout(pk, user):
+                        counts["conflicts"] += 1
+                        # pause before retrying, as a client would after a 409
+                        time.sleep(0.01)
+                        continue
+                    counts["checkouts"] += 1
+                    # hold it for a moment, then give it back
+                    time.sleep(0.001)
+                    returned = BookInstance.objects.filter(borrower=user).transition(
+                        pk,
+                        BookInstance.LOAN_STATUS.OnLoan,
+                        status=BookInstance.LOAN_STATUS.Available,
+                        borrower=None,
+                        due_back=None,
+                    )
+                    counts["loans" if returned else "double loans"] += 1
+            finally:
+                connection.close()
+                with totals_lock:
+                    totals.update(counts)
+
+        workers = [threading.Thread(target=borrower, args=(user,)) for user in users]
+        start = time.perf_counter()
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        elapsed = time.perf_counter() - start
+
+        book.refresh_from_db()
+        on_loan = BookInstance.objects.filter(
+            book=book, status=BookInstance.LOAN_STATUS.OnLoan
+        ).count()
+        attempts = totals["checkouts"] + totals["conflicts"]
+        self.stdout.write(
+            f"{'naive' if naive else 'conditional'} checkout, {threads} threads, {copies} "
+            f"copies: {attempts / elapsed:.0f} attempts/s, {totals['loans'] / elapsed:.0f} "
+            f"completed loans/s, {totals['conflicts']} conflicts, {totals['double loans']} "
+            "double loans"
+        )
+        counters_ok = (book.copies_on_loan, book.copies_available) == (
+            on_loan,
+            copies - on_loan,
+        )
+        self.stdout.write(f"copy counters consistent: {counters_ok}")
+
+        with transaction.atomic():
+            BookInstance.objects.filter(book=book).delete()
+            book.delete()
+            User.objects.filter(pk__in=[user.pk for user in users]).delete()
+
+        if totals["double loans"] and not naive:
+            raise CommandError("Copies were lent twice")
+
+    def checkout(self, pk, user) -> bool:
+        return BookInstance.objects.transition(
+            pk,
+            BookInstance.LOAN_STATUS.Available,
+            status=BookInstance.LOAN_STATUS.OnLoan,
+            borrower=user,
+            due_back=datetime.date.today() + datetime.timedelta(weeks=3),
+        )
+
+    def naive_checkout(self, pk, user) -> bool:
+        copy = BookInstance.objects.get(pk=pk)
+        if copy.status != BookInstance.LOAN_STATUS.Available:
+            return False
+        copy.status = BookInstance.LOAN_STATUS.OnLoan
+        copy.borrower = user
+        copy.due_back = datetime.date.today() + datetime.timedelta(weeks=3)
+        copy.save()
+        return True
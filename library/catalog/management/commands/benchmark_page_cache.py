@@ -0,0 +1,141 @@
+import random
+import re
+import statistics
+import time
+from collections import Counter
+
+from django.core.cache import caches
+from django.core.management.base import BaseCommand, CommandError
+from django.test import Client
+from django.test.utils import override_settings
+from django.urls import Resolver404, resolve, reverse
+
+from catalog.management.commands.benchmark_search import percentile
+from catalog.management.seed import WORDS
+from catalog.models import Author, Book, BookInstance
+
+# request line of a combined-format (gunicorn/nginx) access log entry
+REQUEST_LINE = re.compile(r'"(?:GET|HEAD) (\S+) HTTP/[\d.]+"')
+# the pages catalog.page_cache serves to anonymous users, with their share of the synthetic mix used
+# without --log
+MIX = {
+    "catalog:index": 10,
+    "catalog:books": 30,
+    "catalog:book_detail": 45,
+    "catalog:authors": 15,
+}
+
+
+class Command(BaseCommand):
+    help = (
+        "Replays the anonymous catalog page requests of an access log (or a synthetic mix of "
+        "them) through the full middleware stack, once without and once with the page cache, "
+        "and reports throughput, latency and the hit rate. --loans-per-1000 lends and returns "
+        "copies during the replay, so cached pages get invalidated as in production. Run "
+        "against a scratch database."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--log", help="Access log to take the request paths from, in its order."
+        )
+        parser.add_argument(
+            "--requests", type=int, default=2000, help="Requests replayed (default 2000)."
+        )
+        parser.add_argument(
+            "--loans-per-1000",
+            type=int,
+            default=5,
+            help="Copies lent or returned per 1000 requests (default 5).",
+        )
+
+    def handle(self, *args, log: str | None, requests: int, loans_per_1000: int, **options):
+        paths = self.logged_paths(log) if log else self.synthetic_paths(requests)
+        paths = (paths * (requests // len(paths) + 1))[:requests] if paths else []
+        if not paths:
+            raise CommandError("No anonymous catalog page requests to replay")
+        pages = Counter(resolve(path.split("?")[0]).view_name for path in paths)
+        self.stdout.write(
+            f"{len(paths)} requests: "
+            + ", ".join(f"{count} {name}" for name, count in pages.most_common())
+        )
+
+        copies = list(
+            BookInstance.objects.filter(book__isnull=False).values_list("pk", flat=True)[:200]
+        )
+        for label, backend in (
+            ("no page cache", "django.core.cache.backends.dummy.DummyCache"),
+            ("page cache", "django.core.cache.backends.locmem.LocMemCache"),
+        ):
+            # as many entries as Redis would hold, rather than locmem's default 300
+            pages_cache = {
+                "BACKEND": backend,
+                "LOCATION": "benchmark-pages",
+                "OPTIONS": {"MAX_ENTRIES": 1_000_000},
+            }
+            with override_settings(
+                CACHES={
+                    "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"},
+                    "fragments": {"BACKEND": "django.core.cache.backends.dummy.DummyCache"},
+                    "pages": pages_cache,
+                }
+            ):
+                caches["pages"].clear()
+                self.replay(label, paths, copies, loans_per_1000)
+
+    def replay(self, label: str, paths: list[str], copies: list, loans_per_1000: int) -> None:
+        client = Client(HTTP_HOST="127.0.0.1")
+        rng = random.Random(1)
+        hits, latencies = 0, []
+        start = time.perf_counter()
+        for path in paths:
+            if copies and rng.random() < loans_per_1000 / 1000:
+                self.lend_or_return(rng.choice(copies))
+            request_start = time.perf_counter()
+            response = client.get(path, secure=True)
+            latencies.append((time.perf_counter() - request_start) * 1000)
+            hits += response.get("X-Page-Cache") == "hit"
+        elapsed = time.perf_counter() - start
+        self.stdout.write(
+            f"{label:>14}: {len(paths) / elapsed:7.1f} req/s"
+            f"  p50 {statistics.median(latencies):7.2f} ms"
+            f"  p95 {percentile(latencies, 95):7.2f} ms"
+            f"  hits {hits / len(paths):6.1%}"
+        )
+
+    def lend_or_return(self, pk) -> None:
+        # a checkout or return as the checkout view makes it, which invalidates the book's pages
+        Available, OnLoan = BookInstance.LOAN_STATUS.Available, BookInstance.LOAN_STATUS.OnLoan
+        if not BookInstance.objects.transition(pk, Available, status=OnLoan):
+            BookInstance.objects.transition(pk, OnLoan, status=Available)
+
+    def logged_paths(self, log: str) -> list[str]:
+        paths = []
+        with open(log) as lines:
+            for line in lines:
+                if not (match := REQUEST_LINE.search(line)):
+                    continue
+                try:
+                    view = resolve(match[1].split("?")[0])
+                except Resolver404:
+                    continue
+                if view.view_name in MIX:
+                    paths.append(match[1])
+        return paths
+
+    def synthetic_paths(self, requests: int) -> list[str]:
+        """Popular books (skewed towards a few), list pages and some searches."""
+        rng = random.Random(1)
+        book_ids = list(Book.objects.order_by("pk").values_list("pk", flat=True)[:1000])
+        if not book_ids or not Author.objects.exists():
+            raise CommandError("No books to browse; seed the catalog first")
+        popularity = [1 / rank for rank in range(1, len(book_ids) + 1)]
+        paths = []
+        for name in rng.choices(list(MIX), weights=list(MIX.values()), k=requests):
+            if name == "catalog:book_detail":
+                paths.append(reverse(name, args=[rng.choices(book_ids, popularity)[0]]))
+            elif name != "catalog:index" and rng.random() < 0.2:
+                paths.append(reverse(name) + f"?search={rng.choice(WORDS[:20])}")
+            else:
+                paths.append(reverse(name))
+        return paths
@@ -0,0 +1,92 @@
+import random
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.db.models import Q
+
+from catalog.management.seed import WORDS, seed_catalog
+from catalog.models import Author, Book
+from catalog.search import FUZZY_LIMIT, fuzzy_authors, fuzzy_books, search_books
+
+
+def percentile(samples: list[float], pct: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, round(pct / 100 * (len(ordered) - 1)))]
+
+
+class Command(BaseCommand):
+    help = (
+        "Compares page-sized book search latency of the GIN-indexed full-text and trigram (fuzzy) "
+        "searches against icontains scans. Run against a scratch database, e.g. seeded with "
+        "--seed 1000000."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--seed",
+            type=int,
+            default=0,
+            help="Insert this many synthetic books before benchmarking.",
+        )
+        parser.add_argument(
+            "--queries", type=int, default=200, help="Queries per search path."
+        )
+        parser.add_argument(
+            "--page-size", type=int, default=5, help="Results fetched per query."
+        )
+
+    def handle(self, *args, seed: int, queries: int, page_size: int, **options):
+        if seed:
+            seed_catalog(seed, stdout=self.stdout)
+            with connection.cursor() as cursor:
+                cursor.execute("ANALYZE catalog_book, catalog_author")
+
+        rng = random.Random(1)
+        terms = [" ".join(rng.sample(WORDS, rng.randint(1, 2))) for _ in range(queries)]
+        self.stdout.write(f"{Book.objects.count()} books, {queries} queries per path")
+
+        paths = {
+            "icontains": lambda term: Book.objects.filter(title__icontains=term).order_by(
+                "pk"
+            ),
+            "full-text": lambda term: search_books(Book.objects.all(), term),
+        }
+        # misspelled author names (one dropped letter) for the typo-tolerant paths
+        typos = []
+        for _ in range(queries):
+            word = rng.choice(WORDS)
+            drop = rng.randrange(len(word))
+            typos.append(word[:drop] + word[drop + 1 :])
+        fuzzy_paths = {
+            "author icontains": lambda term: list(
+                Author.objects.filter(
+                    Q(last_name__icontains=term) | Q(first_name__icontains=term)
+                )[:FUZZY_LIMIT]
+            ),
+            "author fuzzy": lambda term: list(fuzzy_authors(term)),
+            "title fuzzy": lambda term: list(fuzzy_books(Book.objects.all(), term)),
+        }
+
+        for name, search in paths.items():
+            # count + page, which is what a paginated list view runs
+            self.report(
+                name,
+                terms,
+                lambda term: (search(term).count(), list(search(term)[:page_size])),
+            )
+        for name, search in fuzzy_paths.items():
+            self.report(name, typos, search)
+
+    def report(self, name, terms, run) -> None:
+        latencies = []
+        for term in terms:
+            start = time.perf_counter()
+            run(term)
+            latencies.append((time.perf_counter() - start) * 1000)
+        self.stdout.write(
+            f"{name:>16}: p50 {statistics.median(latencies):8.2f} ms"
+            f"  p95 {percentile(latencies, 95):8.2f} ms"
+            f"  max {max(latencies):8.2f} ms"
+        )
@@ -0,0 +1,126 @@
+import asyncio
+import statistics
+import time
+from urllib.parse import urlsplit
+
+from django.core.management.base import BaseCommand, CommandError
+
+from catalog.management.commands.benchmark_search import percentile
+
+
+class Command(BaseCommand):
+    help = (
+        "Measures how a running server (e.g. gunicorn started with GUNICORN_SERVER=wsgi, then "
+        "with GUNICORN_SERVER=asgi, and the same number of workers) serves catalog page requests "
+        "while slow clients hold connections open: --slow-clients connections trickle their "
+        "request headers in over --slow-seconds, as clients on bad networks do, while "
+        "--concurrency clients make --requests requests as fast as they're answered. Reports "
+        "the fast requests' throughput and latency, and how many slow clients were served."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("url", help="Page to request, e.g. http://127.0.0.1:8000/catalog/")
+        parser.add_argument(
+            "--requests", type=int, default=500, help="Fast requests made (default 500)."
+        )
+        parser.add_argument(
+            "--concurrency", type=int, default=10, help="Concurrent fast clients (default 10)."
+        )
+        parser.add_argument(
+            "--slow-clients", type=int, default=50, help="Slow clients (default 50)."
+        )
+        parser.add_argument(
+            "--slow-seconds",
+            type=float,
+            default=10,
+            help="Seconds slow clients take to send their request (default 10).",
+        )
+        parser.add_argument(
+            "--timeout", type=float, default=30, help="Seconds before a request fails."
+        )
+
+    def handle(self, *args, url: str, **options):
+        parts = urlsplit(url)
+        if parts.scheme != "http" or not parts.hostname:
+            raise CommandError("Only http:// URLs are supported")
+        self.host, self.port = parts.hostname, parts.port or 80
+        self.path = parts.path + (f"?{parts.query}" if parts.query else "") or "/"
+        asyncio.run(self.run(**options))
+
+    def request_head(self) -> list[bytes]:
+        # as nginx forwards it, so the site doesn't redirect to HTTPS
+        return [
+            f"GET {self.path} HTTP/1.1\r\n".encode(),
+            f"Host: {self.host}\r\n".encode(),
+            b"X-Forwarded-Proto: https\r\n",
+            b"Connection: close\r\n",
+            b"\r\n",
+        ]
+
+    async def fetch(self, delay: float = 0) -> int:
+        """Status of one request, sending its lines `delay` seconds apart."""
+        reader, writer = await asyncio.open_connection(self.host, self.port)
+        try:
+            for line in self.request_head():
+                writer.write(line)
+                await writer.drain()
+                if delay:
+                    await asyncio.sleep(delay)
+            status_line = await reader.readline()
+            await reader.read()
+            return int(status_line.split()[1])
+        finally:
+            writer.close()
+
+    async def run(
+        self,
+        requests: int,
+        concurrency: int,
+        slow_clients: int,
+        slow_seconds: float,
+        timeout: float,
+        **options,
+    ) -> None:
+        latencies: list[float] = []
+        failures = 0
+        remaining = requests
+
+        async def fast_client():
+            nonlocal remaining, failures
+            while remaining > 0:
+                remaining -= 1
+                start = time.perf_counter()
+                try:
+                    status = await asyncio.wait_for(self.fetch(), timeout)
+                except (OSError, asyncio.TimeoutError, IndexError, ValueError):
+                    status = 0
+                if status == 200:
+                    latencies.append((time.perf_counter() - start) * 1000)
+                else:
+                    failures += 1
+
+        async def slow_client() -> bool:
+            try:
+                delay = slow_seconds / len(self.request_head())
+                return await asyncio.wait_for(self.fetch(delay), slow_seconds + timeout) == 200
+            except (OSError, asyncio.TimeoutError, IndexError, ValueError):
+                return False
+
+        slow = [asyncio.create_task(slow_client()) for _ in range(slow_clients)]
+        # let the slow clients connect first
+        await asyncio.sleep(0.5)
+        start = time.perf_counter()
+        await asyncio.gather(*(fast_client() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+        served = sum(await asyncio.gather(*slow))
+
+        if not latencies:
+            raise CommandError(f"All {failures} fast requests failed")
+        self.stdout.write(
+            f"fast: {len(latencies) / elapsed:7.1f} req/s"
+            f"  p50 {statistics.median(latencies):8.1f} ms"
+            f"  p95 {percentile(latencies, 95):8.1f} ms"
+            f"  max {max(latencies):8.1f} ms"
+            f"  failed {failures}"
+        )
+        self.stdout.write(f"slow: {served}/{slow_clients} served")
@@ -0,0 +1,96 @@
+import json
+from collections import defaultdict
+from dataclasses import asdict
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.test import Client
+from django.utils import timezone
+
+from catalog.management.query_budget import (
+    Measurement,
+    fixture_urls,
+    growing,
+    measure,
+    seed_fixture,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Requests every catalog and core page for fixtures with each of --sizes related rows "
+        "(books per author, copies per book, loans per borrower), records the number of SQL "
+        "queries and the database time of each, and writes them to a JSON report. Exits with an "
+        "error if a page's query count grows with the data. The fixtures are rolled back; run "
+        "against a scratch database."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--sizes",
+            type=int,
+            nargs="+",
+            default=[10, 1000, 100000],
+            help="Related rows per fixture object (default 10 1000 100000).",
+        )
+        parser.add_argument(
+            "--report",
+            default="query-budget.json",
+            help="Where to write the JSON report (default query-budget.json).",
+        )
+        parser.add_argument(
+            "--ignore",
+            action="append",
+            default=[],
+            metavar="URL_NAME",
+            help="Page (e.g. catalog:book_detail) allowed to grow, still reported; may be "
+            "repeated.",
+        )
+
+    def handle(self, *args, sizes: list[int], report: str, ignore: list[str], **options):
+        results: dict[str, dict[int, Measurement]] = defaultdict(dict)
+        for size in sorted(set(sizes)):
+            with transaction.atomic():
+                fixture = seed_fixture(size)
+                client = Client(HTTP_HOST="127.0.0.1")
+                for label, path in fixture_urls(fixture).items():
+                    # logged in afresh each time, in case a page (e.g. logout) ended the session
+                    client.force_login(fixture.user)  # type: ignore
+                    results[label][size] = measure(client, label.split()[0], path)
+                transaction.set_rollback(True)
+            self.stdout.write(
+                f"{size} rows: "
+                f"{sum(by_size[size].queries for by_size in results.values())} queries, "
+                f"{sum(by_size[size].db_ms for by_size in results.values()):.1f} ms over "
+                f"{len(results)} pages"
+            )
+
+        grown = growing(results)
+        Path(report).write_text(
+            json.dumps(
+                {
+                    "generated_at": timezone.now().isoformat(),
+                    "sizes": sorted(set(sizes)),
+                    "pages": {
+                        label: {str(size): asdict(result) for size, result in by_size.items()}
+                        for label, by_size in sorted(results.items())
+                    },
+                    "growing": grown,
+                },
+                indent=2,
+            )
+        )
+        self.stdout.write(f"Wrote {report}")
+
+        for label, counts in grown.items():
+            style = self.style.NOTICE if label.split()[0] in ignore else self.style.ERROR
+            self.stdout.write(
+                style(
+                    f"{label}: "
+                    + ", ".join(f"{count} queries at {size}" for size, count in counts.items())
+                )
+            )
+        if failing := [label for label in grown if label.split()[0] not in ignore]:
+            raise CommandError(f"Query counts grow with the data on {len(failing)} page(s)")
+        self.stdout.write(self.style.SUCCESS("No page's query count grows with the data"))
@@ -0,0 +1,48 @@
+import os
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from catalog.exports import EXPORT_CONTENT_TYPES, EXPORTS, snapshot_path, stream_export
+
+
+class Command(BaseCommand):
+    help = (
+        "Writes full catalog exports to EXPORT_SNAPSHOT_ROOT, which the export endpoints then serve "
+        "(through nginx when EXPORT_SNAPSHOT_ACCEL_PREFIX is set) instead of querying the "
+        "database on every download. Meant to be run on a schedule."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "names",
+            nargs="*",
+            help=f"Exports to write, of {', '.join(EXPORTS)} (default: all).",
+        )
+        parser.add_argument(
+            "--format",
+            dest="export_formats",
+            action="append",
+            choices=list(EXPORT_CONTENT_TYPES),
+            help="Format to write, may be repeated (default: all).",
+        )
+
+    def handle(self, *args, names: list[str], export_formats: list[str] | None, **options):
+        if unknown := set(names) - EXPORTS.keys():
+            raise CommandError(f"Unknown exports: {', '.join(sorted(unknown))}")
+        for name in names or EXPORTS:
+            for export_format in export_formats or EXPORT_CONTENT_TYPES:
+                path = snapshot_path(name, export_format)
+                path.parent.mkdir(parents=True, exist_ok=True)
+                start = time.perf_counter()
+                # written next to the snapshot and renamed over it, so downloads never see a
+                # partial file
+                partial = path.with_name(f".{path.name}.partial")
+                with partial.open("wb") as file:
+                    for chunk in stream_export(name, export_format):
+                        file.write(chunk)
+                os.replace(partial, path)
+                self.stdout.write(
+                    f"Wrote {path} ({path.stat().st_size} bytes) in "
+                    f"{time.perf_counter() - start:.1f} s"
+                )
@@ -0,0 +1,92 @@
+from itertools import batched
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, Q
+from django.utils import timezone
+
+from catalog.models import (
+    COPY_STATUS_COUNTERS,
+    Author,
+    Book,
+    BookInstance,
+    LibraryStats,
+)
+
+COUNTER_FIELDS = ["copies_total", *COPY_STATUS_COUNTERS.values()]
+
+
+def count_copies() -> dict[str, Count]:
+    """Aggregates computing every copy counter over a book instance queryset."""
+    aggregates = {"copies_total": Count("pk")}
+    for status, field in COPY_STATUS_COUNTERS.items():
+        aggregates[field] = Count("pk", filter=Q(status=status))
+    return aggregates
+
+
+class Command(BaseCommand):
+    help = (
+        "Rebuilds the denormalized copy counters on books and the library stats rows from the "
+        "book instance table, in batches of books."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=1000,
+            help="Number of books recounted per transaction (default 1000).",
+        )
+
+    def handle(self, *args, batch_size: int, **options):
+        book_pks = Book.objects.order_by("pk").values_list("pk", flat=True)
+        fixed = 0
+        for pks in batched(book_pks.iterator(chunk_size=batch_size), batch_size):
+            fixed += self.reconcile_books(pks)
+        self.reconcile_library_stats()
+        self.stdout.write(self.style.SUCCESS(f"Reconciled copy counts ({fixed} books fixed)"))
+
+    @transaction.atomic
+    def reconcile_books(self, pks) -> int:
+        # locking the books makes concurrent copy writes wait to apply their deltas until after the
+        # recount, so neither side's change is lost
+        books = list(
+            Book.objects.select_for_update().filter(pk__in=pks).only(*COUNTER_FIELDS)
+        )
+        counts = {
+            row.pop("book_id"): row
+            for row in BookInstance.objects.filter(book_id__in=pks)
+            .order_by()
+            .values("book_id")
+            .annotate(**count_copies())
+        }
+        stale = []
+        now = timezone.now()
+        for book in books:
+            expected = counts.get(book.pk, {})
+            if any(getattr(book, f) != expected.get(f, 0) for f in COUNTER_FIELDS):
+                for field in COUNTER_FIELDS:
+                    setattr(book, field, expected.get(field, 0))
+                book.updated_at = now
+                stale.append(book)
+        Book.objects.bulk_update(stale, [*COUNTER_FIELDS, "updated_at"])
+        return len(stale)
+
+    @transaction.atomic
+    def reconcile_library_stats(self) -> None:
+        # every slot is locked, so concurrent counter writes wait for the recount, which goes in
+        # the first one with the rest zeroed
+        LibraryStats.objects.bulk_create(
+            [LibraryStats(pk=slot) for slot in range(1, LibraryStats.SLOTS + 1)],
+            ignore_conflicts=True,
+        )
+        slots = list(LibraryStats.objects.select_for_update().order_by("pk"))
+        totals = {
+            **BookInstance.objects.aggregate(**count_copies()),
+            "num_books": Book.objects.count(),
+            "num_authors": Author.objects.count(),
+        }
+        for stats in slots:
+            for field in LibraryStats.counter_fields():
+                setattr(stats, field, totals[field] if stats is slots[0] else 0)
+        LibraryStats.objects.bulk_update(slots, LibraryStats.counter_fields())
@@ -0,0 +1,38 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from catalog.management.smtp_stub import SMTPStub
+
+
+class Command(BaseCommand):
+    help = (
+        "Runs a local SMTP server that accepts every message, reporting how many it "
+        "received, so the mailers can be tried out (e.g. send_loan_reminders --smtp "
+        "127.0.0.1:1025) without sending real email."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--host", default="127.0.0.1")
+        parser.add_argument("--port", type=int, default=1025)
+        parser.add_argument(
+            "--latency",
+            type=float,
+            default=0,
+            help="Seconds to wait before accepting each message, to mimic a remote server.",
+        )
+
+    def handle(self, *args, host: str, port: int, latency: float, **options):
+        with SMTPStub(host, port, latency) as stub:
+            self.stdout.write(f"SMTP stub listening on {host}:{stub.port}, Ctrl-C to stop")
+            received = 0
+            try:
+                while True:
+                    time.sleep(1)
+                    if len(stub.messages) != received:
+                        received = len(stub.messages)
+                        self.stdout.write(
+                            f"{received} messages received over {stub.connections} connections"
+                        )
+            except KeyboardInterrupt:
+                pass
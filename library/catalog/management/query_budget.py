@@ -0,0 +1,182 @@
+"""Query counts and database time of every catalog and core page at several data sizes, to catch
+pages whose number of queries grows with the data (N+1 queries that auto_prefetch doesn't fold
+into a prefetch)."""
+
+import datetime
+import uuid
+from collections.abc import Iterator
+from dataclasses import dataclass
+from itertools import batched
+
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.db.models import F
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import URLPattern, URLResolver, get_resolver, reverse
+from django.urls.converters import IntConverter, UUIDConverter
+
+from catalog.models import Author, Book, BookInstance, Genre, Language, LibraryStats
+from catalog.search import refresh_search_vectors
+
+# URLconfs whose pages are measured
+URLCONFS = ("catalog.urls", "core.urls")
+BATCH_SIZE = 5000
+# word in every fixture title, for the search pages
+SEARCH_TERM = "budgetword"
+# values for the other URL arguments
+FIXED_KWARGS = {"name": "loans", "export_format": "csv"}
+# pages also measured with these query strings
+VARIANTS = {
+    "catalog:books": f"?search={SEARCH_TERM}",
+    "catalog:authors": "?search=Budget",
+    "catalog:author_lookup": "?q=Budget",
+    "catalog:all_borrowed": f"?search={SEARCH_TERM}",
+    "catalog:export": "?live",
+}
+
+
+@dataclass
+class Fixture:
+    """The objects each page is requested for, with `size` related rows apiece."""
+
+    size: int
+    user: object
+    author: Author
+    book: Book
+    copy: BookInstance
+
+
+@dataclass
+class Measurement:
+    name: str
+    path: str
+    status: int
+    queries: int
+    db_ms: float
+
+
+def seed_fixture(size: int) -> Fixture:
+    """An author with `size` books (each in two genres) and a book with `size` copies, half of
+    them lent to (and some overdue for) a new superuser, who can see every page."""
+    run = uuid.uuid4().hex[:6]
+    user = get_user_model().objects.create_superuser(  # type: ignore
+        username=f"budget-{run}", email=f"budget-{run}@example.com", password=None
+    )
+    genres = [Genre.objects.create(name=f"Budget {run} {i}") for i in range(2)]
+    language = Language.objects.create(name=f"Budget {run}")
+    author = Author.objects.create(first_name="Budget", last_name=f"Author {run}")
+    LibraryStats.update_counters(num_authors=F("num_authors") + 1)
+
+    Genres = Book.genre.through
+    books: list[Book] = []
+    for chunk in batched(range(size), BATCH_SIZE):
+        created = Book.objects.bulk_create(
+            Book(
+                title=f"{SEARCH_TERM} {run} {i}",
+                summary="",
+                isbn=f"{run}{i:07d}",
+                author=author,
+                language=language,
+            )
+            for i in chunk
+        )
+        Genres.objects.bulk_create(
+            Genres(book_id=book.pk, genre_id=genre.pk) for book in created for genre in genres
+        )
+        books += created
+    refresh_search_vectors(Book.objects.filter(author=author))
+
+    book = books[0]
+    today = datetime.date.today()
+    for chunk in batched(range(size), BATCH_SIZE):
+        # counted bulk_create, so the book's copy counters stay right
+        BookInstance.objects.bulk_create(
+            (
+                BookInstance(
+                    book=book,
+                    status=BookInstance.LOAN_STATUS.OnLoan,
+                    borrower=user,
+                    due_back=today + datetime.timedelta(days=i % 20 - 10),
+                )
+                if i % 2
+                else BookInstance(book=book)
+            )
+            for i in chunk
+        )
+    copy = BookInstance.objects.filter(book=book, borrower=user).first()
+    return Fixture(size, user, author, book, copy)  # type: ignore
+
+
+def url_patterns(patterns=None, namespace: str = "") -> Iterator[tuple[str, URLPattern]]:
+    """(namespaced name, pattern) of every named URL in URLCONFS."""
+    if patterns is None:
+        for resolver in get_resolver().url_patterns:
+            # include() has already imported the URLconf module
+            urlconf = getattr(resolver, "urlconf_name", None)
+            if getattr(urlconf, "__name__", urlconf) in URLCONFS:
+                yield from url_patterns(resolver.url_patterns, resolver.namespace or "")
+        return
+    for pattern in patterns:
+        if isinstance(pattern, URLResolver):
+            yield from url_patterns(pattern.url_patterns, pattern.namespace or namespace)
+        elif pattern.name:
+            yield (f"{namespace}:{pattern.name}" if namespace else pattern.name), pattern
+
+
+def fixture_urls(fixture: Fixture) -> dict[str, str]:
+    """Label -> path of every page in URLCONFS (and its VARIANTS) for the fixture's objects."""
+    urls = {}
+    for name, pattern in url_patterns():
+        if path := fixture_url(name, pattern, fixture):
+            urls[name] = path
+            if name in VARIANTS:
+                urls[f"{name} {VARIANTS[name]}"] = path + VARIANTS[name]
+    return urls
+
+
+def fixture_url(name: str, pattern: URLPattern, fixture: Fixture) -> str | None:
+    """Path of the page `name` for the fixture's objects, or None if its arguments can't be
+    filled in (e.g. the keys in account email links)."""
+    kwargs = {}
+    converters = getattr(pattern.pattern, "converters", {})
+    for kwarg in pattern.pattern.regex.groupindex:
+        converter = converters.get(kwarg)
+        if kwarg == "pk" and isinstance(converter, IntConverter):
+            kwargs[kwarg] = fixture.author.pk if "author" in name else fixture.book.pk
+        elif kwarg == "pk" and isinstance(converter, UUIDConverter):
+            kwargs[kwarg] = fixture.copy.pk
+        elif kwarg in FIXED_KWARGS:
+            kwargs[kwarg] = FIXED_KWARGS[kwarg]
+        else:
+            return None
+    return reverse(name, kwargs=kwargs)
+
+
+def measure(client: Client, name: str, path: str) -> Measurement:
+    with CaptureQueriesContext(connection) as captured:
+        response = client.get(path, secure=True)
+        if response.streaming:
+            # streamed responses query as they're consumed
+            for _ in response.streaming_content:  # type: ignore
+                pass
+    return Measurement(
+        name,
+        path,
+        response.status_code,
+        len(captured.captured_queries),
+        sum(float(query["time"]) for query in captured.captured_queries) * 1000,
+    )
+
+
+def growing(results: dict[str, dict[int, Measurement]]) -> dict[str, dict[int, int]]:
+    """Pages whose query count at some size exceeds their count at the smallest size, with their
+    counts by size."""
+    grown = {}
+    for name, by_size in results.items():
+        counts = {size: by_size[size].queries for size in sorted(by_size)}
+        smallest = next(iter(counts.values()))
+        if any(count > smallest for count in counts.values()):
+            grown[name] = counts
+    return grown
+
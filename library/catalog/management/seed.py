@@ -0,0 +1,107 @@
+"""Synthetic catalog data for the benchmark/audit management commands (never run against prod)."""
+
+import datetime
+import random
+import uuid
+from collections.abc import Sequence
+from itertools import batched
+
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.db.models import F
+
+from catalog.models import (
+    Author,
+    Book,
+    BookInstance,
+    Genre,
+    Language,
+    LibraryStats,
+    bulk_created,
+)
+from catalog.search import add_author_names, refresh_search_vectors
+
+# ~8k pronounceable pseudo-words, so matches are about as selective as real catalog text (a
+# small dictionary would make every term match most of the table)
+SYLLABLES = "ka lo mi ne ru sa te vi do ba fe gu ha ji ko li mo nu pa ri".split()
+WORDS = [a + b + c for a in SYLLABLES for b in SYLLABLES for c in SYLLABLES]
+
+FIRST_NAMES = "Ada Jorge Toni Haruki Chimamanda Gabriel Ursula Italo Octavia Orhan Zadie".split()
+
+
+def words(rng: random.Random, count: int) -> str:
+    return " ".join(rng.choices(WORDS, k=count))
+
+
+def seed_copy(rng: random.Random, book: Book, borrowers: Sequence) -> BookInstance:
+    status = rng.choice(BookInstance.LOAN_STATUS.values)
+    if status != BookInstance.LOAN_STATUS.OnLoan:
+        return BookInstance(book=book, status=status)
+    return BookInstance(
+        book=book,
+        status=status,
+        borrower=rng.choice(borrowers) if borrowers else None,
+        due_back=datetime.date.today() + datetime.timedelta(days=rng.randint(-30, 30)),
+    )
+
+
+def seed_catalog(
+    num_books: int,
+    copies_per_book: int = 0,
+    num_authors: int | None = None,
+    batch_size: int = 5000,
+    seed: int = 0,
+    borrowers: Sequence = (),
+    stdout=None,
+) -> None:
+    """Bulk inserts `num_books` books (plus authors, genres and copies) in batches, keeping the
+    search vectors and copy counters correct. Copies that end up on loan are lent to one of
+    `borrowers` (if any)."""
+    rng = random.Random(seed)
+    run = uuid.uuid4().hex[:6]
+
+    genres = [Genre.objects.get_or_create(name=f"Seed {word}")[0] for word in WORDS[:12]]
+    language, _ = Language.objects.get_or_create(name="Seedish")
+
+    num_authors = num_authors or max(1, num_books // 10)
+    authors = []
+    for chunk in batched(range(num_authors), batch_size):
+        authors += Author.objects.bulk_create(
+            Author(
+                first_name=rng.choice(FIRST_NAMES),
+                last_name=rng.choice(WORDS).title(),
+            )
+            for _ in chunk
+        )
+    add_author_names(authors)
+    LibraryStats.update_counters(num_authors=F("num_authors") + len(authors))
+    bulk_created.send(Author, using=DEFAULT_DB_ALIAS)
+
+    Genres = Book.genre.through
+    for done, chunk in enumerate(batched(range(num_books), batch_size), start=1):
+        with transaction.atomic():
+            books = Book.objects.bulk_create(
+                Book(
+                    title=words(rng, rng.randint(1, 5)).title(),
+                    summary=words(rng, 40),
+                    # unique per run so bulk inserts never trip the ISBN unique index
+                    isbn=f"{run}{i:07d}",
+                    author=rng.choice(authors),
+                    language=language,
+                )
+                for i in chunk
+            )
+            Genres.objects.bulk_create(
+                Genres(book_id=book.pk, genre_id=genre.pk)
+                for book in books
+                for genre in rng.sample(genres, 2)
+            )
+            BookInstance.objects.bulk_create(
+                seed_copy(rng, book, borrowers)
+                for book in books
+                for _ in range(copies_per_book)
+            )
+            refresh_search_vectors(Book.objects.filter(pk__in=[b.pk for b in books]))
+            LibraryStats.update_counters(num_books=F("num_books") + len(books))
+            bulk_created.send(Book, using=DEFAULT_DB_ALIAS)
+        if stdout:
+            stdout.write(f"seeded {min(done * batch_size, num_books)}/{num_books} books")
@@ -0,0 +1,90 @@
+"""Minimal local SMTP server that accepts and keeps every message, standing in for SendGrid when
+testing or benchmarking the mailers (the standard library's smtpd is gone as of Python 3.12)."""
+
+import socketserver
+import threading
+import time
+from email import message_from_bytes
+from email.message import Message
+
+
+class _SMTPHandler(socketserver.StreamRequestHandler):
+    server: "SMTPStub"
+
+    def reply(self, line: str) -> None:
+        self.wfile.write(f"{line}\r\n".encode())
+
+    def handle(self):
+        self.reply("220 localhost SMTP stub")
+        sender, recipients = None, []
+        while line := self.rfile.readline():
+            command = line.decode("ascii", "replace").strip()
+            verb = command[:4].upper()
+            if verb in ("HELO", "EHLO"):
+                self.reply("250 localhost")
+            elif verb == "MAIL":
+                sender, recipients = command.partition(":")[2].strip(), []
+                self.reply("250 OK")
+            elif verb == "RCPT":
+                recipients.append(command.partition(":")[2].strip())
+                self.reply("250 OK")
+            elif verb == "DATA":
+                self.reply("354 End data with <CR><LF>.<CR><LF>")
+                self.server.receive(sender, recipients, self.read_data())
+                self.reply("250 OK")
+            elif verb == "RSET":
+                sender, recipients = None, []
+                self.reply("250 OK")
+            elif verb == "NOOP":
+                self.reply("250 OK")
+            elif verb == "QUIT":
+                self.reply("221 Bye")
+                return
+            else:
+                self.reply("502 Command not implemented")
+
+    def read_data(self) -> bytes:
+        lines = []
+        while (line := self.rfile.readline()) not in (b".\r\n", b".\n", b""):
+            # undo dot-stuffing
+            lines.append(line[1:] if line.startswith(b"..") else line)
+        return b"".join(lines)
+
+
+class SMTPStub(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    """SMTP server on a background thread, collecting messages in `messages`. Use as a context
+    manager; port 0 picks a free port (see `port`). `latency` seconds are slept before accepting
+    each message, to mimic a remote server."""
+
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, latency: float = 0):
+        super().__init__((host, port), _SMTPHandler)
+        self.latency = latency
+        self.messages: list[Message] = []
+        self.connections = 0
+        self._lock = threading.Lock()
+
+    @property
+    def port(self) -> int:
+        return self.server_address[1]
+
+    def process_request(self, request, client_address):
+        with self._lock:
+            self.connections += 1
+        super().process_request(request, client_address)
+
+    def receive(self, sender: str | None, recipients: list[str], data: bytes) -> None:
+        if self.latency:
+            time.sleep(self.latency)
+        with self._lock:
+            self.messages.append(message_from_bytes(data))
+
+    def __enter__(self) -> "SMTPStub":
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.shutdown()
+        self.server_close()
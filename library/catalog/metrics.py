@@ -0,0 +1,27 @@
+"""Latency of the catalog's hot paths, exported to Prometheus.
+
+Labels only take values from the code (operations, outcomes and kinds of search), never from the
+request, so each histogram has a handful of series."""
+
+import time
+
+from prometheus_client import Histogram
+
+loan_seconds = Histogram(
+    "catalog_loan_seconds",
+    "Time taken to check out, return or renew a copy (its update and the counters and "
+    "invalidation it triggers).",
+    ["operation", "outcome"],
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5),
+)
+search_seconds = Histogram(
+    "catalog_search_seconds",
+    "Time taken to find and fetch a page of search results (not to render it).",
+    ["target", "match"],
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5),
+)
+
+
+def observe_since(histogram: Histogram, start: float, *labels: str) -> None:
+    """Observes the time since `start` (a time.perf_counter()) against `labels`."""
+    histogram.labels(*labels).observe(time.perf_counter() - start)
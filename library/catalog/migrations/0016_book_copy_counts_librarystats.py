@@ -0,0 +1,92 @@
+# Generated by Django 5.1.15 on 2026-10-18 19:32
+
+from django.db import migrations, models
+from django.db.models import Count, Q
+
+STATUS_COUNTERS = {
+    "a": "copies_available",
+    "o": "copies_on_loan",
+    "r": "copies_reserved",
+    "m": "copies_maintenance",
+}
+
+
+def backfill_copy_counts(apps, schema_editor):
+    # fine for existing small databases; large ones should run the reconcile_copy_counts command
+    Author = apps.get_model("catalog", "Author")
+    Book = apps.get_model("catalog", "Book")
+    BookInstance = apps.get_model("catalog", "BookInstance")
+    LibraryStats = apps.get_model("catalog", "LibraryStats")
+
+    aggregates = {"copies_total": Count("pk")}
+    for status, field in STATUS_COUNTERS.items():
+        aggregates[field] = Count("pk", filter=Q(status=status))
+
+    for row in (
+        BookInstance.objects.exclude(book=None)
+        .order_by()
+        .values("book_id")
+        .annotate(**aggregates)
+    ):
+        Book.objects.filter(pk=row.pop("book_id")).update(**row)
+
+    LibraryStats.objects.update_or_create(
+        pk=1,
+        defaults={
+            **BookInstance.objects.aggregate(**aggregates),
+            "num_books": Book.objects.count(),
+            "num_authors": Author.objects.count(),
+        },
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0015_alter_book_isbn'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LibraryStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('copies_total', models.IntegerField(default=0, editable=False)),
+                ('copies_available', models.IntegerField(default=0, editable=False)),
+                ('copies_on_loan', models.IntegerField(default=0, editable=False)),
+                ('copies_reserved', models.IntegerField(default=0, editable=False)),
+                ('copies_maintenance', models.IntegerField(default=0, editable=False)),
+                ('num_books', models.IntegerField(default=0, editable=False)),
+                ('num_authors', models.IntegerField(default=0, editable=False)),
+            ],
+            options={
+                'verbose_name_plural': 'library stats',
+            },
+        ),
+        migrations.AddField(
+            model_name='book',
+            name='copies_available',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='book',
+            name='copies_maintenance',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='book',
+            name='copies_on_loan',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='book',
+            name='copies_reserved',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='book',
+            name='copies_total',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(backfill_copy_counts, reverse_code=migrations.RunPython.noop),
+    ]
@@ -0,0 +1,44 @@
+# Generated by Django 5.1.15 on 2026-10-18 19:34
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.db import migrations
+
+# same document as catalog.search.book_search_vector(), written out in SQL so the migration doesn't
+# depend on app code
+BACKFILL_SEARCH_VECTORS = """
+UPDATE catalog_book AS book SET search_vector =
+    setweight(to_tsvector('english', coalesce(book.title, '')), 'A')
+    || setweight(to_tsvector('english', coalesce((
+        SELECT author.first_name || ' ' || author.last_name
+        FROM catalog_author AS author WHERE author.id = book.author_id
+    ), '')), 'A')
+    || setweight(to_tsvector('english', coalesce((
+        SELECT string_agg(genre.name, ' ')
+        FROM catalog_book_genre AS book_genre
+        JOIN catalog_genre AS genre ON genre.id = book_genre.genre_id
+        WHERE book_genre.book_id = book.id
+    ), '')), 'B')
+    || setweight(to_tsvector('english', coalesce(book.summary, '')), 'C')
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0016_book_copy_counts_librarystats'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='book',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        # backfill before building the index so it's built once rather than updated per row
+        migrations.RunSQL(BACKFILL_SEARCH_VECTORS, reverse_sql=migrations.RunSQL.noop),
+        migrations.AddIndex(
+            model_name='book',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_vector'], name='book_search_vector_gin'),
+        ),
+    ]
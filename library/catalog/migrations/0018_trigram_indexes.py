@@ -0,0 +1,63 @@
+# Generated by Django 5.1.15 on 2026-10-18 19:39
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.contrib.postgres.operations import TrigramExtension
+from django.db import migrations, models
+
+# the distinct title words (as catalog.search.title_words() splits them) and author names, written
+# out in SQL so the migration doesn't depend on app code
+BACKFILL_SEARCH_TERMS = """
+INSERT INTO catalog_searchterm (kind, term)
+SELECT 't', unnest(tsvector_to_array(to_tsvector('simple', coalesce(title, ''))))
+FROM catalog_book
+UNION SELECT 'f', first_name FROM catalog_author WHERE first_name <> ''
+UNION SELECT 'l', last_name FROM catalog_author WHERE last_name <> ''
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0017_book_search_vector'),
+    ]
+
+    operations = [
+        # provides the gist_trgm_ops operator class (trusted since Postgres 13, so the database
+        # owner can create it)
+        TrigramExtension(),
+        migrations.CreateModel(
+            name='SearchTerm',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('t', 'Title word'), ('f', 'First name'), ('l', 'Last name')], max_length=1)),
+                ('term', models.CharField(max_length=200)),
+            ],
+        ),
+        # backfill before building the indexes so they're built once rather than updated per row
+        migrations.RunSQL(BACKFILL_SEARCH_TERMS, reverse_sql=migrations.RunSQL.noop),
+        migrations.AddConstraint(
+            model_name='searchterm',
+            constraint=models.UniqueConstraint(fields=('kind', 'term'), name='searchterm_once_per_kind'),
+        ),
+        migrations.AddIndex(
+            model_name='searchterm',
+            index=django.contrib.postgres.indexes.GistIndex(condition=models.Q(('kind', 't')), fields=['term'], name='searchterm_title_word_trgm', opclasses=['gist_trgm_ops']),
+        ),
+        migrations.AddIndex(
+            model_name='searchterm',
+            index=django.contrib.postgres.indexes.GistIndex(condition=models.Q(('kind', 'f')), fields=['term'], name='searchterm_first_name_trgm', opclasses=['gist_trgm_ops']),
+        ),
+        migrations.AddIndex(
+            model_name='searchterm',
+            index=django.contrib.postgres.indexes.GistIndex(condition=models.Q(('kind', 'l')), fields=['term'], name='searchterm_last_name_trgm', opclasses=['gist_trgm_ops']),
+        ),
+        migrations.AddIndex(
+            model_name='author',
+            index=models.Index(fields=['first_name', 'last_name', 'id'], name='author_first_name_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='book',
+            index=django.contrib.postgres.indexes.GinIndex(django.contrib.postgres.search.SearchVector('title', config='simple'), name='book_title_words'),
+        ),
+    ]
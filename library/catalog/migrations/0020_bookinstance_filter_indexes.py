@@ -0,0 +1,31 @@
+# Generated by Django 5.1.15 on 2026-10-18 19:49
+
+import auto_prefetch
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0019_keyset_pagination_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    # the composite index is built before the plain book_id index it replaces is dropped
+    operations = [
+        migrations.AddIndex(
+            model_name='bookinstance',
+            index=models.Index(fields=['book', 'due_back'], name='bookinstance_book_due_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='bookinstance',
+            index=models.Index(fields=['status', 'due_back'], name='bookinstance_status_due_idx'),
+        ),
+        migrations.AlterField(
+            model_name='bookinstance',
+            name='book',
+            field=auto_prefetch.ForeignKey(db_index=False, null=True, on_delete=django.db.models.deletion.RESTRICT, to='catalog.book'),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.1.15 on 2026-10-18 20:10
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0020_bookinstance_filter_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LoanReminder',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('d', 'Due soon'), ('o', 'Overdue')], max_length=1)),
+                ('due_back', models.DateField()),
+                ('sent_at', models.DateTimeField(auto_now_add=True)),
+                ('borrower', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+                ('copy', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='reminders', to='catalog.bookinstance')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('copy', 'kind', 'due_back'), name='loanreminder_once_per_due_date')],
+            },
+        ),
+    ]
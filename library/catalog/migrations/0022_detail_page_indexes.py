@@ -0,0 +1,31 @@
+# Generated by Django 5.1.15 on 2026-10-18 20:20
+
+import auto_prefetch
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0021_loan_reminders'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    # the composite index is built before the plain author_id index it replaces is dropped
+    operations = [
+        migrations.AddIndex(
+            model_name='book',
+            index=models.Index(fields=['author', 'title', 'id'], name='book_author_title_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='bookinstance',
+            index=models.Index(fields=['book', 'status', 'id'], name='bookinstance_book_status_idx'),
+        ),
+        migrations.AlterField(
+            model_name='book',
+            name='author',
+            field=auto_prefetch.ForeignKey(db_index=False, null=True, on_delete=django.db.models.deletion.RESTRICT, to='catalog.author'),
+        ),
+    ]
@@ -2,18 +2,44 @@ import datetime
 import random
 import string
 import uuid
-from typing import override
+from collections import Counter, defaultdict
+from itertools import batched
+from typing import Iterable, override
 
 import auto_prefetch
 from django.conf import settings
+from django.contrib.postgres.indexes import GinIndex, GistIndex
+from django.contrib.postgres.search import SearchVector, SearchVectorField
 from django.core.exceptions import ValidationError
-from django.db import models
-from django.db.models import UniqueConstraint
-from django.db.models.functions import Lower
+from django.db import connections, models, router, transaction
+from django.db.models import (
+    Case,
+    ExpressionWrapper,
+    F,
+    Func,
+    Q,
+    Sum,
+    UniqueConstraint,
+    Value,
+    When,
+)
+from django.db.models.functions import Coalesce, Lower
+from django.dispatch import Signal
 from django.urls import reverse
+from django.utils import timezone
 from django_prometheus.models import ExportModelOperationsMixin
 
 
+# sent with the `book_ids` whose copies changed through a queryset write or a counter update,
+# neither of which sends post_save (see catalog.signals)
+copies_changed = Signal()
+# sent whenever LibraryStats' counters change
+library_stats_changed = Signal()
+# sent by the bulk loaders (e.g. import_catalog) with the model whose rows they inserted through
+# bulk_create, which doesn't send post_save
+bulk_created = Signal()
+
+
 # mixin only computes counters for lifecycle operations, not the number of records being affected
 class Genre(ExportModelOperationsMixin("genre"), models.Model):
     """Model representing a book genre."""
@@ -24,6 +50,8 @@ class Genre(ExportModelOperationsMixin("genre"), models.Model):
         unique=True,
         help_text="Enter a book genre (e.g. Science Fiction, French Poetry etc.)",
     )
+    # when the row last changed, for conditional GETs (catalog.conditional)
+    updated_at = models.DateTimeField(auto_now=True)
 
     def __str__(self):
         """String for representing the Model object."""
@@ -50,13 +78,30 @@ def generate_isbn() -> str:
     return "".join(random.choices(string.digits, k=13))
 
 
+class CopyCounts(models.Model):
+    """Denormalized copy counters, kept in step with BookInstance writes so that pages can show
+    availability without counting over the (very large) book instance table."""
+
+    copies_total = models.PositiveIntegerField(default=0, editable=False)
+    copies_available = models.PositiveIntegerField(default=0, editable=False)
+    copies_on_loan = models.PositiveIntegerField(default=0, editable=False)
+    copies_reserved = models.PositiveIntegerField(default=0, editable=False)
+    copies_maintenance = models.PositiveIntegerField(default=0, editable=False)
+
+    class Meta:
+        abstract = True
+
+
 # auto-prefetching optimizes many-to-one/many relationship queries where if a field in a related
 # model is accessed, it performs a prefretch_related() call equivalent
-class Book(ExportModelOperationsMixin("book"), auto_prefetch.Model):
+class Book(ExportModelOperationsMixin("book"), CopyCounts, auto_prefetch.Model):
     """Model representing a book (but not a specific copy of a book)."""
 
     title = models.CharField(max_length=200)
-    author = auto_prefetch.ForeignKey("Author", on_delete=models.RESTRICT, null=True)
+    # indexed by book_author_title_idx (which also serves plain author_id lookups)
+    author = auto_prefetch.ForeignKey(
+        "Author", on_delete=models.RESTRICT, null=True, db_index=False
+    )
 
     summary = models.TextField(
         max_length=1000, help_text="Enter a brief description of the book"
@@ -90,6 +135,13 @@ class Book(ExportModelOperationsMixin("book"), auto_prefetch.Model):
     cover_image_width = models.IntegerField(null=True, blank=True, editable=False)
     cover_image_height = models.IntegerField(null=True, blank=True, editable=False)
 
+    # maintained by catalog.search from the title, summary, author and genres (see catalog.signals)
+    search_vector = SearchVectorField(null=True, editable=False)
+
+    # when the row last changed, counters and genres included, for conditional GETs
+    # (catalog.conditional)
+    updated_at = models.DateTimeField(auto_now=True)
+
     def __str__(self):
         """String for representing the Model object."""
         return self.title
@@ -107,18 +159,184 @@ class Book(ExportModelOperationsMixin("book"), auto_prefetch.Model):
             )
 
     class Meta(auto_prefetch.Model.Meta):
-        pass
+        indexes = [
+            GinIndex(fields=["search_vector"], name="book_search_vector_gin"),
+            # the books with a given word in their title (catalog.search.fuzzy_books)
+            GinIndex(SearchVector("title", config="simple"), name="book_title_words"),
+            # an author's books by title, as the author page pages through them
+            models.Index(fields=["author", "title", "id"], name="book_author_title_idx"),
+            # the latest change to any book (book list ETag)
+            models.Index(fields=["updated_at"], name="book_updated_at_idx"),
+        ]
+
+
+# number of rows read/written per statement when bulk writes have to adjust the copy counters
+COPY_COUNTS_BATCH_SIZE = 2000
+
+# writes touching any of these fields move a copy between counters
+_COPY_COUNTED_FIELDS = frozenset(("book", "book_id", "status"))
+
+
+class BookInstanceQuerySet(auto_prefetch.QuerySet):
+    """Keeps the copy counters correct for bulk writes, which bypass BookInstance.save().
+
+    (Deletes don't need handling here since they always go through the collector, which sends
+    post_delete for every row when receivers are connected.)
+    """
+
+    @override
+    def update(self, **kwargs):
+        # as Django's writes do first, so self.db (and the counters' writes) is the primary's alias
+        # even in read_from_replicas() views
+        self._for_write = True
+        # auto_now only applies to save()
+        kwargs.setdefault("updated_at", timezone.now())
+        if not _COPY_COUNTED_FIELDS.intersection(kwargs):
+            return super().update(**kwargs)
+
+        updated = 0
+        with transaction.atomic(using=self.db):
+            # lock the rows first so nothing can move them between reading and rewriting counters
+            locked_pks = (
+                self.select_for_update()
+                .order_by()
+                .values_list("pk", flat=True)
+                .iterator(chunk_size=COPY_COUNTS_BATCH_SIZE)
+            )
+            for pks in batched(locked_pks, COPY_COUNTS_BATCH_SIZE):
+                updated += self._counted_write(
+                    pks, lambda rows: rows.update(**kwargs)
+                )
+        return updated
+
+    @override
+    def bulk_update(self, objs, fields, batch_size=None):
+        self._for_write = True
+        objs = list(objs)
+        now = timezone.now()
+        for obj in objs:
+            obj.updated_at = now
+        fields = [*fields, "updated_at"]
+        if not _COPY_COUNTED_FIELDS.intersection(fields):
+            return super().bulk_update(objs, fields, batch_size=batch_size)
+
+        with transaction.atomic(using=self.db):
+            pks = list(
+                self.filter(pk__in=[obj.pk for obj in objs])
+                .select_for_update()
+                .order_by()
+                .values_list("pk", flat=True)
+            )
+            return self._counted_write(
+                pks,
+                lambda rows: super(BookInstanceQuerySet, self).bulk_update(
+                    objs, fields, batch_size=batch_size
+                ),
+            )
+
+    @override
+    def bulk_create(
+        self, objs, batch_size=None, ignore_conflicts=False, update_conflicts=False, **kwargs
+    ):
+        if ignore_conflicts or update_conflicts:
+            # the copies that conflicted can't be told from the inserted ones (their UUIDs are set
+            # either way), so they'd be counted as new
+            raise ValueError("Counted bulk_create() of copies doesn't support conflicts")
+        self._for_write = True
+        with transaction.atomic(using=self.db):
+            created = super().bulk_create(objs, batch_size=batch_size, **kwargs)
+            deltas = CopyCountDeltas()
+            for obj in created:
+                deltas.add(obj.book_id, obj.status)
+            deltas.apply(using=self.db)
+        return created
+
+    def transition(self, pk, from_status: str, **changes) -> bool:
+        """Applies `changes` to copy `pk` only if it's still in `from_status` (and matches this
+        queryset's filters), writing just the changed columns.
+
+        Returns False without waiting if the copy has moved on or another transaction holds its row
+        (e.g. a concurrent checkout of the same copy), so callers can report a conflict instead of
+        queueing behind a change that will make theirs invalid anyway.
+        """
+        self._for_write = True
+        with transaction.atomic(using=self.db):
+            book_ids = list(
+                self.select_for_update(skip_locked=True)
+                .filter(pk=pk, status=from_status)
+                .order_by()
+                .values_list("book_id", flat=True)[:1]
+            )
+            if not book_ids:
+                return False
+            self.model._base_manager.db_manager(self.db).filter(pk=pk).update(
+                updated_at=timezone.now(), **changes
+            )
+            deltas = CopyCountDeltas()
+            deltas.remove(book_ids[0], from_status)
+            deltas.add(book_ids[0], changes.get("status", from_status))
+            deltas.apply(using=self.db)
+            # sent even if the status didn't change, since the other columns did
+            copies_changed.send(BookInstance, book_ids=book_ids, using=self.db)
+        return True
+
+    def _overdue(self, today: datetime.date) -> Q:
+        return Q(status=self.model.LOAN_STATUS.OnLoan, due_back__lt=today)
+
+    def with_overdue(self, today: datetime.date | None = None):
+        """Annotates `overdue` and `days_overdue` (0 unless overdue), computed in SQL rather than
+        calling is_overdue() on every row."""
+        today = today or timezone.localdate()
+        # date - date is a whole number of days in Postgres
+        days_late = Func(
+            Value(today, output_field=models.DateField()),
+            F("due_back"),
+            template="(%(expressions)s)",
+            arg_joiner=" - ",
+            output_field=models.IntegerField(),
+        )
+        return self.annotate(
+            overdue=ExpressionWrapper(self._overdue(today), output_field=models.BooleanField()),
+            days_overdue=Case(
+                When(self._overdue(today), then=days_late),
+                default=Value(0),
+                output_field=models.IntegerField(),
+            ),
+        )
+
+    def overdue(self, today: datetime.date | None = None):
+        """Copies on loan past their due date (a range scan of bookinstance_status_due_idx)."""
+        today = today or timezone.localdate()
+        return self.filter(self._overdue(today)).with_overdue(today)
+
+    def _counted_write(self, pks, write) -> int:
+        # base manager, so the write itself doesn't recurse back into this queryset
+        rows = self.model._base_manager.db_manager(self.db).filter(pk__in=pks)
+        deltas = CopyCountDeltas()
+        deltas.remove_rows(rows.order_by().values_list("book_id", "status"))
+        written = write(rows)
+        deltas.add_rows(rows.order_by().values_list("book_id", "status"))
+        deltas.apply(using=self.db)
+        return written
+
+
+BookInstanceManager = auto_prefetch.Manager.from_queryset(BookInstanceQuerySet)
 
 
 class BookInstance(ExportModelOperationsMixin("bookinstance"), auto_prefetch.Model):
     """Model representing a specific copy of a book (i.e. that can be borrowed from the library)."""
 
+    objects = BookInstanceManager()
+
     id = models.UUIDField(
         primary_key=True,
         default=uuid.uuid4,
         help_text="Unique ID for this particular book across whole library",
     )
-    book = auto_prefetch.ForeignKey(Book, on_delete=models.RESTRICT, null=True)
+    # indexed by bookinstance_book_due_idx (which also serves plain book_id lookups)
+    book = auto_prefetch.ForeignKey(
+        Book, on_delete=models.RESTRICT, null=True, db_index=False
+    )
     due_back = models.DateField(null=True, blank=True)
 
     class LOAN_STATUS(models.TextChoices):
@@ -139,15 +357,140 @@ class BookInstance(ExportModelOperationsMixin("bookinstance"), auto_prefetch.Mod
         settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True, blank=True
     )
 
+    # when the row last changed, queryset writes included, for conditional GETs
+    # (catalog.conditional)
+    updated_at = models.DateTimeField(auto_now=True)
+
     def is_overdue(self):
         return bool(self.due_back and self.due_back < datetime.date.today())
 
+    @override
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get("update_fields")
+        if update_fields is not None and not _COPY_COUNTED_FIELDS.intersection(
+            update_fields
+        ):
+            return super().save(*args, **kwargs)
+
+        using = kwargs.get("using") or router.db_for_write(type(self), instance=self)
+        with transaction.atomic(using=using):
+            deltas = CopyCountDeltas()
+            if not self._state.adding:
+                # read the stored values rather than trusting the ones loaded into this instance,
+                # which may be stale by now
+                deltas.remove_rows(
+                    BookInstance._base_manager.db_manager(using)
+                    .select_for_update()
+                    .filter(pk=self.pk)
+                    .values_list("book_id", "status")
+                )
+            super().save(*args, **kwargs)
+            deltas.add(self.book_id, self.status)  # type: ignore
+            deltas.apply(using=using)
+
     def __str__(self):
         """String for representing the Model object."""
         return f"{self.id} ({self.book.title if self.book is not None else "no title"})"
 
     class Meta(auto_prefetch.Model.Meta):
         ordering = ["due_back"]
+        # keyset pagination of the loan lists (catalog.pagination), seeking on (due_back, id)
+        indexes = [
+            models.Index(
+                fields=["due_back", "id"],
+                condition=Q(status="o"),
+                name="bookinstance_loans_due_idx",
+            ),
+            models.Index(
+                fields=["borrower", "due_back", "id"],
+                condition=Q(status="o"),
+                name="bookinstance_borrower_due_idx",
+            ),
+            # a book's copies in due date order (book detail page)
+            models.Index(fields=["book", "due_back"], name="bookinstance_book_due_idx"),
+            # a book's copies in a given status, as the book page pages through them
+            models.Index(fields=["book", "status", "id"], name="bookinstance_book_status_idx"),
+            # copies in a given status by due date (e.g. loans that are overdue)
+            models.Index(fields=["status", "due_back"], name="bookinstance_status_due_idx"),
+            # the latest change to a book's copies (book detail ETag)
+            models.Index(fields=["book", "updated_at"], name="bookinstance_book_updated_idx"),
+        ]
+
+
+# counter column tracking each loan status on Book and LibraryStats (a blank status only counts
+# toward the total)
+COPY_STATUS_COUNTERS = {
+    BookInstance.LOAN_STATUS.Available: "copies_available",
+    BookInstance.LOAN_STATUS.OnLoan: "copies_on_loan",
+    BookInstance.LOAN_STATUS.Reserved: "copies_reserved",
+    BookInstance.LOAN_STATUS.Maintenance: "copies_maintenance",
+}
+
+
+class CopyCountDeltas:
+    """Net change in the number of copies per (book, status), applied to the counters with one
+    UPDATE per distinct change (books changing by the same amounts are updated together) plus one
+    for a library-wide stats slot."""
+
+    def __init__(self) -> None:
+        self.deltas: Counter[tuple[int | None, str]] = Counter()
+
+    def add(self, book_id: int | None, status: str, count: int = 1) -> None:
+        self.deltas[(book_id, status)] += count
+
+    def remove(self, book_id: int | None, status: str, count: int = 1) -> None:
+        self.deltas[(book_id, status)] -= count
+
+    def add_rows(self, rows: Iterable[tuple[int | None, str]]) -> None:
+        for book_id, status in rows:
+            self.add(book_id, status)
+
+    def remove_rows(self, rows: Iterable[tuple[int | None, str]]) -> None:
+        for book_id, status in rows:
+            self.remove(book_id, status)
+
+    def apply(self, using: str | None = None) -> None:
+        per_book: defaultdict[int, Counter[str]] = defaultdict(Counter)
+        library: Counter[str] = Counter()
+        for (book_id, status), count in self.deltas.items():
+            if not count:
+                continue
+            changes = Counter({"copies_total": count})
+            if status in COPY_STATUS_COUNTERS:
+                changes[COPY_STATUS_COUNTERS[status]] += count
+            if book_id is not None:
+                per_book[book_id].update(changes)
+            library.update(changes)
+
+        # bulk writes usually change many books by the same amounts (e.g. N new copies each)
+        by_change: defaultdict[tuple[tuple[str, int], ...], list[int]] = defaultdict(list)
+        for book_id, changes in per_book.items():
+            if key := tuple(sorted((f, c) for f, c in changes.items() if c)):
+                by_change[key].append(book_id)
+        books = Book._base_manager.db_manager(using)
+        if len(by_change) > 1 or any(len(pks) > 1 for pks in by_change.values()):
+            # an UPDATE locks rows in no particular order, so they're locked in pk order first, the
+            # same order across concurrent writers, to avoid deadlocks
+            list(
+                books.select_for_update()
+                .filter(pk__in=list(per_book))
+                .order_by("pk")
+                .values_list("pk", flat=True)
+            )
+        now = timezone.now()
+        for key, book_ids in by_change.items():
+            books.filter(pk__in=book_ids).update(
+                updated_at=now, **_counter_updates(Counter(dict(key)))
+            )
+        if per_book:
+            copies_changed.send(BookInstance, book_ids=list(per_book), using=using)
+        if updates := _counter_updates(library):
+            LibraryStats.update_counters(using=using, **updates)
+        self.deltas.clear()
+
+
+def _counter_updates(changes: Counter[str]) -> dict[str, F]:
+    return {field: F(field) + count for field, count in changes.items() if count}
 
 
 class Author(ExportModelOperationsMixin("author"), models.Model):
@@ -157,9 +500,27 @@ class Author(ExportModelOperationsMixin("author"), models.Model):
     last_name = models.CharField(max_length=100)
     date_of_birth = models.DateField(null=True, blank=True)
     date_of_death = models.DateField("died", null=True, blank=True)
+    # when the row last changed, or one of the author's books was added, changed or removed, for
+    # conditional GETs (catalog.conditional)
+    updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
         ordering = ["last_name", "first_name"]
+        indexes = [
+            # the authors with a given first name, by name (catalog.search.fuzzy_authors)
+            models.Index(
+                fields=["first_name", "last_name", "id"],
+                name="author_first_name_idx",
+            ),
+            # keyset pagination of the author list (catalog.pagination), and the authors with a
+            # given last name (catalog.search.fuzzy_authors)
+            models.Index(
+                fields=["last_name", "first_name", "id"],
+                name="author_name_ordering_idx",
+            ),
+            # the latest change to any author (list ETags)
+            models.Index(fields=["updated_at"], name="author_updated_at_idx"),
+        ]
 
     def get_absolute_url(self):
         """Returns the URL to access a particular author instance."""
@@ -178,6 +539,8 @@ class Language(ExportModelOperationsMixin("language"), models.Model):
         unique=True,
         help_text="Enter the book's natural language (e.g. English, French, Japanese etc.)",
     )
+    # when the row last changed, for conditional GETs (catalog.conditional)
+    updated_at = models.DateTimeField(auto_now=True)
 
     def get_absolute_url(self):
         """Returns the url to access a particular language instance."""
@@ -186,3 +549,140 @@ class Language(ExportModelOperationsMixin("language"), models.Model):
     def __str__(self):
         """String for representing the Model object (in Admin site etc.)"""
         return self.name
+
+
+class LibraryStats(CopyCounts):
+    """Library-wide counters so the home page doesn't have to count whole tables, spread over
+    SLOTS rows and summed on read: concurrent loans and returns add to different rows rather than
+    queueing on one row lock until they commit."""
+
+    SLOTS = 16
+
+    # one slot's share can go below zero (e.g. a copy added through one slot and lent through
+    # another), only the sums can't
+    copies_total = models.IntegerField(default=0, editable=False)
+    copies_available = models.IntegerField(default=0, editable=False)
+    copies_on_loan = models.IntegerField(default=0, editable=False)
+    copies_reserved = models.IntegerField(default=0, editable=False)
+    copies_maintenance = models.IntegerField(default=0, editable=False)
+    num_books = models.IntegerField(default=0, editable=False)
+    num_authors = models.IntegerField(default=0, editable=False)
+
+    class Meta:
+        verbose_name_plural = "library stats"
+
+    def __str__(self):
+        return "Library stats"
+
+    @classmethod
+    def counter_fields(cls) -> list[str]:
+        return [field.name for field in cls._meta.concrete_fields if not field.primary_key]
+
+    @classmethod
+    def totals(cls) -> models.QuerySet:
+        """The slots as a single group, so aggregates selected from it (e.g. in a values_list())
+        sum over all of them in one row (ordered, trivially, so that first() can fetch it)."""
+        return cls.objects.values(total=Value(True)).order_by("total")
+
+    @classmethod
+    def load(cls) -> "LibraryStats":
+        """The counters summed over the slots, read like any other rows, so from a replica in
+        read_from_replicas() views; an unsaved instance, all zeros if there are no slots."""
+        return cls(**cls.objects.aggregate(**cls._sums()))
+
+    @classmethod
+    async def aload(cls) -> "LibraryStats":
+        return cls(**await cls.objects.aaggregate(**cls._sums()))
+
+    @classmethod
+    def _sums(cls) -> dict[str, Coalesce]:
+        return {field: Coalesce(Sum(field), 0) for field in cls.counter_fields()}
+
+    @classmethod
+    def update_counters(cls, using: str | None = None, **updates) -> None:
+        """Applies `updates` (usually F() increments) to the slot of the current database session,
+        creating it if missing. A slot per session rather than per write keeps a transaction that
+        updates the counters more than once (e.g. adding a book and its copies) on one row, so two
+        such transactions never lock two slots in opposite orders."""
+        connection = connections[using or router.db_for_write(cls)]
+        connection.ensure_connection()
+        slot = connection.connection.info.backend_pid % cls.SLOTS + 1
+        rows = cls.objects.db_manager(connection.alias).filter(pk=slot)
+        if not rows.update(**updates):
+            cls.objects.db_manager(connection.alias).get_or_create(pk=slot)
+            rows.update(**updates)
+        library_stats_changed.send(cls, using=using)
+
+
+class SearchTerm(models.Model):
+    """A distinct title word or author name, which the fuzzy lookups (catalog.search) match typos
+    against: there are far fewer of them than books or authors, and they're far shorter. Terms are
+    only ever added (one that nothing has any more just matches nothing)."""
+
+    class KIND(models.TextChoices):
+        TitleWord = ("t", "Title word")
+        FirstName = ("f", "First name")
+        LastName = ("l", "Last name")
+
+    kind = models.CharField(max_length=1, choices=KIND)  # type: ignore
+    term = models.CharField(max_length=200)
+
+    class Meta:
+        constraints = [
+            UniqueConstraint(fields=["kind", "term"], name="searchterm_once_per_kind"),
+        ]
+        # trigram indexes read closest first (`<->`), so a lookup stops after the few it needs; one
+        # per kind, as each lookup is for one kind
+        indexes = [
+            GistIndex(
+                fields=["term"],
+                opclasses=["gist_trgm_ops"],
+                condition=Q(kind=kind),
+                name=f"searchterm_{name}_trgm",
+            )
+            for kind, name in (("t", "title_word"), ("f", "first_name"), ("l", "last_name"))
+        ]
+
+    def __str__(self):
+        return f"{self.get_kind_display()}: {self.term}"  # type: ignore
+
+
+class ImportCheckpoint(models.Model):
+    """How many records of an input import_catalog has imported, saved in the transaction that
+    imports each batch, so an interrupted import resumes exactly after the last committed one."""
+
+    # the input file's absolute path, unless the import names its checkpoint
+    source = models.CharField(max_length=1000, unique=True)
+    records = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.source}: {self.records} records"
+
+
+class LoanReminder(models.Model):
+    """Record of a reminder sent about a loan, so send_loan_reminders never mails the same notice
+    twice. Keyed on the due date too, so a renewed loan gets reminded again."""
+
+    class KIND(models.TextChoices):
+        DueSoon = ("d", "Due soon")
+        Overdue = ("o", "Overdue")
+
+    # indexed by the unique constraint
+    copy = models.ForeignKey(
+        BookInstance, on_delete=models.CASCADE, related_name="reminders", db_index=False
+    )
+    borrower = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
+    kind = models.CharField(max_length=1, choices=KIND)  # type: ignore
+    due_back = models.DateField()
+    sent_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            UniqueConstraint(
+                fields=["copy", "kind", "due_back"], name="loanreminder_once_per_due_date"
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.get_kind_display()} reminder for {self.copy_id} due {self.due_back}"  # type: ignore
@@ -0,0 +1,184 @@
+"""Whole-page cache of the catalog pages anonymous users browse.
+
+Pages are cached per path, the query parameters the pages read (PAGE_PARAMS) and whether the nav
+menu cookie has it open, which is everything an anonymous page varies on. Each page is tagged with
+what it shows (see tag_page()), and a change to any of those records the time of the change
+against its tags once it commits (see catalog.signals). A cached page is only served if none of its
+tags has changed since the page started rendering, so pages never go stale waiting on a TTL, and a
+page rendered from rows read just before a concurrent change (or from a replica that hadn't caught
+up with it, see core.replicas) is never served.
+
+Tags are "book:<id>", "author:<id>", "genre:<id>" and "language:<id>" for single objects,
+"books" and "authors" for the membership and order of the lists, "search" for search results and
+"stats" for the library-wide counters."""
+
+import hashlib
+import re
+import time
+from collections.abc import Callable, Iterable
+from functools import wraps
+from urllib.parse import urlencode
+
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.core.cache import caches
+from django.http import HttpRequest, HttpResponse
+from django.middleware.csrf import get_token
+from django.utils.cache import get_conditional_response
+from django.utils.http import parse_http_date_safe
+
+from core.replicas import staleness
+
+from .context_processors import NAV_MENU_COOKIE_NAME, NAV_MENU_COOKIE_OPEN
+
+# alias of the cache holding the pages and tags, which must be shared by every worker process (see
+# CACHES)
+PAGE_CACHE = "pages"
+# pages are kept fresh by their tags, this just lets unvisited ones expire
+PAGE_TIMEOUT = 24 * 60 * 60
+# query parameters the cached pages read; any others don't change the page
+PAGE_PARAMS = ("page", "cursor", "search", "status")
+# allowance for clock differences between the processes recording changes and rendering pages
+CLOCK_SKEW = 1.0
+# what {% csrf_token %} renders; the token is per user, so pages are stored without it and served
+# with the requesting user's
+CSRF_INPUT = re.compile(rb'(name="csrfmiddlewaretoken" value=")[^"]*(")')
+CSRF_PLACEHOLDER = rb"\1\2"
+
+
+def tag_key(tag: str) -> str:
+    return f"page-tag:{tag}"
+
+
+def page_key(request: HttpRequest) -> str:
+    params = urlencode(
+        [(param, request.GET[param].strip()) for param in PAGE_PARAMS if param in request.GET]
+    )
+    nav_open = request.COOKIES.get(NAV_MENU_COOKIE_NAME) == NAV_MENU_COOKIE_OPEN
+    digest = hashlib.md5(f"{request.path}?{params}&nav={nav_open}".encode()).hexdigest()
+    return f"page:{digest}"
+
+
+def tag_page(request: HttpRequest, *tags: str) -> None:
+    """Records what the page being rendered shows, so it's invalidated when any of it changes."""
+    if (page_tags := getattr(request, "page_cache_tags", None)) is not None:
+        page_tags.update(tags)
+
+
+def invalidate_tags(tags: Iterable[str]) -> None:
+    """Makes every cached page tagged with any of `tags` stale."""
+    if changed := {tag_key(tag): time.time() for tag in tags}:
+        caches[PAGE_CACHE].set_many(changed, timeout=None)
+
+
+def cache_anonymous_page(view: Callable) -> Callable:
+    """Serves anonymous GET requests for the (sync or async) view from the page cache, tagged with
+    tag_page()."""
+    if iscoroutinefunction(view):
+
+        @wraps(view)
+        async def async_wrapper(request: HttpRequest, *args, **kwargs):
+            if request.method not in ("GET", "HEAD") or (await request.auser()).is_authenticated:
+                return await view(request, *args, **kwargs)
+            cache = caches[PAGE_CACHE]
+            key = page_key(request)
+            if (cached := await sync_to_async(fresh_page)(cache, key)) is not None:
+                return cached_response(request, cached)
+            started = time.time()
+            request.page_cache_tags = set()  # type: ignore
+            response = await view(request, *args, **kwargs)
+            return await sync_to_async(rendered_page)(cache, key, request, response, started)
+
+        return async_wrapper
+
+    @wraps(view)
+    def wrapper(request: HttpRequest, *args, **kwargs):
+        if request.method not in ("GET", "HEAD") or request.user.is_authenticated:
+            return view(request, *args, **kwargs)
+        cache = caches[PAGE_CACHE]
+        key = page_key(request)
+        if (cached := fresh_page(cache, key)) is not None:
+            return cached_response(request, cached)
+        started = time.time()
+        request.page_cache_tags = set()  # type: ignore
+        response = view(request, *args, **kwargs)
+        return rendered_page(cache, key, request, response, started)
+
+    return wrapper
+
+
+def cached_response(request: HttpRequest, cached: dict) -> HttpResponse:
+    response = HttpResponse(
+        CSRF_INPUT.sub(
+            lambda match: match[1] + get_token(request).encode() + match[2],
+            cached["content"],
+        )
+        if cached["csrf"]
+        else cached["content"],
+        content_type=cached["content_type"],
+    )
+    response["X-Page-Cache"] = "hit"
+    for header, value in cached["validators"].items():
+        response[header] = value
+    # the cached page's own ETag/Last-Modified (see catalog.conditional) still apply
+    return get_conditional_response(
+        request,
+        etag=response.get("ETag"),
+        last_modified=parse_http_date_safe(response.get("Last-Modified")),
+        response=response,
+    )
+
+
+def rendered_page(
+    cache, key: str, request: HttpRequest, response: HttpResponse, started: float
+) -> HttpResponse:
+    """Stores the page the view rendered, if it's cacheable."""
+    if hasattr(response, "render"):
+        response.render()
+    tags = request.page_cache_tags  # type: ignore
+    if (
+        response.status_code == 200
+        and not response.streaming
+        and not response.cookies
+        and tags
+    ):
+        store_page(cache, key, response, tags, started)
+    response["X-Page-Cache"] = "miss"
+    return response
+
+
+def fresh_page(cache, key: str) -> dict | None:
+    if (page := cache.get(key)) is None:
+        return None
+    changed = cache.get_many([tag_key(tag) for tag in page["tags"]])
+    # a tag without a recorded change time (e.g. evicted) may have changed at any time
+    if len(changed) < len(page["tags"]) or max(changed.values()) > page["started"]:
+        return None
+    return page
+
+
+def store_page(cache, key: str, response: HttpResponse, tags: set[str], started: float) -> None:
+    # rows read from a replica may be as old as the lag it's allowed
+    started -= CLOCK_SKEW + staleness()
+    # tags that have never changed (or were evicted) are recorded as unchanged since the render
+    # started; if a change is recorded first, add() leaves it and this page is stale from the start
+    found = cache.get_many([tag_key(tag) for tag in tags])
+    for tag in tags:
+        if tag_key(tag) not in found:
+            cache.add(tag_key(tag), started, timeout=None)
+    content, csrf_inputs = CSRF_INPUT.subn(CSRF_PLACEHOLDER, response.content)
+    cache.set(
+        key,
+        {
+            "started": started,
+            "tags": sorted(tags),
+            "content": content,
+            "content_type": response["Content-Type"],
+            "csrf": bool(csrf_inputs),
+            "validators": {
+                header: response[header]
+                for header in ("ETag", "Last-Modified")
+                if response.has_header(header)
+            },
+        },
+        timeout=PAGE_TIMEOUT,
+    )
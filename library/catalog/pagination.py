@@ -0,0 +1,233 @@
+import base64
+import binascii
+import json
+from collections.abc import Sequence
+from functools import reduce
+from operator import or_
+from typing import Any, override
+
+from django.core.exceptions import ValidationError
+from django.core.paginator import InvalidPage, Page, Paginator
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Field, Q, QuerySet
+from django.http import Http404
+
+# cursor directions
+NEXT = "n"
+PREVIOUS = "p"
+LAST = "l"
+
+
+def encode_cursor(direction: str, values: Sequence[Any] | None = None) -> str:
+    payload = json.dumps([direction, values], cls=DjangoJSONEncoder, separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str, fields: Sequence[Field]) -> tuple[str, list[Any] | None]:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        direction, values = json.loads(base64.urlsafe_b64decode(padded))
+        if direction not in (NEXT, PREVIOUS, LAST):
+            raise ValueError(direction)
+        if values is not None:
+            if len(values) != len(fields):
+                raise ValueError(values)
+            values = [
+                None if value is None else field.to_python(value)
+                for field, value in zip(fields, values)
+            ]
+        return direction, values
+    except (ValueError, TypeError, binascii.Error, ValidationError):
+        raise Http404("Invalid cursor")
+
+
+def _beyond(field: Field, name: str, value: Any, backwards: bool) -> Q:
+    # ascending order puts NULLs last in Postgres (and descending puts them first), so NULLs sort
+    # after every value
+    if backwards:
+        if value is None:
+            return Q(**{f"{name}__isnull": False})
+        return Q(**{f"{name}__lt": value})
+    if value is None:
+        return Q(pk__in=[])
+    beyond = Q(**{f"{name}__gt": value})
+    return beyond | Q(**{f"{name}__isnull": True}) if field.null else beyond
+
+
+def _equal(name: str, value: Any) -> Q:
+    return Q(**{f"{name}__isnull": True}) if value is None else Q(**{name: value})
+
+
+def seek_filter(
+    fields: Sequence[Field], names: Sequence[str], values: Sequence[Any], backwards: bool
+) -> Q:
+    """Rows strictly after (or before) `values` in the ascending order on `names`, i.e. the
+    expanded form of `(a, b, c) > (x, y, z)` that also handles NULLs."""
+    conditions = []
+    equal = Q()
+    for field, name, value in zip(fields, names, values):
+        conditions.append(equal & _beyond(field, name, value, backwards))
+        equal &= _equal(name, value)
+    seek = reduce(or_, conditions)
+
+    # a plain range condition on the leading column lets the index scan start at the cursor rather
+    # than evaluating the OR for every row
+    if values[0] is not None and not fields[0].null:
+        seek &= Q(**{f"{names[0]}__{'lte' if backwards else 'gte'}": values[0]})
+    return seek
+
+
+class CursorPage(Sequence):
+    """Page of a keyset-paginated queryset, mirroring the parts of django.core.paginator.Page that
+    templates use (no page numbers or counts, since computing them is what keyset pagination
+    avoids)."""
+
+    def __init__(
+        self,
+        object_list: list,
+        next_cursor: str | None,
+        previous_cursor: str | None,
+    ):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+        self.last_cursor = encode_cursor(LAST)
+
+    def __repr__(self):
+        return f"<CursorPage of {len(self)} objects>"
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def has_next(self) -> bool:
+        return self.next_cursor is not None
+
+    def has_previous(self) -> bool:
+        return self.previous_cursor is not None
+
+    def has_other_pages(self) -> bool:
+        return self.has_next() or self.has_previous()
+
+
+def paginate_by_cursor(
+    queryset: QuerySet,
+    ordering: Sequence[str],
+    page_size: int,
+    cursor: str | None = None,
+) -> CursorPage:
+    """Fetches one page by seeking on `ordering` (ascending fields, the last of which must be
+    unique), using `LIMIT page_size + 1` and no OFFSET or COUNT(*)."""
+    seek = CursorSeek(queryset, ordering, page_size, cursor)
+    return seek.page(list(seek.rows))
+
+
+async def apaginate_by_cursor(
+    queryset: QuerySet,
+    ordering: Sequence[str],
+    page_size: int,
+    cursor: str | None = None,
+) -> CursorPage:
+    """paginate_by_cursor() for async views."""
+    seek = CursorSeek(queryset, ordering, page_size, cursor)
+    return seek.page([row async for row in seek.rows])
+
+
+class CursorSeek:
+    """The query for one page of paginate_by_cursor(), and the page made of its rows."""
+
+    def __init__(
+        self, queryset: QuerySet, ordering: Sequence[str], page_size: int, cursor: str | None
+    ):
+        meta = queryset.model._meta
+        self.fields = [meta.pk if name == "pk" else meta.get_field(name) for name in ordering]
+        self.page_size = page_size
+        self.direction, self.values = (
+            decode_cursor(cursor, self.fields) if cursor else (NEXT, None)
+        )
+        self.backwards = self.direction in (PREVIOUS, LAST)
+
+        page = queryset.order_by(*(f"-{name}" if self.backwards else name for name in ordering))
+        if self.values is not None:
+            page = page.filter(seek_filter(self.fields, ordering, self.values, self.backwards))
+        self.rows = page[: page_size + 1]
+
+    def page(self, rows: list) -> CursorPage:
+        has_more = len(rows) > self.page_size
+        rows = rows[: self.page_size]
+        if self.backwards:
+            rows.reverse()
+
+        if self.backwards:
+            has_previous, has_next = has_more, self.direction == PREVIOUS
+        else:
+            has_previous, has_next = self.values is not None, has_more
+
+        def key(row) -> list[Any]:
+            # rows may be model instances or values() dicts
+            if isinstance(row, dict):
+                return [row[field.attname] for field in self.fields]
+            return [getattr(row, field.attname) for field in self.fields]
+
+        return CursorPage(
+            rows,
+            next_cursor=encode_cursor(NEXT, key(rows[-1])) if rows and has_next else None,
+            previous_cursor=(
+                encode_cursor(PREVIOUS, key(rows[0])) if rows and has_previous else None
+            ),
+        )
+
+
+async def apaginate(queryset: QuerySet, page_size: int, page: str | int) -> Page:
+    """Numbered page `page` (or "last") of `queryset`, as ListView paginates, for async views."""
+    paginator = Paginator(queryset, page_size)
+    # counted with the async ORM up front, so the paginator doesn't query
+    paginator.count = await queryset.acount()  # type: ignore
+    try:
+        number = paginator.num_pages if page == "last" else int(page)
+        page_obj = paginator.page(number)
+    except (ValueError, InvalidPage):
+        raise Http404("Invalid page")
+    page_obj.object_list = [row async for row in page_obj.object_list]
+    return page_obj
+
+
+class CursorPaginationMixin:
+    """ListView mixin that paginates with opaque next/previous cursors that seek on
+    `cursor_ordering`, instead of `OFFSET n LIMIT k` plus a `COUNT(*)` (both of which get slower
+    the deeper the page on large tables).
+
+    Numbered `?page=` links still work (falling back to the standard paginator), as do views that
+    return None from get_cursor_ordering(), e.g. for relevance-ranked search results.
+    """
+
+    cursor_kwarg = "cursor"
+    # ascending field names ending with a unique one (usually "pk") as a tie-breaker
+    cursor_ordering: Sequence[str] = ("pk",)
+
+    def get_cursor_ordering(self) -> Sequence[str] | None:
+        if self.page_kwarg in self.request.GET:  # type: ignore
+            return None
+        return self.cursor_ordering
+
+    @override
+    def paginate_queryset(self, queryset, page_size):
+        ordering = self.get_cursor_ordering()
+        if not ordering:
+            return super().paginate_queryset(queryset, page_size)  # type: ignore
+
+        page = paginate_by_cursor(
+            queryset,
+            ordering,
+            page_size,
+            self.request.GET.get(self.cursor_kwarg),  # type: ignore
+        )
+        return (None, page, page.object_list, page.has_other_pages())
+
+    @override
+    def get_context_data(self, **kwargs: Any) -> dict[str, Any]:
+        context = super().get_context_data(**kwargs)  # type: ignore
+        context["cursor_paginated"] = isinstance(context.get("page_obj"), CursorPage)
+        return context
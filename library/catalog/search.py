@@ -0,0 +1,212 @@
+from collections import defaultdict
+from collections.abc import Iterable
+
+from django.contrib.postgres.aggregates import StringAgg
+from django.contrib.postgres.search import (
+    SearchQuery,
+    SearchRank,
+    SearchVector,
+    TrigramDistance,
+    TrigramSimilarity,
+    TrigramWordSimilarity,
+)
+from django.db.models import CharField, F, Func, OuterRef, QuerySet, Subquery, Value
+from django.db.models.functions import Concat, Greatest
+
+from .models import Author, Book, SearchTerm
+
+# default number of matches returned by the fuzzy (typo-tolerant) lookups
+FUZZY_LIMIT = 10
+# words of the search looked up by fuzzy_books, and closest terms looked up for each word or name
+# (each costs an index scan)
+FUZZY_WORDS = 5
+FUZZY_TERMS = 3
+
+# text search configuration used for both indexing and querying (they must match for the GIN index
+# to be used)
+SEARCH_CONFIG = "english"
+
+
+def book_search_vector() -> SearchVector:
+    """Weighted document for a book: title and author name rank above genres, which rank above the
+    summary.
+
+    Related names are pulled in with correlated subqueries (rather than joins) so the expression can
+    be used in a bulk UPDATE.
+    """
+    author_name = Author.objects.filter(pk=OuterRef("author_id")).values(
+        name=Concat("first_name", Value(" "), "last_name")
+    )
+    genre_names = (
+        Book.genre.through.objects.filter(book_id=OuterRef("pk"))
+        .order_by()
+        .values("book_id")
+        .annotate(names=StringAgg("genre__name", delimiter=" "))
+        .values("names")
+    )
+    return (
+        SearchVector("title", weight="A", config=SEARCH_CONFIG)
+        + SearchVector(Subquery(author_name), weight="A", config=SEARCH_CONFIG)
+        + SearchVector(Subquery(genre_names), weight="B", config=SEARCH_CONFIG)
+        + SearchVector("summary", weight="C", config=SEARCH_CONFIG)
+    )
+
+
+def refresh_search_vectors(books: QuerySet[Book]) -> int:
+    """Recomputes the stored search vector for `books` in a single UPDATE, and adds the words of
+    their titles to the search terms."""
+    add_title_words(books)
+    return books.order_by().update(search_vector=book_search_vector())
+
+
+def search_query(terms: str) -> SearchQuery:
+    # websearch syntax never raises on user input (quotes, "or", "-" exclusions are all supported)
+    return SearchQuery(terms, search_type="websearch", config=SEARCH_CONFIG)
+
+
+def search_books(books: QuerySet[Book], terms: str) -> QuerySet[Book]:
+    """Filters `books` to those matching `terms`, best matches first."""
+    query = search_query(terms)
+    return (
+        books.filter(search_vector=query)
+        .annotate(search_rank=SearchRank(F("search_vector"), query))
+        .order_by("-search_rank", "pk")
+    )
+
+
+# Fuzzy lookups use pg_trgm, but not on the books and authors themselves: with a million titles,
+# so many share trigrams that even a nearest-neighbour scan of a title index reads most of it.
+# Instead the distinct title words and names are kept as search terms (short, and far fewer), the
+# few closest to what was typed are read from their gist_trgm_ops indexes in distance order (`<->`,
+# stopping after FUZZY_TERMS), and only the first books or authors with each of those are ranked.
+
+
+def title_words() -> SearchVector:
+    """The words of a book's title, as the book_title_words index holds them."""
+    return SearchVector("title", config="simple")
+
+
+def add_search_terms(kind: SearchTerm.KIND, terms: Iterable[str]) -> None:
+    # sorted, so concurrent writers adding the same new terms wait on each other rather than
+    # deadlock
+    SearchTerm.objects.bulk_create(
+        (SearchTerm(kind=kind, term=term) for term in sorted(set(terms) - {""})),
+        ignore_conflicts=True,
+    )
+
+
+def add_title_words(books: QuerySet[Book]) -> None:
+    """Adds the words of `books`' titles to the search terms."""
+    words = Func(
+        Func(title_words(), function="tsvector_to_array"),
+        function="unnest",
+        output_field=CharField(),
+    )
+    add_search_terms(
+        SearchTerm.KIND.TitleWord,
+        books.order_by().annotate(word=words).values_list("word", flat=True).distinct(),
+    )
+
+
+def add_author_names(authors: Iterable[Author]) -> None:
+    """Adds the names of `authors` to the search terms."""
+    authors = list(authors)
+    add_search_terms(SearchTerm.KIND.FirstName, (author.first_name for author in authors))
+    add_search_terms(SearchTerm.KIND.LastName, (author.last_name for author in authors))
+
+
+def closest_terms(texts: dict[SearchTerm.KIND, list[str]]) -> dict[str, list[str]]:
+    """The FUZZY_TERMS terms of each kind closest to each of its `texts`, among those similar
+    enough to it (pg_trgm.similarity_threshold), looked up in a single query."""
+    terms = SearchTerm.objects.values_list("kind", "term")
+    scans = [
+        terms.filter(kind=kind, term__trigram_similar=text).order_by(
+            TrigramDistance("term", text), "term"
+        )[:FUZZY_TERMS]
+        for kind, kind_texts in texts.items()
+        for text in kind_texts
+    ]
+    closest = defaultdict(list)
+    for kind, term in scans[0].union(*scans[1:]) if scans else ():
+        closest[kind].append(term)
+    return closest
+
+
+def author_names(terms: str) -> dict[SearchTerm.KIND, list[str]]:
+    return {SearchTerm.KIND.LastName: [terms], SearchTerm.KIND.FirstName: [terms]}
+
+
+def author_full_name():
+    return Concat("first_name", Value(" "), "last_name")
+
+
+def fuzzy_authors(terms: str, limit: int = FUZZY_LIMIT) -> QuerySet[Author]:
+    """Top `limit` authors whose first or last name is similar to `terms`, closest first."""
+    closest = closest_terms(author_names(terms))
+    # the first `limit` authors with each of the closest names, resolved up front: building the
+    # query around a literal pk list is far cheaper than around a UNION of subqueries
+    authors = Author.objects.order_by("last_name", "first_name", "pk").values_list("pk", flat=True)
+    candidates = [
+        authors.filter(**{field: name})[:limit]
+        for field, kind in (
+            ("last_name", SearchTerm.KIND.LastName),
+            ("first_name", SearchTerm.KIND.FirstName),
+        )
+        for name in closest[kind]
+    ]
+    if not candidates:
+        return Author.objects.none()
+    return (
+        Author.objects.filter(pk__in=list(candidates[0].union(*candidates[1:])))
+        .annotate(
+            similarity=Greatest(
+                TrigramSimilarity("last_name", terms),
+                TrigramSimilarity("first_name", terms),
+                TrigramSimilarity(author_full_name(), terms),
+            )
+        )
+        .order_by("-similarity", "last_name", "first_name", "pk")[:limit]
+    )
+
+
+def fuzzy_books(
+    books: QuerySet[Book], terms: str, limit: int = FUZZY_LIMIT
+) -> QuerySet[Book]:
+    """Top `limit` books whose title contains something like `terms` or whose author's name is
+    similar to it, closest first."""
+    closest = closest_terms(
+        {**author_names(terms), SearchTerm.KIND.TitleWord: terms.split()[:FUZZY_WORDS]}
+    )
+    # any `limit` books with each of the closest title words or author names (the indexes don't
+    # order them, and as far as the word or name goes they're equally close), resolved up front as
+    # in fuzzy_authors
+    candidates = books.order_by().values_list("pk", flat=True)
+    with_title_words = candidates.alias(title_words=title_words())
+    candidates = [
+        *(
+            with_title_words.filter(title_words=SearchQuery(word, config="simple"))[:limit]
+            for word in closest[SearchTerm.KIND.TitleWord]
+        ),
+        *(
+            candidates.filter(**{f"author__{field}": name})[:limit]
+            for field, kind in (
+                ("last_name", SearchTerm.KIND.LastName),
+                ("first_name", SearchTerm.KIND.FirstName),
+            )
+            for name in closest[kind]
+        ),
+    ]
+    if not candidates:
+        return books.none()
+    return (
+        books.filter(pk__in=list(candidates[0].union(*candidates[1:])))
+        .annotate(
+            similarity=Greatest(
+                TrigramWordSimilarity(terms, "title"),
+                TrigramSimilarity(
+                    Concat("author__first_name", Value(" "), "author__last_name"), terms
+                ),
+            )
+        )
+        .order_by("-similarity", "pk")[:limit]
+    )
@@ -0,0 +1,295 @@
+from django.db import transaction
+from django.db.models import F
+from django.db.models.signals import (
+    m2m_changed,
+    post_delete,
+    post_save,
+    pre_delete,
+    pre_save,
+)
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .cards import bump_versions
+from .models import (
+    Author,
+    Book,
+    BookInstance,
+    CopyCountDeltas,
+    Genre,
+    Language,
+    LibraryStats,
+    bulk_created,
+    copies_changed,
+    library_stats_changed,
+)
+from .page_cache import invalidate_tags
+from .search import add_author_names, refresh_search_vectors
+
+# Book fields that feed the search vector
+SEARCH_VECTOR_FIELDS = frozenset(("title", "summary", "author", "author_id"))
+
+
+# saves are handled by BookInstance.save() since it needs the previous row to compute the change,
+# but deletes are handled here since queryset deletes never call Model.delete() (the collector runs
+# them inside a transaction and sends this signal per row)
+@receiver(post_delete, sender=BookInstance)
+def remove_deleted_copy_from_counts(sender, instance: BookInstance, using, **kwargs):
+    deltas = CopyCountDeltas()
+    deltas.remove(instance.book_id, instance.status)  # type: ignore
+    deltas.apply(using=using)
+
+
+@receiver(post_save, sender=Book)
+def count_created_book(sender, instance: Book, created, using, raw=False, **kwargs):
+    if created and not raw:
+        LibraryStats.update_counters(using=using, num_books=F("num_books") + 1)
+
+
+@receiver(post_delete, sender=Book)
+def uncount_deleted_book(sender, instance: Book, using, **kwargs):
+    LibraryStats.update_counters(using=using, num_books=F("num_books") - 1)
+
+
+@receiver(post_save, sender=Author)
+def count_created_author(sender, instance: Author, created, using, raw=False, **kwargs):
+    if created and not raw:
+        LibraryStats.update_counters(using=using, num_authors=F("num_authors") + 1)
+
+
+@receiver(post_delete, sender=Author)
+def uncount_deleted_author(sender, instance: Author, using, **kwargs):
+    LibraryStats.update_counters(using=using, num_authors=F("num_authors") - 1)
+
+
+# search vectors are refreshed incrementally: only the books whose document text could have changed
+# are recomputed, each time with a single UPDATE
+
+
+@receiver(post_save, sender=Book)
+def refresh_saved_book_search_vector(
+    sender, instance: Book, update_fields, raw=False, **kwargs
+):
+    if raw or (
+        update_fields is not None and not SEARCH_VECTOR_FIELDS.intersection(update_fields)
+    ):
+        return
+    refresh_search_vectors(Book.objects.filter(pk=instance.pk))
+
+
+@receiver(m2m_changed, sender=Book.genre.through)
+def refresh_regenred_books_search_vectors(
+    sender, instance, action, reverse, pk_set, **kwargs
+):
+    if action not in ("post_add", "post_remove", "post_clear"):
+        return
+    if not reverse:
+        refresh_search_vectors(Book.objects.filter(pk=instance.pk))
+    elif action == "post_clear":
+        # pk_set is None on clear, so the affected books are captured in pre_clear
+        refresh_search_vectors(
+            Book.objects.filter(pk__in=getattr(instance, "_cleared_book_pks", []))
+        )
+    else:
+        refresh_search_vectors(Book.objects.filter(pk__in=pk_set))
+
+
+@receiver(m2m_changed, sender=Book.genre.through)
+def capture_cleared_genre_books(sender, instance, action, reverse, **kwargs):
+    if action == "pre_clear" and reverse:
+        instance._cleared_book_pks = list(instance.book_set.values_list("pk", flat=True))
+
+
+@receiver(post_save, sender=Author)
+def add_saved_author_names(sender, instance: Author, raw=False, **kwargs):
+    if not raw:
+        add_author_names([instance])
+
+
+@receiver(post_save, sender=Author)
+def refresh_author_books_search_vectors(
+    sender, instance: Author, created, raw=False, **kwargs
+):
+    if not created and not raw:
+        refresh_search_vectors(Book.objects.filter(author=instance))
+
+
+@receiver(post_save, sender=Genre)
+def refresh_genre_books_search_vectors(
+    sender, instance: Genre, created, raw=False, **kwargs
+):
+    if not created and not raw:
+        refresh_search_vectors(Book.objects.filter(genre=instance))
+
+
+@receiver(pre_delete, sender=Genre)
+def capture_deleted_genre_books(sender, instance: Genre, **kwargs):
+    # the m2m rows are cascade-deleted without sending m2m_changed
+    instance._deleted_book_pks = list(instance.book_set.values_list("pk", flat=True))
+
+
+@receiver(post_delete, sender=Genre)
+def refresh_deleted_genre_books_search_vectors(sender, instance: Genre, **kwargs):
+    refresh_search_vectors(
+        Book.objects.filter(pk__in=getattr(instance, "_deleted_book_pks", []))
+    )
+
+
+# cached cards (catalog.cards) showing a changed object are made stale once the change commits, so
+# a card isn't re-rendered from the old row in the meantime
+
+
+def bump_card_versions_on_commit(model, pks, using) -> None:
+    pks = list(pks)
+    transaction.on_commit(lambda: bump_versions(model, pks), using=using)
+
+
+@receiver(post_save, sender=Book)
+@receiver(post_save, sender=Author)
+@receiver(post_save, sender=Genre)
+@receiver(post_save, sender=Language)
+@receiver(post_delete, sender=Book)
+@receiver(post_delete, sender=Author)
+@receiver(post_delete, sender=Genre)
+@receiver(post_delete, sender=Language)
+def bump_changed_card_versions(sender, instance, using, raw=False, **kwargs):
+    if not raw:
+        bump_card_versions_on_commit(sender, [instance.pk], using)
+
+
+@receiver(m2m_changed, sender=Book.genre.through)
+def bump_regenred_book_card_versions(
+    sender, instance, action, reverse, pk_set, using, **kwargs
+):
+    if action not in ("post_add", "post_remove", "post_clear"):
+        return
+    if not reverse:
+        bump_card_versions_on_commit(Book, [instance.pk], using)
+    elif action == "post_clear":
+        bump_card_versions_on_commit(Book, getattr(instance, "_cleared_book_pks", []), using)
+    else:
+        bump_card_versions_on_commit(Book, pk_set, using)
+
+
+# cached pages (catalog.page_cache) are invalidated through the tags of what changed, also once the
+# change commits
+
+
+def invalidate_tags_on_commit(tags, using) -> None:
+    tags = list(tags)
+    transaction.on_commit(lambda: invalidate_tags(tags), using=using)
+
+
+@receiver(post_save, sender=Book)
+@receiver(post_delete, sender=Book)
+def invalidate_book_pages(sender, instance: Book, using, created=True, raw=False, **kwargs):
+    if not raw:
+        # only new and deleted books move the others between pages of the book list
+        tags = [f"book:{instance.pk}", "search", *(["books"] if created else [])]
+        invalidate_tags_on_commit(tags, using)
+
+
+@receiver(m2m_changed, sender=Book.genre.through)
+def invalidate_regenred_book_pages(sender, instance, action, reverse, pk_set, using, **kwargs):
+    if action not in ("post_add", "post_remove", "post_clear"):
+        return
+    if not reverse:
+        pks = [instance.pk]
+    elif action == "post_clear":
+        pks = getattr(instance, "_cleared_book_pks", [])
+    else:
+        pks = pk_set
+    invalidate_tags_on_commit([*(f"book:{pk}" for pk in pks), "search"], using)
+
+
+@receiver(post_save, sender=Author)
+@receiver(post_delete, sender=Author)
+def invalidate_author_pages(sender, instance: Author, using, raw=False, **kwargs):
+    if not raw:
+        invalidate_tags_on_commit([f"author:{instance.pk}", "authors", "search"], using)
+
+
+@receiver(post_save, sender=Genre)
+@receiver(post_delete, sender=Genre)
+def invalidate_genre_pages(sender, instance: Genre, using, raw=False, **kwargs):
+    if not raw:
+        invalidate_tags_on_commit([f"genre:{instance.pk}", "search"], using)
+
+
+@receiver(post_save, sender=Language)
+@receiver(post_delete, sender=Language)
+def invalidate_language_pages(sender, instance: Language, using, raw=False, **kwargs):
+    if not raw:
+        invalidate_tags_on_commit([f"language:{instance.pk}"], using)
+
+
+@receiver(post_save, sender=BookInstance)
+def invalidate_saved_copy_book_pages(
+    sender, instance: BookInstance, using, raw=False, **kwargs
+):
+    # e.g. renewals, which don't change any counters
+    if not raw and instance.book_id is not None:  # type: ignore
+        invalidate_tags_on_commit([f"book:{instance.book_id}"], using)  # type: ignore
+
+
+@receiver(copies_changed)
+def invalidate_changed_copies_book_pages(sender, book_ids, using, **kwargs):
+    invalidate_tags_on_commit((f"book:{pk}" for pk in book_ids), using)
+
+
+@receiver(library_stats_changed)
+def invalidate_stats_pages(sender, using, **kwargs):
+    invalidate_tags_on_commit(["stats"], using)
+
+
+@receiver(bulk_created, sender=Book)
+def invalidate_bulk_created_book_pages(sender, using, **kwargs):
+    invalidate_tags_on_commit(["books", "search"], using)
+
+
+@receiver(bulk_created, sender=Author)
+def invalidate_bulk_created_author_pages(sender, using, **kwargs):
+    invalidate_tags_on_commit(["authors", "search"], using)
+
+
+# updated_at (see catalog.conditional) is also moved forward on the rows whose pages show a change
+# made elsewhere: an author's when their books change, a book's when its genres do
+
+
+@receiver(pre_save, sender=Book)
+def capture_previous_book_author(sender, instance: Book, raw=False, **kwargs):
+    if not raw and not instance._state.adding:
+        instance._previous_author_id = (  # type: ignore
+            Book._base_manager.filter(pk=instance.pk).values_list("author_id", flat=True).first()
+        )
+
+
+@receiver(post_save, sender=Book)
+@receiver(post_delete, sender=Book)
+def touch_book_authors(sender, instance: Book, using, raw=False, **kwargs):
+    if not raw:
+        # the previous author's page loses the book
+        author_ids = {
+            instance.author_id,  # type: ignore
+            getattr(instance, "_previous_author_id", None),
+        }
+        author_ids.discard(None)
+        Author.objects.db_manager(using).filter(pk__in=author_ids).update(
+            updated_at=timezone.now()
+        )
+
+
+@receiver(m2m_changed, sender=Book.genre.through)
+def touch_regenred_books(sender, instance, action, reverse, pk_set, using, **kwargs):
+    if action not in ("post_add", "post_remove", "post_clear"):
+        return
+    if not reverse:
+        pks = [instance.pk]
+    elif action == "post_clear":
+        pks = getattr(instance, "_cleared_book_pks", [])
+    else:
+        pks = pk_set
+    now = timezone.now()
+    books = Book.objects.db_manager(using).filter(pk__in=pks)
+    Author.objects.db_manager(using).filter(book__in=books).update(updated_at=now)
+    books.update(updated_at=now)
@@ -0,0 +1,42 @@
+// fills the datalist of author lookup inputs with fuzzy matches for what has been typed so far
+const DEBOUNCE_MS = 200;
+
+document.querySelectorAll("input[data-lookup-url]").forEach((input) => {
+  const datalist = document.getElementById(input.getAttribute("list") ?? "");
+  if (!(input instanceof HTMLInputElement) || !datalist) {
+    return;
+  }
+
+  let timeout = 0;
+  let controller = new AbortController();
+
+  input.addEventListener("input", () => {
+    clearTimeout(timeout);
+    timeout = setTimeout(async () => {
+      const query = input.value.trim();
+      // a picked suggestion ends with its "(#id)" and doesn't need another lookup
+      if (query.length < 2 || /\(#\d+\)$/.test(query)) {
+        return;
+      }
+      // drop any slower response for an earlier query
+      controller.abort();
+      controller = new AbortController();
+      try {
+        const url = `${input.dataset.lookupUrl}?q=${encodeURIComponent(query)}`;
+        const response = await fetch(url, { signal: controller.signal });
+        const { results } = await response.json();
+        datalist.replaceChildren(
+          ...results.map((/** @type {{label: string}} */ author) => {
+            const option = document.createElement("option");
+            option.value = author.label;
+            return option;
+          })
+        );
+      } catch (error) {
+        if (!(error instanceof DOMException && error.name === "AbortError")) {
+          throw error;
+        }
+      }
+    }, DEBOUNCE_MS);
+  });
+});
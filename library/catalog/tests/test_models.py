@@ -1,10 +1,31 @@
+import datetime
+import json
+import tempfile
+from io import StringIO
+from pathlib import Path
 from typing import override
+from unittest import mock
 
+from django.contrib.auth import get_user_model
+from django.core import mail
+from django.core.management import call_command
+from django.db import DatabaseError
 from django.forms import ModelForm, ValidationError
-from django.test import TestCase
+from django.test import TestCase, override_settings
 from django.urls import reverse
 
-from catalog.models import Author
+from catalog.management.smtp_stub import SMTPStub
+from catalog.models import (
+    Author,
+    Book,
+    BookInstance,
+    CopyCountDeltas,
+    Genre,
+    ImportCheckpoint,
+    LibraryStats,
+    LoanReminder,
+)
+from core.models import OutboxEmail
 
 
 # TestCase creates a new DB for the test class and runs each test in its own transaction. There are
@@ -85,3 +106,319 @@ class AuthorModelTest(TestCase):
             AuthorModelTest.base_author.get_absolute_url(),
             reverse("catalog:author_detail", args=[1]),
         )
+
+
+class CopyCountsTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.book = Book.objects.create(title="Counted", summary="Summary")
+        cls.other_book = Book.objects.create(title="Also counted", summary="Summary")
+
+    def assertCounts(self, book, **expected):
+        # LibraryStats.load() is summed afresh, and unsaved
+        if book.pk is not None:
+            book.refresh_from_db()
+        for field, value in expected.items():
+            self.assertEqual(getattr(book, field), value, field)
+
+    def test_create_counts_copy(self):
+        BookInstance.objects.create(book=self.book)
+        self.assertCounts(self.book, copies_total=1, copies_available=1)
+        self.assertCounts(LibraryStats.load(), copies_total=1, copies_available=1)
+
+    def test_status_change_moves_copy_between_counters(self):
+        copy = BookInstance.objects.create(book=self.book)
+        copy.status = BookInstance.LOAN_STATUS.OnLoan
+        copy.save()
+        self.assertCounts(
+            self.book, copies_total=1, copies_available=0, copies_on_loan=1
+        )
+
+    def test_stale_instance_save_uses_stored_status(self):
+        copy = BookInstance.objects.create(book=self.book)
+        stale = BookInstance.objects.get(pk=copy.pk)
+        copy.status = BookInstance.LOAN_STATUS.Maintenance
+        copy.save()
+        stale.status = BookInstance.LOAN_STATUS.OnLoan
+        stale.save()
+        self.assertCounts(
+            self.book, copies_available=0, copies_maintenance=0, copies_on_loan=1
+        )
+
+    def test_moving_copy_to_other_book(self):
+        copy = BookInstance.objects.create(book=self.book)
+        copy.book = self.other_book
+        copy.save()
+        self.assertCounts(self.book, copies_total=0, copies_available=0)
+        self.assertCounts(self.other_book, copies_total=1, copies_available=1)
+
+    def test_delete_uncounts_copy(self):
+        BookInstance.objects.create(book=self.book)
+        BookInstance.objects.create(book=self.book).delete()
+        self.assertCounts(self.book, copies_total=1)
+        BookInstance.objects.all().delete()
+        self.assertCounts(self.book, copies_total=0, copies_available=0)
+        self.assertCounts(LibraryStats.load(), copies_total=0)
+
+    def test_bulk_writes_keep_counts(self):
+        BookInstance.objects.bulk_create(
+            [BookInstance(book=self.book) for _ in range(3)]
+            + [BookInstance(book=self.other_book)]
+        )
+        BookInstance.objects.filter(book=self.book).update(
+            status=BookInstance.LOAN_STATUS.Reserved
+        )
+        self.assertCounts(self.book, copies_total=3, copies_reserved=3)
+        self.assertCounts(self.other_book, copies_total=1, copies_available=1)
+        self.assertCounts(
+            LibraryStats.load(), copies_total=4, copies_reserved=3, copies_available=1
+        )
+
+    def test_bulk_writes_apply_counts_on_their_database(self):
+        apply = CopyCountDeltas.apply
+        with mock.patch.object(
+            CopyCountDeltas, "apply", autospec=True, side_effect=apply
+        ) as counted:
+            copies = BookInstance.objects.bulk_create([BookInstance(book=self.book)])
+            BookInstance.objects.filter(book=self.book).update(book=self.other_book)
+            BookInstance.objects.bulk_update(copies, ["status"])
+        aliases = {call.kwargs.get("using") for call in counted.call_args_list}
+        self.assertEqual(aliases, {"default"})
+
+    def test_bulk_create_rejects_conflicts(self):
+        copy = BookInstance.objects.create(book=self.book)
+        for conflicts in [{"ignore_conflicts": True}, {"update_conflicts": True}]:
+            with self.subTest(**conflicts), self.assertRaises(ValueError):
+                BookInstance.objects.bulk_create([copy], **conflicts)
+        self.assertCounts(self.book, copies_total=1, copies_available=1)
+
+    def test_library_stats_count_books_and_authors(self):
+        author = Author.objects.create(first_name="Counted", last_name="Author")
+        self.assertCounts(LibraryStats.load(), num_books=2, num_authors=1)
+        author.delete()
+        self.assertCounts(LibraryStats.load(), num_authors=0)
+
+    def test_library_stats_sum_the_slots(self):
+        LibraryStats.objects.all().delete()
+        LibraryStats.objects.create(pk=1, copies_total=3, copies_on_loan=-1)
+        LibraryStats.objects.create(pk=2, copies_total=1, copies_on_loan=2)
+        self.assertCounts(LibraryStats.load(), copies_total=4, copies_on_loan=1, num_books=0)
+
+    def test_reconcile_rebuilds_drifted_counts(self):
+        BookInstance.objects.create(book=self.book)
+        BookInstance.objects.create(
+            book=self.book, status=BookInstance.LOAN_STATUS.OnLoan
+        )
+        Book.objects.update(copies_total=0, copies_available=0, copies_on_loan=0)
+        LibraryStats.objects.update(copies_total=0, num_books=0)
+        LibraryStats.objects.create(pk=LibraryStats.SLOTS + 1, copies_total=5)
+        call_command("reconcile_copy_counts", batch_size=1, stdout=StringIO())
+        self.assertCounts(
+            self.book, copies_total=2, copies_available=1, copies_on_loan=1
+        )
+        self.assertCounts(self.other_book, copies_total=0)
+        self.assertCounts(LibraryStats.load(), copies_total=2, num_books=2)
+        self.assertEqual(LibraryStats.objects.filter(copies_total__gt=0).count(), 1)
+
+
+class ImportCatalogTest(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = Path(directory.name)
+        Book.objects.create(title="Already here", summary="", isbn="9780000000001")
+        Genre.objects.create(name="Fantasy")
+
+    def import_catalog(self, name, content, *args):
+        path = self.directory / name
+        path.write_text(content)
+        out, err = StringIO(), StringIO()
+        call_command("import_catalog", str(path), *args, stdout=out, stderr=err)
+        return out.getvalue(), err.getvalue()
+
+    def test_imports_csv(self):
+        out, err = self.import_catalog(
+            "books.csv",
+            "title,summary,isbn,author_first_name,author_last_name,language,genres,copies\n"
+            "The Hobbit,There and back,9780000000002,John,Tolkien,English,fantasy|Adventure,2\n"
+            "Silmarillion,,,John,Tolkien,English,Fantasy,1\n"
+            ",no title,,,,,,\n",
+        )
+        self.assertIn("Imported 2 books, 3 copies and 1 new authors", out)
+        self.assertIn("line 4: missing title", err)
+
+        hobbit = Book.objects.get(isbn="9780000000002")
+        self.assertEqual(str(hobbit.author), "Tolkien, John")
+        self.assertEqual(hobbit.language.name, "English")
+        # genres are matched case-insensitively
+        self.assertCountEqual(
+            hobbit.genre.values_list("name", flat=True), ["Fantasy", "Adventure"]
+        )
+        self.assertEqual((hobbit.copies_total, hobbit.copies_available), (2, 2))
+        self.assertEqual(Book.objects.get(title="Silmarillion").author, hobbit.author)
+        self.assertEqual(len(Book.objects.get(title="Silmarillion").isbn), 13)
+        self.assertEqual(Author.objects.count(), 1)
+        self.assertEqual(Book.objects.filter(search_vector="tolkien").count(), 2)
+
+        stats = LibraryStats.load()
+        self.assertEqual((stats.num_books, stats.num_authors), (3, 1))
+        self.assertEqual(stats.copies_total, 3)
+
+    def test_rejects_values_too_long_for_their_fields(self):
+        lines = [
+            {"title": "Long first name", "author_first_name": "x" * 101},
+            {"title": "Long last name", "author_last_name": "x" * 101},
+            {"title": "Long language", "language": "x" * 201},
+            {"title": "Long genre", "genres": ["Fantasy", "x" * 201]},
+            {"title": "Long summary", "summary": "x" * 1001},
+            {"title": "Fits", "summary": "x" * 1000, "author_last_name": "x" * 100},
+        ]
+        out, err = self.import_catalog(
+            "books.jsonl", "\n".join(json.dumps(line) for line in lines)
+        )
+        # the rest of the batch is still imported
+        self.assertIn("Imported 1 books", out)
+        self.assertIn("skipped 0 duplicate ISBNs and 5 invalid records", out)
+        for line, message in [
+            (1, "author first name longer than 100 characters"),
+            (2, "author last name longer than 100 characters"),
+            (3, "language longer than 200 characters"),
+            (4, "genre name longer than 200 characters"),
+            (5, "summary longer than 1000 characters"),
+        ]:
+            self.assertIn(f"line {line}: {message}", err)
+        self.assertTrue(Book.objects.filter(title="Fits").exists())
+
+    def test_invalidates_cached_pages(self):
+        with (
+            mock.patch("catalog.signals.invalidate_tags") as invalidate_tags,
+            self.captureOnCommitCallbacks(execute=True),
+        ):
+            self.import_catalog(
+                "books.jsonl", json.dumps({"title": "New", "author_last_name": "Newcomer"})
+            )
+        invalidated = {tag for call in invalidate_tags.call_args_list for tag in call.args[0]}
+        self.assertLessEqual({"books", "authors", "search", "stats"}, invalidated)
+
+    def test_skips_duplicate_isbns(self):
+        lines = [
+            {"title": "Duplicate of an existing book", "isbn": "9780000000001"},
+            {"title": "New", "isbn": "9780000000003", "genres": ["Poetry"]},
+            {"title": "Repeats the line above", "isbn": "9780000000003"},
+        ]
+        out, _ = self.import_catalog(
+            "books.jsonl", "\n".join(json.dumps(line) for line in lines), "--batch-size=2"
+        )
+        self.assertIn("Imported 1 books", out)
+        self.assertIn("skipped 2 duplicate ISBNs", out)
+        self.assertEqual(Book.objects.get(isbn="9780000000003").title, "New")
+
+    def test_resumes_from_checkpoint(self):
+        lines = "\n".join(json.dumps({"title": f"Book {i}"}) for i in range(5))
+        self.import_catalog("books.jsonl", lines, "--batch-size=2")
+        checkpoint = ImportCheckpoint.objects.get()
+        self.assertEqual(checkpoint.source, str((self.directory / "books.jsonl").resolve()))
+        self.assertEqual(checkpoint.records, 5)
+
+        # as if interrupted after the first batch
+        ImportCheckpoint.objects.update(records=2)
+        out, _ = self.import_catalog("books.jsonl", lines, "--batch-size=2")
+        self.assertIn("Resuming after 2 records", out)
+        self.assertEqual(Book.objects.filter(title="Book 0").count(), 1)
+        self.assertEqual(Book.objects.filter(title="Book 4").count(), 2)
+
+        self.import_catalog("books.jsonl", lines, "--restart")
+        self.assertEqual(Book.objects.filter(title="Book 0").count(), 2)
+
+    def test_checkpoint_is_rolled_back_with_its_batch(self):
+        lines = "\n".join(json.dumps({"title": f"Book {i}"}) for i in range(4))
+        # the second batch fails after its books are inserted
+        with (
+            mock.patch(
+                "catalog.management.commands.import_catalog.refresh_search_vectors",
+                side_effect=[None, DatabaseError],
+            ),
+            self.assertRaises(DatabaseError),
+        ):
+            self.import_catalog("books.jsonl", lines, "--batch-size=2")
+        self.assertEqual(ImportCheckpoint.objects.get().records, 2)
+        self.assertEqual(Book.objects.filter(title__startswith="Book").count(), 2)
+
+        out, _ = self.import_catalog("books.jsonl", lines, "--batch-size=2")
+        self.assertIn("Resuming after 2 records", out)
+        self.assertEqual(Book.objects.filter(title__startswith="Book").count(), 4)
+
+
+@override_settings(OUTBOX_DELIVERY_BACKEND="django.core.mail.backends.locmem.EmailBackend")
+class LoanRemindersTest(TestCase):
+    def setUp(self):
+        User = get_user_model()
+        self.alice = User.objects.create(username="alice", email="alice@example.com")
+        self.bob = User.objects.create(username="bob", email="bob@example.com")
+        no_email = User.objects.create(username="carol")
+        self.today = datetime.date(2030, 6, 10)
+        book = Book.objects.create(title="The Hobbit", summary="")
+        self.loans = {}
+        for name, borrower, days in [
+            ("alice late", self.alice, -2),
+            ("alice soon", self.alice, 1),
+            ("alice later", self.alice, 10),
+            ("bob soon", self.bob, 3),
+            ("carol late", no_email, -1),
+        ]:
+            self.loans[name] = BookInstance.objects.create(
+                book=book,
+                borrower=borrower,
+                status=BookInstance.LOAN_STATUS.OnLoan,
+                due_back=self.today + datetime.timedelta(days=days),
+            )
+
+    def send(self, *args, date=None):
+        out = StringIO()
+        call_command(
+            "send_loan_reminders", "--date", str(date or self.today), *args, stdout=out
+        )
+        return out.getvalue()
+
+    def test_one_message_per_borrower(self):
+        self.assertIn("Sent 2 reminders about 3 loans", self.send())
+        alice, bob = sorted(mail.outbox, key=lambda message: message.to)
+        self.assertEqual(alice.to, ["alice@example.com"])
+        self.assertIn("Overdue", alice.subject)
+        self.assertIn("2 days ago", alice.body)
+        self.assertIn("due back soon", alice.body)
+        self.assertIn("Reminder: 1 book due soon", bob.subject)
+        # delivered rather than queued in the outbox
+        self.assertFalse(OutboxEmail.objects.exists())
+        self.assertEqual(
+            LoanReminder.objects.get(copy=self.loans["alice late"]).kind,
+            LoanReminder.KIND.Overdue,
+        )
+
+    def test_reruns_only_send_whats_owed(self):
+        self.send()
+        self.assertIn("Sent 0 reminders", self.send())
+        self.assertEqual(len(mail.outbox), 2)
+
+        # a loan that has since become overdue, and a renewed one coming due again
+        self.loans["alice soon"].due_back = self.today - datetime.timedelta(days=1)
+        self.loans["alice soon"].save()
+        self.loans["bob soon"].due_back = self.today + datetime.timedelta(days=20)
+        self.loans["bob soon"].save()
+        out = self.send(date=self.today + datetime.timedelta(days=8))
+        self.assertIn("Sent 1 reminders about 2 loans", out)
+        self.assertEqual(mail.outbox[-1].to, ["alice@example.com"])
+        self.assertIn("The Hobbit (due June 9, 2030, 9 days ago)", mail.outbox[-1].body)
+        self.assertIn("The Hobbit (due June 20, 2030)", mail.outbox[-1].body)
+
+    def test_dry_run(self):
+        self.assertIn("Would send 2 reminders", self.send("--dry-run"))
+        self.assertEqual(mail.outbox, [])
+        self.assertFalse(LoanReminder.objects.exists())
+
+    def test_batches_share_one_smtp_connection(self):
+        with SMTPStub() as stub:
+            self.send("--smtp", f"127.0.0.1:{stub.port}", "--batch-size", "1")
+        self.assertEqual(len(stub.messages), 2)
+        self.assertEqual(stub.connections, 1)
+        self.assertEqual(LoanReminder.objects.count(), 3)
@@ -1,17 +1,37 @@
+import asyncio
+import csv
 import datetime
+import importlib
+import json
+import tempfile
 import uuid
+import warnings
+from io import StringIO
+from unittest import mock
 
+from asgiref.sync import sync_to_async
 from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.contrib.auth.models import (
     Permission,
 )
-from django.test import TestCase
-from django.urls import reverse
+from django.core.cache import caches
+from django.core.exceptions import ValidationError
+from django.core.handlers.asgi import ASGIHandler
+from django.core.management import CommandError, call_command
+from django.http import FileResponse
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.urls import clear_url_caches, resolve, reverse
 from django.utils import timezone
+from prometheus_client import REGISTRY
 
-from catalog.models import Author, Book, BookInstance, Genre, Language
+from catalog import async_views
+from catalog.context_processors import NAV_MENU_COOKIE_NAME, NAV_MENU_COOKIE_OPEN
+from catalog.forms import BookForm
+from catalog.management.query_budget import Measurement, growing
+from catalog.models import Author, Book, BookInstance, Genre, Language, LibraryStats
 from catalog.views import AllLoanedBooksListView
+from core.replicas import ReplicaRouter
 
 
 # views are tested using the django test Client, which is a dummy web browser with lots of useful
@@ -274,3 +294,980 @@ class RenewBookInstancesViewTest(TestUserTestCase):
         )
         self.assertRedirects(response, reverse("catalog:all_borrowed"))
 
+
+class BookSearchTest(TestUserTestCase):
+    def setUp(self):
+        super().setUp()
+        self.other_book = Book.objects.create(
+            title="Gardening for Dragons", summary="Raising vegetables in caves"
+        )
+
+    def search(self, url_name, terms):
+        return self.client.get(reverse(url_name), {"search": terms})
+
+    def test_book_list_search_matches_title_author_and_genre(self):
+        for terms in ["title", "smith", "fantasy"]:
+            response = self.search("catalog:books", terms)
+            self.assertEqual(list(response.context["book_list"]), [self.test_book])
+
+    def test_searches_are_timed(self):
+        def count(target, match):
+            return REGISTRY.get_sample_value(
+                "catalog_search_seconds_count", {"target": target, "match": match}
+            ) or 0
+
+        before = [count("books", "fulltext"), count("books", "fuzzy")]
+        self.search("catalog:books", "dragons")
+        self.search("catalog:books", "dargons")
+        self.client.get(reverse("catalog:books"))
+        self.assertEqual(
+            [count("books", "fulltext"), count("books", "fuzzy")], [before[0] + 1, before[1] + 1]
+        )
+
+    def test_book_list_search_ranks_title_matches_first(self):
+        # 'dragons' is in the other book's title but only in this book's summary
+        self.test_book.summary = "Dragons everywhere"
+        self.test_book.save()
+        response = self.search("catalog:books", "dragon")
+        self.assertEqual(
+            list(response.context["book_list"]), [self.other_book, self.test_book]
+        )
+
+    def test_search_follows_author_and_genre_renames(self):
+        author = self.test_book.author
+        author.last_name = "Tolkien"
+        author.save()
+        genre = Genre.objects.get(name="Fantasy")
+        genre.name = "Mythopoeia"
+        genre.save()
+        self.other_book.genre.add(genre)
+        for terms, expected in [
+            ("tolkien", [self.test_book]),
+            ("smith", []),
+            ("mythopoeia", [self.test_book, self.other_book]),
+        ]:
+            response = self.search("catalog:books", terms)
+            self.assertCountEqual(response.context["book_list"], expected)
+
+    def test_loaned_books_search(self):
+        permission = Permission.objects.get(codename="change_bookinstance")
+        self.test_user2.user_permissions.add(permission)
+        self.client.login(
+            username=self.test_user2.username, password=self.test_user2.raw_password
+        )
+        for book in [self.test_book, self.other_book]:
+            BookInstance.objects.create(
+                book=book,
+                borrower=self.test_user1,
+                due_back=datetime.date.today(),
+                status=BookInstance.LOAN_STATUS.OnLoan,
+            )
+        response = self.search("catalog:all_borrowed", "gardening")
+        self.assertEqual(
+            [copy.book for copy in response.context["books_list"]], [self.other_book]
+        )
+
+
+class FuzzyLookupTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.tolkien = Author.objects.create(first_name="John", last_name="Tolkien")
+        cls.le_guin = Author.objects.create(first_name="Ursula", last_name="Le Guin")
+        cls.hobbit = Book.objects.create(
+            title="The Hobbit", summary="There and back again", author=cls.tolkien
+        )
+
+    def test_author_list_search_tolerates_typos(self):
+        response = self.client.get(reverse("catalog:authors"), {"search": "Tolkein"})
+        self.assertEqual(list(response.context["author_list"]), [self.tolkien])
+
+    def test_book_list_falls_back_to_fuzzy_titles(self):
+        response = self.client.get(reverse("catalog:books"), {"search": "hobit"})
+        self.assertTrue(response.context["fuzzy"])
+        self.assertEqual(list(response.context["book_list"]), [self.hobbit])
+
+    def test_book_list_fuzzy_matches_author_names(self):
+        response = self.client.get(reverse("catalog:books"), {"search": "tolkein"})
+        self.assertEqual(list(response.context["book_list"]), [self.hobbit])
+
+    def test_fuzzy_lookups_follow_renames(self):
+        self.hobbit.title = "The Silmarillion"
+        self.hobbit.save()
+        self.tolkien.last_name = "Tolkien-Reuel"
+        self.tolkien.save()
+        response = self.client.get(reverse("catalog:books"), {"search": "silmarilion"})
+        self.assertEqual(list(response.context["book_list"]), [self.hobbit])
+        response = self.client.get(reverse("catalog:authors"), {"search": "Tolkein-Reuel"})
+        self.assertEqual(list(response.context["author_list"]), [self.tolkien])
+
+    def test_author_lookup_returns_labelled_matches(self):
+        response = self.client.get(reverse("catalog:author_lookup"), {"q": "Ursla"})
+        self.assertEqual(
+            response.json()["results"],
+            [{"id": self.le_guin.pk, "label": f"Le Guin, Ursula (#{self.le_guin.pk})"}],
+        )
+
+    def test_book_form_author_field(self):
+        field = BookForm().fields["author"]
+        self.assertEqual(field.clean(f"Tolkien, John (#{self.tolkien.pk})"), self.tolkien)
+        self.assertEqual(field.clean("tolkien, john"), self.tolkien)
+        with self.assertRaisesMessage(ValidationError, "Did you mean: Tolkien, John"):
+            field.clean("Tolkein, John")
+
+
+class CursorPaginationTest(TestUserTestCase):
+    def setUp(self):
+        super().setUp()
+        # repeated due dates, so paging has to fall back to the pk tie-breaker
+        for copy in range(23):
+            BookInstance.objects.create(
+                book=self.test_book,
+                due_back=datetime.date.today() + datetime.timedelta(days=copy % 3),
+                borrower=self.test_user1,
+                status=BookInstance.LOAN_STATUS.OnLoan,
+            )
+        self.client.login(
+            username=self.test_user1.username, password=self.test_user1.raw_password
+        )
+        self.url = reverse("catalog:my_borrowed")
+
+    def get_page(self, cursor=None):
+        response = self.client.get(self.url, {"cursor": cursor} if cursor else {})
+        self.assertTrue(response.context["cursor_paginated"])
+        return response.context["page_obj"]
+
+    def test_next_and_previous_cursors_walk_the_whole_list(self):
+        expected = list(
+            BookInstance.objects.filter(borrower=self.test_user1).order_by("due_back", "pk")
+        )
+        pages = [self.get_page()]
+        while pages[-1].has_next():
+            pages.append(self.get_page(pages[-1].next_cursor))
+        self.assertEqual([len(page) for page in pages], [10, 10, 3])
+        self.assertEqual([copy for page in pages for copy in page], expected)
+        self.assertFalse(pages[0].has_previous())
+
+        back = self.get_page(pages[-1].previous_cursor)
+        self.assertEqual(list(back), list(pages[1]))
+        self.assertTrue(back.has_next())
+        self.assertTrue(back.has_previous())
+
+        last = self.get_page(pages[0].last_cursor)
+        self.assertEqual(list(last), expected[-10:])
+        self.assertFalse(last.has_next())
+        self.assertEqual(list(self.get_page(last.previous_cursor)), expected[3:13])
+
+    def test_author_list_cursor_follows_name_ordering(self):
+        for name in ["Adams", "Brown", "Brown", "Clark", "Adams", "Smith"]:
+            Author.objects.create(first_name="Ann", last_name=name)
+        url = reverse("catalog:authors")
+        seen = []
+        response = self.client.get(url)
+        while True:
+            seen += response.context["author_list"]
+            page = response.context["page_obj"]
+            if not page.has_next():
+                break
+            response = self.client.get(url, {"cursor": page.next_cursor})
+        self.assertEqual(seen, list(Author.objects.order_by("last_name", "first_name", "pk")))
+
+    def test_invalid_cursor_is_not_found(self):
+        for cursor in ["nonsense", "WyJ4IiwgbnVsbF0"]:
+            response = self.client.get(self.url, {"cursor": cursor})
+            self.assertEqual(response.status_code, 404)
+
+    def test_page_numbers_still_work(self):
+        response = self.client.get(self.url, {"page": 3})
+        self.assertFalse(response.context["cursor_paginated"])
+        self.assertEqual(len(response.context["books_list"]), 3)
+
+
+class AuditQueryPlansTest(TestUserTestCase):
+    def setUp(self):
+        super().setUp()
+        BookInstance.objects.create(
+            book=self.test_book,
+            borrower=self.test_user1,
+            due_back=datetime.date.today(),
+            status=BookInstance.LOAN_STATUS.OnLoan,
+        )
+
+    def test_audits_every_catalog_page(self):
+        out = StringIO()
+        call_command("audit_query_plans", stdout=out)
+        for url in [
+            reverse("catalog:books"),
+            reverse("catalog:all_borrowed"),
+            self.test_book.get_absolute_url(),
+        ]:
+            self.assertIn(f"{url}: ", out.getvalue())
+        self.assertIn("No sequential scans", out.getvalue())
+
+    def test_reports_sequential_scans(self):
+        # tables this small are always scanned sequentially
+        out = StringIO()
+        with self.assertRaisesMessage(CommandError, "sequential scan(s)"):
+            call_command("audit_query_plans", "--min-rows", "0", stdout=out)
+        self.assertIn("Seq Scan on catalog_book", out.getvalue())
+
+
+class QueryBudgetTest(TestCase):
+    def check_query_budget(self, *args):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        report = f"{directory.name}/report.json"
+        out = StringIO()
+        try:
+            call_command(
+                "check_query_budget", "--sizes", "2", "12", "--report", report, *args, stdout=out
+            )
+        finally:
+            self.out = out.getvalue()
+        with open(report) as file:
+            return json.load(file)
+
+    def test_reports_every_page(self):
+        report = self.check_query_budget()
+        self.assertEqual(report["sizes"], [2, 12])
+        for name in [
+            "catalog:index",
+            "catalog:book_detail",
+            "catalog:author_detail",
+            "catalog:books ?search=budgetword",
+            "catalog:export ?live",
+            "account_login",
+        ]:
+            self.assertIn(name, report["pages"])
+        book_detail = report["pages"]["catalog:book_detail"]
+        self.assertEqual(book_detail["2"]["status"], 200)
+        self.assertEqual(book_detail["2"]["queries"], book_detail["12"]["queries"])
+        self.assertEqual(report["growing"], {})
+        self.assertIn("No page's query count grows", self.out)
+
+    def test_growing_query_counts(self):
+        def measured(queries):
+            return Measurement("page", "/page/", 200, queries, 1.0)
+
+        self.assertEqual(
+            growing(
+                {
+                    "steady": {10: measured(5), 1000: measured(5)},
+                    "n+1": {10: measured(14), 1000: measured(1004)},
+                }
+            ),
+            {"n+1": {10: 14, 1000: 1004}},
+        )
+
+
+class DetailViewQueriesTest(TestUserTestCase):
+    def setUp(self):
+        super().setUp()
+        self.author = self.test_book.author
+        genre = Genre.objects.get()
+        for i in range(25):
+            book = Book.objects.create(title=f"Sequel {i:02d}", summary="", author=self.author)
+            book.genre.add(genre)
+        BookInstance.objects.bulk_create(
+            BookInstance(book=self.test_book) for _ in range(30)
+        )
+        BookInstance.objects.create(
+            book=self.test_book,
+            status=BookInstance.LOAN_STATUS.OnLoan,
+            borrower=self.test_user1,
+            due_back=datetime.date(2030, 1, 2),
+        )
+
+    def test_author_detail_pages_through_books(self):
+        # version (catalog.conditional), author, one page of books, their genres
+        with self.assertNumQueries(4):
+            response = self.client.get(self.author.get_absolute_url())
+        self.assertEqual(
+            [book.title for book in response.context["books"]][:2], ["Book Title", "Sequel 00"]
+        )
+        self.assertEqual(len(response.context["books"]), 20)
+        self.assertContains(response, "<strong>Genres:</strong>\n    Fantasy", count=20)
+
+        page = response.context["books"]
+        response = self.client.get(self.author.get_absolute_url(), {"cursor": page.next_cursor})
+        self.assertEqual(len(response.context["books"]), 6)
+        self.assertFalse(response.context["books"].has_next())
+
+    def test_book_detail_pages_through_copies_by_status(self):
+        # version (catalog.conditional), book with author and language, its genres, one page of
+        # copies
+        with self.assertNumQueries(4):
+            response = self.client.get(self.test_book.get_absolute_url())
+        self.assertEqual(response.context["copy_status"], BookInstance.LOAN_STATUS.Available)
+        self.assertContains(response, "Available: 30")
+        self.assertContains(response, "On loan: 1")
+        self.assertEqual(len(response.context["copies"]), 20)
+        self.assertTrue(response.context["copies"].has_next())
+
+        response = self.client.get(self.test_book.get_absolute_url(), {"status": "o"})
+        self.assertEqual(len(response.context["copies"]), 1)
+        self.assertContains(response, "Due back: Jan. 2, 2030")
+
+
+@override_settings(
+    CACHES={
+        "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"},
+        "fragments": {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+            "LOCATION": "fragments",
+        },
+        "pages": {"BACKEND": "django.core.cache.backends.dummy.DummyCache"},
+    }
+)
+class CardCacheTest(TestUserTestCase):
+    def setUp(self):
+        super().setUp()
+        caches["fragments"].clear()
+        permission = Permission.objects.get(codename="change_book")
+        self.test_user2.user_permissions.add(permission)
+
+    def get_books(self, **params):
+        return self.client.get(reverse("catalog:books"), params)
+
+    def test_cards_are_cached_until_their_objects_change(self):
+        self.get_books()
+        # the page's version (catalog.conditional), the books, and no author query for the cached
+        # card
+        with self.assertNumQueries(2):
+            response = self.get_books()
+        self.assertContains(response, "Author: Smith, John")
+        self.assertContains(response, "0 of 0 copies available")
+
+        # copy counters are rendered around the card, so they're current without a new version
+        BookInstance.objects.create(book=self.test_book)
+        self.assertContains(self.get_books(), "1 of 1 copies available")
+
+        author = self.test_book.author
+        author.last_name = "Smithers"
+        with self.captureOnCommitCallbacks(execute=True):
+            author.save()
+        self.assertContains(self.get_books(), "Author: Smithers, John")
+
+        self.test_book.title = "Retitled"
+        with self.captureOnCommitCallbacks(execute=True):
+            self.test_book.save()
+        self.assertContains(self.get_books(), "Retitled")
+
+    def test_genre_changes_refresh_author_page_cards(self):
+        url = self.test_book.author.get_absolute_url()
+        self.assertContains(self.client.get(url), "Fantasy")
+        genre = Genre.objects.get()
+        genre.name = "Science Fiction"
+        with self.captureOnCommitCallbacks(execute=True):
+            genre.save()
+        self.assertContains(self.client.get(url), "Science Fiction")
+
+        with self.captureOnCommitCallbacks(execute=True):
+            genre.book_set.clear()
+        self.assertNotContains(self.client.get(url), "Science Fiction")
+
+    def test_cards_are_shared_but_buttons_are_per_user(self):
+        self.assertNotContains(self.get_books(), "Update")
+        self.client.login(
+            username=self.test_user2.username, password=self.test_user2.raw_password
+        )
+        # the anonymous user's cached card, with this user's buttons
+        response = self.get_books()
+        self.assertContains(response, reverse("catalog:book_update", args=[self.test_book.pk]))
+        self.assertNotIn("Update", caches["fragments"].get(f"card:book:{self.test_book.pk}")[1])
+
+    def test_cards_newer_than_replica_lag_are_not_stored(self):
+        # the primary stands in for a replica
+        with self.settings(DATABASE_REPLICAS=["default"], DATABASE_REPLICA_STICKY_SECONDS=60):
+            self.get_books()
+            # the versions made just now may be newer than what was read, so the card is rendered
+            # again, author included
+            with self.assertNumQueries(3):
+                self.get_books()
+        with self.assertNumQueries(3):
+            self.get_books()
+        with self.assertNumQueries(2):
+            self.get_books()
+
+
+@override_settings(
+    CACHES={
+        "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"},
+        "fragments": {"BACKEND": "django.core.cache.backends.dummy.DummyCache"},
+        "pages": {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+            "LOCATION": "pages",
+        },
+    }
+)
+class PageCacheTest(TestUserTestCase):
+    def setUp(self):
+        super().setUp()
+        caches["pages"].clear()
+        self.copy = BookInstance.objects.create(book=self.test_book)
+
+    def get(self, url, **params):
+        return self.client.get(url, params, secure=True)
+
+    def test_anonymous_pages_are_served_until_what_they_show_changes(self):
+        url = self.test_book.get_absolute_url()
+        self.assertEqual(self.get(url)["X-Page-Cache"], "miss")
+        with self.assertNumQueries(0):
+            response = self.get(url)
+        self.assertEqual(response["X-Page-Cache"], "hit")
+        self.assertContains(response, "Available: 1")
+
+        with self.captureOnCommitCallbacks(execute=True):
+            BookInstance.objects.transition(
+                self.copy.pk,
+                BookInstance.LOAN_STATUS.Available,
+                status=BookInstance.LOAN_STATUS.OnLoan,
+                borrower=self.test_user1,
+                due_back=datetime.date(2030, 1, 2),
+            )
+        response = self.get(url)
+        self.assertEqual(response["X-Page-Cache"], "miss")
+        self.assertContains(response, "On loan: 1")
+
+        # the author's other pages aren't affected by the loan, but are by a rename
+        self.get(reverse("catalog:authors"))
+        self.assertEqual(self.get(reverse("catalog:authors"))["X-Page-Cache"], "hit")
+        author = self.test_book.author
+        author.first_name = "Jon"
+        with self.captureOnCommitCallbacks(execute=True):
+            author.save()
+        self.assertContains(self.get(reverse("catalog:authors")), "Smith, Jon")
+        self.assertContains(self.get(url), "Jon")
+
+    def test_pages_vary_on_page_params_and_nav_menu_cookie_only(self):
+        books = reverse("catalog:books")
+        self.get(books)
+        self.assertEqual(self.get(books, utm_source="x")["X-Page-Cache"], "hit")
+        self.assertEqual(self.get(books, search="Book")["X-Page-Cache"], "miss")
+        self.client.cookies[NAV_MENU_COOKIE_NAME] = NAV_MENU_COOKIE_OPEN
+        self.assertEqual(self.get(books)["X-Page-Cache"], "miss")
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Book.objects.create(title="Another Book", summary="", author=self.test_book.author)
+        self.assertContains(self.get(books), "Another Book")
+
+    def test_cached_pages_carry_each_users_csrf_token(self):
+        index = reverse("catalog:index")
+        first = self.get(index)
+        other_client = self.client_class()
+        second = other_client.get(index, secure=True)
+        self.assertEqual(second["X-Page-Cache"], "hit")
+        self.assertNotIn(first.cookies["csrftoken"].value, second.content.decode())
+        self.assertNotContains(second, 'name="csrfmiddlewaretoken" value=""')
+        self.assertIn("csrftoken", second.cookies)
+
+    def test_signed_in_users_are_not_served_cached_pages(self):
+        url = self.test_book.get_absolute_url()
+        self.get(url)
+        self.client.login(
+            username=self.test_user1.username, password=self.test_user1.raw_password
+        )
+        response = self.get(url)
+        self.assertNotIn("X-Page-Cache", response)
+        self.assertContains(response, "Create new copy")
+
+
+class ConditionalGetTest(TestUserTestCase):
+    def setUp(self):
+        super().setUp()
+        self.copy = BookInstance.objects.create(book=self.test_book)
+        self.client.login(
+            username=self.test_user1.username, password=self.test_user1.raw_password
+        )
+
+    def revisit(self, url, response, **params):
+        return self.client.get(url, params, HTTP_IF_NONE_MATCH=response["ETag"])
+
+    def test_unchanged_pages_are_not_modified(self):
+        url = self.test_book.get_absolute_url()
+        response = self.client.get(url)
+        self.assertIn("Last-Modified", response)
+        # the session, the user and the version, and nothing rendered
+        with self.assertNumQueries(3):
+            self.assertEqual(self.revisit(url, response).status_code, 304)
+        # a different page of copies isn't the same page
+        self.assertEqual(self.revisit(url, response, status="o").status_code, 200)
+
+    def test_book_page_changes_with_its_copies_author_and_genres(self):
+        url = self.test_book.get_absolute_url()
+        response = self.client.get(url)
+        self.copy.due_back = datetime.date(2030, 1, 2)
+        self.copy.save()
+        response = self.assert_modified(url, response)
+
+        BookInstance.objects.transition(
+            self.copy.pk,
+            BookInstance.LOAN_STATUS.Available,
+            status=BookInstance.LOAN_STATUS.Maintenance,
+        )
+        response = self.assert_modified(url, response)
+
+        author = self.test_book.author
+        author.first_name = "Jon"
+        author.save()
+        response = self.assert_modified(url, response)
+
+        self.test_book.genre.clear()
+        self.assert_modified(url, response)
+
+    def test_list_and_author_pages_change_with_their_books(self):
+        books, author_url = reverse("catalog:books"), self.test_book.author.get_absolute_url()
+        book_list, author_page = self.client.get(books), self.client.get(author_url)
+        Book.objects.create(title="Sequel", summary="", author=self.test_book.author)
+        self.assert_modified(books, book_list)
+        self.assert_modified(author_url, author_page)
+
+        index = reverse("catalog:index")
+        response = self.client.get(index)
+        BookInstance.objects.create(book=self.test_book)
+        self.assert_modified(index, response)
+
+    def test_pages_differ_per_user(self):
+        url = self.test_book.get_absolute_url()
+        response = self.client.get(url)
+        self.client.logout()
+        self.assertEqual(self.revisit(url, response).status_code, 200)
+
+    def assert_modified(self, url, response):
+        # timestamps may only move forward by microseconds, so the ETag is what's compared
+        revisited = self.revisit(url, response)
+        self.assertEqual(revisited.status_code, 200)
+        self.assertNotEqual(revisited["ETag"], response["ETag"])
+        return revisited
+
+
+@override_settings(DATABASE_REPLICAS=["default"])
+class ReplicaReadsTest(TestUserTestCase):
+    def test_index_reads_from_the_replica(self):
+        self.client.force_login(self.test_user1)
+        # the primary stands in for the replica, so the aliases the router picks are recorded
+        routes = []
+        db_for_read, db_for_write = ReplicaRouter.db_for_read, ReplicaRouter.db_for_write
+
+        def record(route):
+            def wrapper(router, model, **hints):
+                alias = route(router, model, **hints)
+                routes.append((route.__name__, model, alias))
+                return alias
+
+            return wrapper
+
+        with (
+            mock.patch.object(ReplicaRouter, "db_for_read", record(db_for_read)),
+            mock.patch.object(ReplicaRouter, "db_for_write", record(db_for_write)),
+        ):
+            self.assertContains(self.client.get(reverse("catalog:index")), "copies")
+        # the stats (and its version) are read from the replica, and nothing's written
+        stats_routes = {(route, alias) for route, model, alias in routes if model is LibraryStats}
+        self.assertEqual(stats_routes, {("db_for_read", "default")})
+        self.assertNotIn("db_for_write", [route for route, _, _ in routes])
+
+
+def reload_urlconf():
+    # catalog.urls picks its read-only views by settings.ASYNC_VIEWS as it's imported
+    importlib.reload(importlib.import_module("catalog.urls"))
+    importlib.reload(importlib.import_module(settings.ROOT_URLCONF))
+    clear_url_caches()
+
+
+@override_settings(
+    ASYNC_VIEWS=True,
+    CACHES={
+        "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"},
+        "fragments": {"BACKEND": "django.core.cache.backends.dummy.DummyCache"},
+        "pages": {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+            "LOCATION": "async-pages",
+        },
+    },
+)
+class AsyncViewsTest(TestUserTestCase):
+    @classmethod
+    def setUpClass(cls):
+        # cleanups run in reverse, so this one runs after the settings are restored
+        cls.addClassCleanup(reload_urlconf)
+        super().setUpClass()
+        reload_urlconf()
+
+    def setUp(self):
+        super().setUp()
+        caches["pages"].clear()
+        self.copy = BookInstance.objects.create(book=self.test_book)
+
+    def test_read_only_pages_are_async(self):
+        self.assertIs(resolve(reverse("catalog:books")).func, async_views.book_list)
+        self.assertIs(
+            resolve(self.test_book.get_absolute_url()).func, async_views.book_detail
+        )
+
+    async def test_pages(self):
+        author_url = await sync_to_async(self.test_book.author.get_absolute_url)()
+        for url, params, text in [
+            (reverse("catalog:index"), {}, "A library that works for you"),
+            (reverse("catalog:books"), {}, "Author: Smith, John"),
+            (reverse("catalog:books"), {"search": "summary"}, "Book Title"),
+            (reverse("catalog:books"), {"search": "Smiht"}, "Book Title"),
+            (reverse("catalog:books"), {"page": "last"}, "Book Title"),
+            (self.test_book.get_absolute_url(), {}, "Available: 1"),
+            (reverse("catalog:authors"), {}, "Smith, John"),
+            (reverse("catalog:authors"), {"search": "Smth"}, "Smith, John"),
+            (author_url, {}, "Book Title"),
+        ]:
+            with self.subTest(url=url, **params):
+                self.assertContains(await self.async_client.get(url, params), text)
+        response = await self.async_client.get(reverse("catalog:books"), {"page": "2"})
+        self.assertEqual(response.status_code, 404)
+        response = await self.async_client.get(reverse("catalog:book_detail", args=[0]))
+        self.assertEqual(response.status_code, 404)
+
+    async def test_pages_are_cached_and_conditional(self):
+        url = self.test_book.get_absolute_url()
+        self.assertEqual((await self.async_client.get(url))["X-Page-Cache"], "miss")
+        self.assertEqual((await self.async_client.get(url))["X-Page-Cache"], "hit")
+
+        await self.async_client.aforce_login(self.test_user1)
+        response = await self.async_client.get(url)
+        self.assertNotIn("X-Page-Cache", response)
+        self.assertContains(response, "Available: 1")
+        revisit = await self.async_client.get(url, headers={"if-none-match": response["ETag"]})
+        self.assertEqual(revisit.status_code, 304)
+
+
+class ExportTest(TestUserTestCase):
+    def setUp(self):
+        super().setUp()
+        self.loan = BookInstance.objects.create(
+            book=self.test_book,
+            borrower=self.test_user1,
+            due_back=datetime.date(2030, 1, 2),
+            status=BookInstance.LOAN_STATUS.OnLoan,
+        )
+        BookInstance.objects.create(book=self.test_book)
+        permission = Permission.objects.get(codename="change_bookinstance")
+        self.test_user2.user_permissions.add(permission)
+        self.client.login(
+            username=self.test_user2.username, password=self.test_user2.raw_password
+        )
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.snapshots = override_settings(EXPORT_SNAPSHOT_ROOT=directory.name)
+        self.snapshots.enable()
+        self.addCleanup(self.snapshots.disable)
+
+    def export(self, name, export_format, **params):
+        return self.client.get(
+            reverse("catalog:export", args=[name, export_format]), params
+        )
+
+    def test_requires_permission(self):
+        self.client.login(
+            username=self.test_user1.username, password=self.test_user1.raw_password
+        )
+        self.assertEqual(self.export("loans", "csv").status_code, 403)
+
+    def test_unknown_export_is_not_found(self):
+        self.assertEqual(self.export("users", "csv").status_code, 404)
+        self.assertEqual(self.export("books", "xml").status_code, 404)
+
+    def test_streams_books_csv(self):
+        response = self.export("books", "csv")
+        self.assertTrue(response.streaming)
+        self.assertEqual(
+            response["Content-Disposition"], 'attachment; filename="books.csv"'
+        )
+        rows = list(csv.DictReader(b"".join(response.streaming_content).decode().splitlines()))
+        self.assertEqual(len(rows), 1)
+        self.assertEqual(rows[0]["title"], "Book Title")
+        self.assertEqual(rows[0]["author"], "Smith, John")
+        self.assertEqual(rows[0]["genres"], "Fantasy")
+        self.assertEqual(rows[0]["copies_total"], "2")
+
+    def test_streams_loans_jsonl(self):
+        response = self.export("loans", "jsonl")
+        lines = b"".join(response.streaming_content).decode().splitlines()
+        self.assertEqual(
+            [json.loads(line) for line in lines],
+            [
+                {
+                    "id": str(self.loan.pk),
+                    "book_id": self.test_book.pk,
+                    "title": "Book Title",
+                    "author": "Smith, John",
+                    "borrower": self.test_user1.username,
+                    "due_back": "2030-01-02",
+                }
+            ],
+        )
+
+    def test_serves_snapshots(self):
+        call_command("export_snapshots", "copies", "--format=csv", stdout=StringIO())
+        response = self.export("copies", "csv")
+        self.assertIsInstance(response, FileResponse)
+        self.assertEqual(len(b"".join(response.streaming_content).splitlines()), 3)
+
+        # later changes only show up in a live export (or the next snapshot)
+        BookInstance.objects.create(book=self.test_book)
+        response = self.export("copies", "csv", live="")
+        self.assertEqual(len(b"".join(response.streaming_content).splitlines()), 4)
+
+        with self.settings(EXPORT_SNAPSHOT_ACCEL_PREFIX="/protected-exports/"):
+            response = self.export("copies", "csv")
+        self.assertEqual(response["X-Accel-Redirect"], "/protected-exports/copies.csv")
+        self.assertEqual(response.content, b"")
+
+
+@override_settings(ASYNC_VIEWS=True)
+class AsyncExportTest(TransactionTestCase):
+    # a TransactionTestCase, since ASGIHandler runs the view in a thread (and on a database
+    # connection) of the request's own, which wouldn't see a TestCase's uncommitted rows
+    @classmethod
+    def setUpClass(cls):
+        cls.addClassCleanup(reload_urlconf)
+        super().setUpClass()
+        reload_urlconf()
+
+    def setUp(self):
+        super().setUp()
+        user = get_user_model().objects.create_user(username="librarian")
+        user.user_permissions.add(Permission.objects.get(codename="change_bookinstance"))
+        self.client.force_login(user)
+        author = Author.objects.create(first_name="John", last_name="Smith")
+        for number in range(3):
+            Book.objects.create(title=f"Book {number}", isbn=str(number), author=author)
+
+    async def get(self, path: str) -> list[dict]:
+        """The messages ASGIHandler sends for a GET of `path`."""
+        messages = []
+        requests = asyncio.Queue()
+        requests.put_nowait({"type": "http.request", "body": b"", "more_body": False})
+
+        async def receive():
+            # the request, then nothing (the client doesn't disconnect)
+            return await requests.get()
+
+        async def send(message):
+            messages.append(message)
+
+        session = self.client.cookies[settings.SESSION_COOKIE_NAME]
+        cookie = f"{session.key}={session.value}"
+        scope = {
+            "type": "http",
+            "asgi": {"version": "3.0"},
+            "http_version": "1.1",
+            "method": "GET",
+            "scheme": "http",
+            "path": path,
+            "raw_path": path.encode(),
+            "query_string": b"",
+            "root_path": "",
+            "headers": [(b"host", b"testserver"), (b"cookie", cookie.encode())],
+            "client": ("127.0.0.1", 1234),
+            "server": ("testserver", 80),
+        }
+        await ASGIHandler()(scope, receive, send)
+        return messages
+
+    async def test_export_is_streamed_under_asgi(self):
+        self.assertIs(
+            resolve(reverse("catalog:export", args=["books", "csv"])).func, async_views.export
+        )
+        # a chunk per line
+        with (
+            mock.patch("catalog.exports.EXPORT_WRITE_SIZE", 1),
+            warnings.catch_warnings(record=True) as caught,
+        ):
+            warnings.simplefilter("always")
+            messages = await self.get(reverse("catalog:export", args=["books", "csv"]))
+        # no "StreamingHttpResponse must consume synchronous iterators" (into a list)
+        self.assertEqual([str(warning.message) for warning in caught], [])
+        self.assertEqual(messages[0]["status"], 200)
+        bodies = [message for message in messages if message["type"] == "http.response.body"]
+        self.assertEqual(len(bodies), 5)
+        self.assertTrue(all(body["more_body"] for body in bodies[:-1]))
+        content = b"".join(body.get("body", b"") for body in bodies).decode()
+        rows = list(csv.DictReader(content.splitlines()))
+        self.assertEqual([row["title"] for row in rows], ["Book 0", "Book 1", "Book 2"])
+
+
+class CheckoutOrReturnViewTest(TestUserTestCase):
+    def setUp(self):
+        super().setUp()
+        self.copy = BookInstance.objects.create(book=self.test_book)
+        self.url = reverse("catalog:checkout_or_return_book_instance", args=[self.copy.pk])
+        self.due_back = datetime.date.today() + datetime.timedelta(weeks=3)
+
+    def login(self, user):
+        self.client.login(username=user.username, password=user.raw_password)
+
+    def borrow(self, borrower):
+        return self.client.post(
+            self.url, {"borrower": borrower.pk, "due_back": self.due_back, "status": "o"}
+        )
+
+    def give_back(self):
+        return self.client.post(self.url, {"borrower": "", "due_back": "", "status": "a"})
+
+    def test_redirect_if_not_logged_in(self):
+        response = self.borrow(self.test_user1)
+        self.assertRedirects(response, settings.LOGIN_URL + "?next=" + self.url)
+
+    def test_borrow_and_return(self):
+        self.login(self.test_user1)
+        self.assertRedirects(self.borrow(self.test_user1), reverse("catalog:my_borrowed"))
+        self.copy.refresh_from_db()
+        self.assertEqual(self.copy.status, BookInstance.LOAN_STATUS.OnLoan)
+        self.assertEqual(self.copy.borrower, self.test_user1)
+        self.assertEqual(self.copy.due_back, self.due_back)
+        self.test_book.refresh_from_db()
+        self.assertEqual(self.test_book.copies_on_loan, 1)
+
+        self.assertRedirects(self.give_back(), reverse("catalog:my_borrowed"))
+        self.copy.refresh_from_db()
+        self.assertEqual(self.copy.status, BookInstance.LOAN_STATUS.Available)
+        self.assertIsNone(self.copy.borrower)
+        self.assertIsNone(self.copy.due_back)
+        self.test_book.refresh_from_db()
+        self.assertEqual(self.test_book.copies_available, 1)
+
+    def test_borrowed_copy_conflicts(self):
+        self.login(self.test_user1)
+        self.borrow(self.test_user1)
+        self.login(self.test_user2)
+        response = self.borrow(self.test_user2)
+        self.assertEqual(response.status_code, 409)
+        self.assertContains(response, "just been borrowed", status_code=409)
+        self.copy.refresh_from_db()
+        self.assertEqual(self.copy.borrower, self.test_user1)
+
+    def test_only_the_borrower_can_return(self):
+        self.login(self.test_user1)
+        self.borrow(self.test_user1)
+        self.login(self.test_user2)
+        self.assertEqual(self.give_back().status_code, 409)
+        self.copy.refresh_from_db()
+        self.assertEqual(self.copy.status, BookInstance.LOAN_STATUS.OnLoan)
+
+    def test_borrowers_can_only_lend_to_themselves(self):
+        self.login(self.test_user2)
+        self.borrow(self.test_user1)
+        self.copy.refresh_from_db()
+        self.assertEqual(self.copy.borrower, self.test_user2)
+
+    def test_loans_are_timed(self):
+        def count(operation, outcome):
+            return REGISTRY.get_sample_value(
+                "catalog_loan_seconds_count", {"operation": operation, "outcome": outcome}
+            ) or 0
+
+        before = [count("checkout", "ok"), count("checkout", "conflict"), count("return", "ok")]
+        self.login(self.test_user1)
+        self.borrow(self.test_user1)
+        self.borrow(self.test_user1)
+        self.give_back()
+        self.assertEqual(
+            [count("checkout", "ok"), count("checkout", "conflict"), count("return", "ok")],
+            [before[0] + 1, before[1] + 1, before[2] + 1],
+        )
+
+    def test_only_borrow_and_return_are_allowed(self):
+        self.login(self.test_user1)
+        response = self.client.post(self.url, {"status": "m"})
+        self.assertFormError(
+            response.context["form"], "status", "Copies can only be borrowed or returned here"
+        )
+        self.copy.refresh_from_db()
+        self.assertEqual(self.copy.status, BookInstance.LOAN_STATUS.Available)
+
+
+class OverdueLoansTest(TestUserTestCase):
+    def setUp(self):
+        super().setUp()
+        today = timezone.localdate()
+        self.loans = {}
+        for days_late, borrower in [
+            (10, self.test_user1),
+            (3, self.test_user2),
+            (0, self.test_user1),
+        ]:
+            self.loans[days_late] = BookInstance.objects.create(
+                book=self.test_book,
+                borrower=borrower,
+                due_back=today - datetime.timedelta(days=days_late),
+                status=BookInstance.LOAN_STATUS.OnLoan,
+            )
+        # past its due date, but not on loan
+        BookInstance.objects.create(
+            book=self.test_book,
+            due_back=today - datetime.timedelta(days=5),
+            status=BookInstance.LOAN_STATUS.Maintenance,
+        )
+        permission = Permission.objects.get(codename="change_bookinstance")
+        self.test_user2.user_permissions.add(permission)
+
+    def test_with_overdue_annotations(self):
+        copies = BookInstance.objects.with_overdue().filter(book=self.test_book)
+        annotated = {copy.pk: (copy.overdue, copy.days_overdue) for copy in copies}
+        self.assertEqual(annotated[self.loans[10].pk], (True, 10))
+        self.assertEqual(annotated[self.loans[3].pk], (True, 3))
+        # due today isn't overdue yet
+        self.assertEqual(annotated[self.loans[0].pk], (False, 0))
+        self.assertEqual(
+            sorted(annotated.values()).count((False, 0)), 2, "copies not on loan aren't overdue"
+        )
+
+    def test_overdue_filter(self):
+        self.assertQuerySetEqual(
+            BookInstance.objects.overdue().order_by("due_back"),
+            [self.loans[10], self.loans[3]],
+        )
+
+    def test_report_requires_permission(self):
+        self.client.login(
+            username=self.test_user1.username, password=self.test_user1.raw_password
+        )
+        self.assertEqual(self.client.get(reverse("catalog:overdue")).status_code, 403)
+
+    def test_report_lists_longest_overdue_first(self):
+        self.client.login(
+            username=self.test_user2.username, password=self.test_user2.raw_password
+        )
+        # session, user, user and group permissions, then a single query for the page
+        with self.assertNumQueries(5):
+            response = self.client.get(reverse("catalog:overdue"))
+        loans = response.context["loans"]
+        self.assertEqual([loan["id"] for loan in loans], [self.loans[10].pk, self.loans[3].pk])
+        self.assertEqual(loans[0]["days_overdue"], 10)
+        self.assertContains(response, "10 days overdue")
+        self.assertContains(response, "3 days overdue")
+
+    def test_borrowed_list_flags_overdue_copies(self):
+        self.client.login(
+            username=self.test_user1.username, password=self.test_user1.raw_password
+        )
+        response = self.client.get(reverse("catalog:my_borrowed"))
+        self.assertContains(response, "OVERDUE (10 days)")
+        self.assertContains(response, "OVERDUE", count=1)
+
+    def test_command_groups_by_borrower(self):
+        out = StringIO()
+        call_command("overdue_report", "--format", "jsonl", stdout=out)
+        records = [json.loads(line) for line in out.getvalue().splitlines()]
+        self.assertEqual(
+            [(record["username"], len(record["loans"])) for record in records],
+            [(self.test_user1.username, 1), (self.test_user2.username, 1)],
+        )
+        self.assertEqual(records[0]["loans"][0]["days_overdue"], 10)
+
+        out = StringIO()
+        call_command(
+            "overdue_report",
+            "--date",
+            str(timezone.localdate() + datetime.timedelta(days=1)),
+            stdout=out,
+        )
+        self.assertIn(f"{self.test_user1.username}: 2 overdue", out.getvalue())
+        self.assertIn("3 overdue loans held by 2 borrowers", out.getvalue())
@@ -1,17 +1,34 @@
+from django.conf import settings
 from django.urls import path
 
-from . import views
+from . import async_views, views
 
 app_name = __package__
 
-urlpatterns = [
-    path("", views.index, name="index"),
-    path("books/", views.BookListView.as_view(), name="books"),
-    path("book/<int:pk>/", views.BookDetailView.as_view(), name="book_detail"),
-    path("authors/", views.AuthorListView.as_view(), name="authors"),
-    path("authors/<int:pk>/", views.AuthorDetailView.as_view(), name="author_detail"),
+if settings.ASYNC_VIEWS:
+    read_only_patterns = [
+        path("", async_views.index, name="index"),
+        path("books/", async_views.book_list, name="books"),
+        path("book/<int:pk>/", async_views.book_detail, name="book_detail"),
+        path("authors/", async_views.author_list, name="authors"),
+        path("authors/<int:pk>/", async_views.author_detail, name="author_detail"),
+        path("exports/<slug:name>.<slug:export_format>", async_views.export, name="export"),
+    ]
+else:
+    read_only_patterns = [
+        path("", views.index, name="index"),
+        path("books/", views.BookListView.as_view(), name="books"),
+        path("book/<int:pk>/", views.BookDetailView.as_view(), name="book_detail"),
+        path("authors/", views.AuthorListView.as_view(), name="authors"),
+        path("authors/<int:pk>/", views.AuthorDetailView.as_view(), name="author_detail"),
+        path("exports/<slug:name>.<slug:export_format>", views.export, name="export"),
+    ]
+
+urlpatterns = read_only_patterns + [
+    path("authors/lookup/", views.author_lookup, name="author_lookup"),
     path("mybooks/", views.LoanedBooksByUserListView.as_view(), name="my_borrowed"),
     path("loanedbooks/", views.AllLoanedBooksListView.as_view(), name="all_borrowed"),
+    path("overdue/", views.OverdueLoansListView.as_view(), name="overdue"),
     path(
         "book/<uuid:pk>/renew/",
         views.RenewBookLibrarianModelView.as_view(),
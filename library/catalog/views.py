@@ -1,56 +1,143 @@
 import datetime
+import time
 from typing import Any, override
 
 from allauth.account.decorators import verified_email_required
+from django.conf import settings
+from django.contrib.auth.decorators import permission_required
 from django.contrib.auth.mixins import LoginRequiredMixin, PermissionRequiredMixin
+from django.contrib.postgres.search import SearchRank
+from django.db.models import F, Prefetch
 from django.db.models.base import Model as Model
 from django.db.models.query import QuerySet
 from django.forms import BaseModelForm
-from django.http import HttpResponseRedirect
+from django.http import (
+    FileResponse,
+    Http404,
+    HttpRequest,
+    HttpResponse,
+    HttpResponseRedirect,
+    JsonResponse,
+    StreamingHttpResponse,
+)
 from django.shortcuts import render
 from django.urls import reverse, reverse_lazy
 from django.utils.decorators import method_decorator
 from django.views import generic
 from django.views.generic import CreateView, DeleteView, UpdateView
 
+from core.replicas import read_from_replicas
+
+from .cards import AUTHOR_BOOK_CARD, BOOK_CARD, render_cards
+from .conditional import (
+    author_detail_version,
+    author_list_version,
+    book_detail_version,
+    book_list_version,
+    conditional_page,
+    index_version,
+)
+from .exports import EXPORT_CONTENT_TYPES, EXPORTS, snapshot_path, stream_export
 from .forms import (
     AuthorForm,
+    author_label,
     BookForm,
     BorrowOrReturnBookInstanceModelForm,
     CreateBookInstanceModelForm,
     RenewBookModelForm,
 )
-from .models import Author, Book, BookInstance
+from .metrics import loan_seconds, observe_since, search_seconds
+from .models import Author, Book, BookInstance, Genre, LibraryStats
+from .page_cache import cache_anonymous_page, tag_page
+from .pagination import CursorPaginationMixin, paginate_by_cursor
+from .search import (
+    FUZZY_LIMIT,
+    fuzzy_authors,
+    fuzzy_books,
+    search_books,
+    search_query,
+)
 
 
+@read_from_replicas
+@cache_anonymous_page
+@conditional_page(index_version)
 def index(request):
     """View function for home page of site."""
 
-    num_books = Book.objects.count()
-    num_instances = BookInstance.objects.count()
-
-    num_instances_available = BookInstance.objects.filter(
-        status__exact=BookInstance.LOAN_STATUS.Available
-    ).count()
-
-    num_authors = Author.objects.count()
+    # maintained counters instead of COUNT(*) over each table
+    stats = LibraryStats.load()
 
     context = {
-        "num_books": num_books,
-        "num_instances": num_instances,
-        "num_instances_available": num_instances_available,
-        "num_authors": num_authors,
+        "num_books": stats.num_books,
+        "num_instances": stats.copies_total,
+        "num_instances_available": stats.copies_available,
+        "num_authors": stats.num_authors,
     }
 
+    tag_page(request, "stats")
     return render(request, "catalog/index.html", context=context)
 
 
-class BookListView(generic.ListView):
+@method_decorator(read_from_replicas, name="dispatch")
+@method_decorator(cache_anonymous_page, name="dispatch")
+@method_decorator(conditional_page(book_list_version), name="dispatch")
+class BookListView(CursorPaginationMixin, generic.ListView):
     model = Book
     paginate_by = 5
     context_object_name = "book_list"
+    cursor_ordering = ("pk",)
+    fuzzy = False
 
+    @override
+    def get(self, request, *args, **kwargs):
+        if not request.GET.get("search", "").strip():
+            return super().get(request, *args, **kwargs)
+        start = time.perf_counter()
+        # the page of results is fetched here, the response is rendered later
+        response = super().get(request, *args, **kwargs)
+        observe_since(search_seconds, start, "books", "fuzzy" if self.fuzzy else "fulltext")
+        return response
+
+    @override
+    def get_queryset(self) -> QuerySet[Book]:
+        books = super().get_queryset()
+        if search := self.request.GET.get("search", "").strip():
+            # ranked full-text search over title, author, genres and summary
+            results = search_books(books, search)
+            if results.exists():
+                return results
+            # nothing matched exactly, so fall back to the closest titles/author names (typos)
+            self.fuzzy = True
+            return fuzzy_books(books, search)
+        return books.order_by("pk")
+
+    @override
+    def get_cursor_ordering(self):
+        # search results are ordered by relevance, which can't be seeked on
+        return None if self.request.GET.get("search") else super().get_cursor_ordering()
 
+    @override
+    def get_context_data(self, **kwargs: Any) -> dict[str, Any]:
+        context = super().get_context_data(**kwargs)
+        context["search"] = self.request.GET.get("search", "").strip()
+        context["fuzzy"] = self.fuzzy
+        # the page's cards in one cache lookup; the book's author is only fetched for cards that
+        # have to be rendered
+        books = list(context["book_list"])
+        context["cards"] = list(zip(books, render_cards(BOOK_CARD, books)))
+        tag_page(
+            self.request,
+            "search" if context["search"] else "books",
+            *(f"book:{book.pk}" for book in books),
+            *(f"author:{book.author_id}" for book in books),  # type: ignore
+        )
+        return context
+
+
+@method_decorator(read_from_replicas, name="dispatch")
+@method_decorator(cache_anonymous_page, name="dispatch")
+@method_decorator(conditional_page(book_detail_version), name="dispatch")
 class BookDetailView(generic.DetailView):
     """Display an individual :model:`catalog.Book (does not hyperlink if in first line for views
     🙄)`
@@ -75,46 +162,189 @@ class BookDetailView(generic.DetailView):
 
     model = Book
     context_object_name = "book"
+    # the book with its author and language in one query, and its genres in another
+    queryset = (
+        Book.objects.select_related("author", "language")
+        .only(
+            "title",
+            "summary",
+            "isbn",
+            "copies_total",
+            "copies_available",
+            "copies_on_loan",
+            "copies_reserved",
+            "copies_maintenance",
+            "author__first_name",
+            "author__last_name",
+            "language__name",
+        )
+        .prefetch_related(Prefetch("genre", queryset=Genre.objects.only("name")))
+    )
+    copies_per_page = 20
 
     @override
     def get_context_data(self, **kwargs: Any) -> dict[str, Any]:
         context = super().get_context_data(**kwargs)
-        # for hidden due_date field in form for borrowing book
-        context["checkout_due_date"] = (
-            datetime.date.today() + datetime.timedelta(weeks=3)
-        ).isoformat()
+        book: Book = self.object  # type: ignore
+        context.update(book_copies_context(self.request, book))
+        context["copies"] = paginate_by_cursor(
+            book_copies(book, context["copy_status"]),
+            ("pk",),
+            self.copies_per_page,
+            self.request.GET.get("cursor"),
+        )
         return context
 
 
-class AuthorListView(generic.ListView):
+def book_copies_context(request: HttpRequest, book: Book) -> dict[str, Any]:
+    """Context of the book detail page besides the book and its page of copies (shared with
+    catalog.async_views)."""
+    # the copy counters give the per-status summary, and only one page of copies in the chosen
+    # status is loaded
+    summary = [
+        (BookInstance.LOAN_STATUS.Available, book.copies_available),
+        (BookInstance.LOAN_STATUS.OnLoan, book.copies_on_loan),
+        (BookInstance.LOAN_STATUS.Reserved, book.copies_reserved),
+        (BookInstance.LOAN_STATUS.Maintenance, book.copies_maintenance),
+    ]
+    status = request.GET.get("status")
+    if status not in BookInstance.LOAN_STATUS.values:
+        status = next((status for status, count in summary if count), summary[0][0])
+    tag_page(
+        request,
+        f"book:{book.pk}",
+        f"author:{book.author_id}",  # type: ignore
+        f"language:{book.language_id}",  # type: ignore
+        *(f"genre:{genre.pk}" for genre in book.genre.all()),
+    )
+    return {
+        "copy_summary": summary,
+        "copy_status": status,
+        # for hidden due_date field in form for borrowing book
+        "checkout_due_date": (datetime.date.today() + datetime.timedelta(weeks=3)).isoformat(),
+    }
+
+
+def book_copies(book: Book, status: str) -> QuerySet[BookInstance]:
+    # walks bookinstance_book_status_idx
+    return BookInstance.objects.filter(book=book, status=status).only(
+        "id", "status", "due_back", "book_id"
+    )
+
+
+@method_decorator(read_from_replicas, name="dispatch")
+@method_decorator(cache_anonymous_page, name="dispatch")
+@method_decorator(conditional_page(author_list_version), name="dispatch")
+class AuthorListView(CursorPaginationMixin, generic.ListView):
     model = Author
     paginate_by = 5
     context_object_name = "author_list"
     queryset = Author.objects.all()
+    # Author.Meta.ordering plus the pk as a tie-breaker (backed by author_name_ordering_idx)
+    cursor_ordering = ("last_name", "first_name", "pk")
+
+    @override
+    def get(self, request, *args, **kwargs):
+        if not request.GET.get("search", "").strip():
+            return super().get(request, *args, **kwargs)
+        start = time.perf_counter()
+        response = super().get(request, *args, **kwargs)
+        observe_since(search_seconds, start, "authors", "fuzzy")
+        return response
+
+    @override
+    def get_queryset(self) -> QuerySet[Author]:
+        if search := self.request.GET.get("search", "").strip():
+            # names are frequently misspelled, so author search is always typo-tolerant
+            return fuzzy_authors(search)
+        return super().get_queryset()
+
+    @override
+    def get_cursor_ordering(self):
+        return None if self.request.GET.get("search") else super().get_cursor_ordering()
+
+    @override
+    def get_context_data(self, **kwargs: Any) -> dict[str, Any]:
+        context = super().get_context_data(**kwargs)
+        context["search"] = self.request.GET.get("search", "").strip()
+        # renames change both the order of the list and the search results
+        tag_page(
+            self.request, "authors", *(f"author:{author.pk}" for author in context["author_list"])
+        )
+        return context
+
+
+def author_lookup(request):
+    """JSON suggestions for the author field of :model:`catalog.Book` forms."""
+    authors = []
+    if search := request.GET.get("q", "").strip():
+        start = time.perf_counter()
+        authors = list(
+            fuzzy_authors(search, limit=FUZZY_LIMIT).only("pk", "first_name", "last_name")
+        )
+        observe_since(search_seconds, start, "author_lookup", "fuzzy")
+    return JsonResponse(
+        {"results": [{"id": a.pk, "label": author_label(a)} for a in authors]}
+    )
 
 
+@method_decorator(read_from_replicas, name="dispatch")
+@method_decorator(conditional_page(author_detail_version), name="dispatch")
 class AuthorDetailView(generic.DetailView):
     model = Author
     context_object_name = "author"
+    books_per_page = 20
 
+    @override
+    def get_context_data(self, **kwargs: Any) -> dict[str, Any]:
+        context = super().get_context_data(**kwargs)
+        # one page of books (walking book_author_title_idx) and all of their genres in one more
+        # query, rather than author.book_set.all and a genre query per book
+        books = paginate_by_cursor(
+            author_books(self.object),  # type: ignore
+            ("title", "pk"),
+            self.books_per_page,
+            self.request.GET.get("cursor"),
+        )
+        context["books"] = books
+        context["book_cards"] = render_cards(AUTHOR_BOOK_CARD, books)
+        context["page_obj"] = books
+        context["is_paginated"] = context["cursor_paginated"] = books.has_other_pages()
+        return context
 
-class LoanedBooksByUserListView(LoginRequiredMixin, generic.ListView):
+
+def author_books(author: Author) -> QuerySet[Book]:
+    return (
+        Book.objects.filter(author=author)
+        .only("title", "isbn", "author_id")
+        .prefetch_related(Prefetch("genre", queryset=Genre.objects.only("name")))
+    )
+
+
+class LoanedBooksByUserListView(
+    LoginRequiredMixin, CursorPaginationMixin, generic.ListView
+):
     """Generic class-based view listing books on loan to current user."""
 
     model = BookInstance
     context_object_name = "books_list"
     template_name = "catalog/borrowed_books.html"
     paginate_by = 10
+    # backed by bookinstance_borrower_due_idx
+    cursor_ordering = ("due_back", "pk")
 
     def get_queryset(self):
         return (
             BookInstance.objects.filter(borrower=self.request.user)
             .filter(status__exact=BookInstance.LOAN_STATUS.OnLoan)
+            .with_overdue()
             .order_by("due_back")
         )
 
 
-class AllLoanedBooksListView(PermissionRequiredMixin, generic.ListView):
+class AllLoanedBooksListView(
+    PermissionRequiredMixin, CursorPaginationMixin, generic.ListView
+):
     """All loaned books. Accessible only to users with the 'catalog.change_bookinstance'
     permission."""
 
@@ -123,23 +353,65 @@ class AllLoanedBooksListView(PermissionRequiredMixin, generic.ListView):
     context_object_name = "books_list"
     template_name = "catalog/borrowed_books.html"
     paginate_by = 10
+    # backed by bookinstance_loans_due_idx
+    cursor_ordering = ("due_back", "pk")
 
     def get_queryset(self):
-        return (
-            BookInstance.objects.filter(
-                book__title__icontains=self.request.GET.get("search", "")
+        loans = BookInstance.objects.filter(
+            status__exact=BookInstance.LOAN_STATUS.OnLoan
+        ).with_overdue()
+        if search := self.request.GET.get("search", "").strip():
+            # the book's search vector is GIN indexed, unlike an icontains scan over titles
+            query = search_query(search)
+            return (
+                loans.filter(book__search_vector=query)
+                .annotate(search_rank=SearchRank(F("book__search_vector"), query))
+                .order_by("-search_rank", "due_back")
             )
-            .filter(status__exact=BookInstance.LOAN_STATUS.OnLoan)
-            .order_by("due_back")
-        )
+        return loans.order_by("due_back")
+
+    @override
+    def get_cursor_ordering(self):
+        return None if self.request.GET.get("search") else super().get_cursor_ordering()
 
     def get_context_data(self, **kwargs: Any) -> dict[str, Any]:
         context = super().get_context_data(**kwargs)
+        context["search"] = self.request.GET.get("search", "").strip()
         context["show_search"] = True
         context["show_renew_option"] = True
         return context
 
 
+class OverdueLoansListView(
+    PermissionRequiredMixin, CursorPaginationMixin, generic.ListView
+):
+    """Overdue loans, longest overdue first, for librarians chasing returns. Rows are values()
+    dicts rather than model instances, so each page is one query however many loans there are."""
+
+    permission_required = "catalog.change_bookinstance"
+    model = BookInstance
+    context_object_name = "loans"
+    template_name = "catalog/overdue_loans.html"
+    paginate_by = 50
+    # backed by bookinstance_loans_due_idx
+    cursor_ordering = ("due_back", "pk")
+
+    def get_queryset(self):
+        return (
+            BookInstance.objects.overdue()
+            .order_by("due_back", "pk")
+            .values(
+                "id",
+                "due_back",
+                "days_overdue",
+                "book_id",
+                "book__title",
+                "borrower__username",
+                "borrower__email",
+            )
+        )
+
+
 class RenewBookLibrarianModelView(PermissionRequiredMixin, UpdateView):
     model = BookInstance
     context_object_name = "book_instance"
@@ -148,14 +420,62 @@ class RenewBookLibrarianModelView(PermissionRequiredMixin, UpdateView):
     permission_required = "catalog.change_bookinstance"
     success_url = reverse_lazy("catalog:all_borrowed")
 
+    @override
+    def form_valid(self, form):
+        start = time.perf_counter()
+        response = super().form_valid(form)
+        observe_since(loan_seconds, start, "renew", "ok")
+        return response
+
+
+class CheckoutOrReturnBookInstanceView(LoginRequiredMixin, UpdateView):
+    """Borrows (status 'o') or returns (status 'a') a copy.
+
+    The change is a conditional update of just the loan columns, so when several people try to
+    borrow the same copy at once exactly one gets it and the rest get a 409 Conflict.
+    """
 
-class CheckoutOrReturnBookInstanceView(UpdateView):
     model = BookInstance
     context_object_name = "book_instance"
     form_class = BorrowOrReturnBookInstanceModelForm
     template_name = "catalog/checkout_or_return_book_instance.html"
     success_url = reverse_lazy("catalog:my_borrowed")
 
+    @override
+    def form_valid(self, form):
+        start = time.perf_counter()
+        data = form.cleaned_data
+        user = self.request.user
+        # librarians can lend to (and take returns from) anyone, everyone else only themselves
+        librarian = user.has_perm("catalog.change_bookinstance")
+        copies = BookInstance.objects.all()
+        if data["status"] == BookInstance.LOAN_STATUS.OnLoan:
+            operation = "checkout"
+            from_status = BookInstance.LOAN_STATUS.Available
+            borrower = data["borrower"] if librarian and data["borrower"] else user
+            conflict = "Sorry, this copy has just been borrowed by someone else."
+        else:
+            operation = "return"
+            from_status = BookInstance.LOAN_STATUS.OnLoan
+            borrower = None
+            if not librarian:
+                copies = copies.filter(borrower=user)
+            conflict = "This copy is not on loan to you."
+
+        if not copies.transition(
+            self.object.pk,
+            from_status,
+            status=data["status"],
+            borrower=borrower,
+            due_back=data["due_back"],
+        ):
+            observe_since(loan_seconds, start, operation, "conflict")
+            return self.render_to_response(
+                self.get_context_data(form=form, conflict=conflict), status=409
+            )
+        observe_since(loan_seconds, start, operation, "ok")
+        return HttpResponseRedirect(self.get_success_url())
+
 
 @method_decorator(verified_email_required, name="dispatch")
 class AuthorCreate(PermissionRequiredMixin, CreateView):
@@ -273,3 +593,35 @@ class BookInstanceDeleteView(DeleteView):
 
     def get_success_url(self) -> str:
         return reverse("catalog:book_delete", kwargs={"pk": self.book})
+
+
+@permission_required("catalog.change_bookinstance", raise_exception=True)
+def export(request, name: str, export_format: str):
+    """Full dump of the books, copies or active loans as CSV or JSON Lines.
+
+    A pre-generated snapshot (see the export_snapshots command) is served when there is one, handed
+    off to nginx with X-Accel-Redirect if EXPORT_SNAPSHOT_ACCEL_PREFIX is set. Otherwise, or with
+    `?live`, the export is streamed straight from the database.
+    """
+    if name not in EXPORTS or export_format not in EXPORT_CONTENT_TYPES:
+        raise Http404("No such export")
+    content_type = EXPORT_CONTENT_TYPES[export_format]
+
+    snapshot = snapshot_path(name, export_format)
+    if "live" not in request.GET and snapshot.is_file():
+        if settings.EXPORT_SNAPSHOT_ACCEL_PREFIX:
+            # nginx sends the file itself (sendfile), so no worker is tied up for the download
+            response = HttpResponse(content_type=content_type)
+            response["X-Accel-Redirect"] = (
+                f"{settings.EXPORT_SNAPSHOT_ACCEL_PREFIX}{snapshot.name}"
+            )
+        else:
+            response = FileResponse(snapshot.open("rb"), content_type=content_type)
+    else:
+        response = StreamingHttpResponse(
+            stream_export(name, export_format), content_type=content_type
+        )
+        # pass chunks through as they're produced instead of buffering the dump to disk
+        response["X-Accel-Buffering"] = "no"
+    response["Content-Disposition"] = f'attachment; filename="{name}.{export_format}"'
+    return response
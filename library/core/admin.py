@@ -1,6 +1,140 @@
+from collections import Counter
+
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin
-from .models import User
+from django.http import HttpResponse
+from django.shortcuts import get_object_or_404
+from django.urls import path, reverse
+from django.utils.html import format_html, format_html_join
+
+from .models import OutboxEmail, RequestProfile, SlowQuery, User
+
+# functions listed on a profile's page
+HOT_FUNCTIONS = 30
 
 # Register your models here.
-admin.site.register(User, UserAdmin)
\ No newline at end of file
+admin.site.register(User, UserAdmin)
+
+
+@admin.register(OutboxEmail)
+class OutboxEmailAdmin(admin.ModelAdmin):
+    list_display = ("__str__", "status", "attempts", "next_attempt_at", "created_at", "sent_at")
+    list_filter = ("status",)
+    exclude = ("message",)
+    readonly_fields = ("from_email", "recipients", "attempts", "last_error", "created_at", "sent_at")
+
+
+@admin.register(RequestProfile)
+class RequestProfileAdmin(admin.ModelAdmin):
+    list_display = (
+        "created_at",
+        "method",
+        "path",
+        "view",
+        "status_code",
+        "duration_ms",
+        "query_count",
+        "samples",
+        "trigger",
+        "user",
+    )
+    list_filter = ("trigger", "view")
+    ordering = ("-created_at",)
+    exclude = ("stacks", "queries")
+    readonly_fields = (
+        "created_at",
+        "method",
+        "path",
+        "view",
+        "status_code",
+        "duration_ms",
+        "user",
+        "trigger",
+        "samples",
+        "flamegraph",
+        "hot_functions",
+        "sql",
+    )
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def get_urls(self):
+        return [
+            path(
+                "<int:pk>/stacks/",
+                self.admin_site.admin_view(self.download_stacks),
+                name="core_requestprofile_stacks",
+            ),
+            *super().get_urls(),
+        ]
+
+    def download_stacks(self, request, pk: int):
+        if not self.has_view_permission(request):
+            return HttpResponse(status=403)
+        profile = get_object_or_404(RequestProfile, pk=pk)
+        response = HttpResponse(profile.stacks, content_type="text/plain")
+        response["Content-Disposition"] = f'attachment; filename="profile-{pk}.folded"'
+        return response
+
+    @admin.display(description="Queries")
+    def query_count(self, profile: RequestProfile) -> int:
+        return len(profile.queries)
+
+    @admin.display(description="Flame graph")
+    def flamegraph(self, profile: RequestProfile):
+        return format_html(
+            '<a href="{}">Folded stacks</a> (open in speedscope.app or flamegraph.pl)',
+            reverse("admin:core_requestprofile_stacks", args=[profile.pk]),
+        )
+
+    @admin.display(description="Hot functions")
+    def hot_functions(self, profile: RequestProfile):
+        """The functions sampled most often, with the samples spent in them (self) and in them or
+        what they called (total)."""
+        own, total = Counter(), Counter()
+        for line in profile.stacks.splitlines():
+            stack, _, count = line.rpartition(" ")
+            frames = stack.split(";")
+            own[frames[-1]] += int(count)
+            for frame in set(frames):
+                total[frame] += int(count)
+        return format_html(
+            "<table><tr><th>Self</th><th>Total</th><th>Function</th></tr>{}</table>",
+            format_html_join(
+                "",
+                "<tr><td>{}</td><td>{}</td><td>{}</td></tr>",
+                (
+                    (count, total[frame], frame)
+                    for frame, count in own.most_common(HOT_FUNCTIONS)
+                ),
+            ),
+        )
+
+    @admin.display(description="SQL")
+    def sql(self, profile: RequestProfile):
+        return format_html(
+            "<table><tr><th>ms</th><th>Query</th></tr>{}</table>",
+            format_html_join(
+                "",
+                "<tr><td>{}</td><td><code>{}</code></td></tr>",
+                ((f"{ms:.2f}", sql) for sql, ms in profile.queries),
+            ),
+        )
+
+
+@admin.register(SlowQuery)
+class SlowQueryAdmin(admin.ModelAdmin):
+    list_display = ("fingerprint", "view", "count", "total_ms", "max_ms", "last_seen")
+    list_filter = ("view",)
+    ordering = ("-total_ms",)
+    search_fields = ("sql",)
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
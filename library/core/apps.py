@@ -9,6 +9,21 @@ class CoreConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "core"
 
+    def ready(self) -> None:
+        from django.conf import settings
+        from django.core.signals import request_finished
+
+        from .db.base import PoolCollector, PoolStatsExporter
+        from .metrics import MULTIPROCESS, registry
+        from .replicas import ReplicaLagCollector
+
+        if MULTIPROCESS:
+            request_finished.connect(PoolStatsExporter(), weak=False)
+        else:
+            registry.register(PoolCollector())
+        if settings.DATABASE_REPLICAS:
+            registry.register(ReplicaLagCollector())
+
 
 class AllAuthCompatibleAdminConfig(AdminConfig):
     @override
@@ -0,0 +1,2 @@
+"""Postgres backend (ENGINE "core.db") for pooled connections: django_prometheus's instrumented
+backend, with the psycopg connection pool's stats exported too."""
@@ -0,0 +1,153 @@
+import time
+
+from django.db.backends.postgresql.base import DatabaseWrapper as PostgresDatabaseWrapper
+from django_prometheus.db.backends.postgresql import base
+from prometheus_client import Counter, Gauge, Histogram
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+from prometheus_client.registry import Collector
+
+from core.instrumentation import record_query
+
+pool_checkout_seconds = Histogram(
+    "django_db_pool_checkout_seconds",
+    "Time taken to get a connection from the pool, waiting and health check included.",
+    ["alias"],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30),
+)
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # counts the queries of each view
+        self.execute_wrappers.append(record_query)
+
+    def get_new_connection(self, conn_params):
+        if not self.pool:
+            return super().get_new_connection(conn_params)
+        start = time.perf_counter()
+        connection = super().get_new_connection(conn_params)
+        pool_checkout_seconds.labels(self.alias).observe(time.perf_counter() - start)
+        return connection
+
+
+# (stat, metric, help, divisor) of psycopg_pool's ConnectionPool.get_stats(); the counters are
+# since the pool opened
+POOL_GAUGES = (
+    ("pool_size", "django_db_pool_size", "Connections in the pool, in use or idle.", 1),
+    ("pool_available", "django_db_pool_available", "Idle connections in the pool.", 1),
+    ("pool_max", "django_db_pool_max_size", "Most connections the pool opens.", 1),
+    (
+        "requests_waiting",
+        "django_db_pool_requests_waiting",
+        "Requests waiting for a connection.",
+        1,
+    ),
+)
+POOL_COUNTERS = (
+    ("requests_num", "django_db_pool_requests", "Connections asked of the pool.", 1),
+    (
+        "requests_queued",
+        "django_db_pool_requests_queued",
+        "Connections asked of the pool that had to wait for one.",
+        1,
+    ),
+    (
+        "requests_wait_ms",
+        "django_db_pool_wait_seconds",
+        "Time spent waiting for a connection.",
+        1000,
+    ),
+    (
+        "requests_errors",
+        "django_db_pool_request_errors",
+        "Connections asked of the pool that timed out or were refused.",
+        1,
+    ),
+    ("usage_ms", "django_db_pool_usage_seconds", "Time connections were in use.", 1000),
+    (
+        "returns_bad",
+        "django_db_pool_returns_bad",
+        "Connections returned to the pool in a bad state.",
+        1,
+    ),
+    ("connections_num", "django_db_pool_connections_created", "Connections opened.", 1),
+    (
+        "connections_ms",
+        "django_db_pool_connection_seconds",
+        "Time spent opening connections.",
+        1000,
+    ),
+    (
+        "connections_errors",
+        "django_db_pool_connection_errors",
+        "Connections that failed to open.",
+        1,
+    ),
+    (
+        "connections_lost",
+        "django_db_pool_connections_lost",
+        "Connections found broken by the health checks.",
+        1,
+    ),
+)
+
+
+class PoolCollector(Collector):
+    """Stats of the connection pools this process has opened, read when /metrics is scraped."""
+
+    def collect(self):
+        families = [
+            (stat, GaugeMetricFamily(name, documentation, labels=["alias"]), divisor)
+            for stat, name, documentation, divisor in POOL_GAUGES
+        ] + [
+            (stat, CounterMetricFamily(name, documentation, labels=["alias"]), divisor)
+            for stat, name, documentation, divisor in POOL_COUNTERS
+        ]
+        for alias, pool in PostgresDatabaseWrapper._connection_pools.items():
+            stats = pool.get_stats()
+            for stat, family, divisor in families:
+                family.add_metric([alias], stats.get(stat, 0) / divisor)
+        for _, family, _ in families:
+            yield family
+
+
+class PoolStatsExporter:
+    """In multiprocess mode (see core.metrics), where PoolCollector would only report the stats of
+    whichever worker serves /metrics, writes the same metrics to the worker's metric files as
+    requests finish, at most every `interval` seconds: the gauges summed over the live workers, and
+    the counters over every worker that's run."""
+
+    def __init__(self, interval: float = 1.0):
+        self.interval = interval
+        self.exported_at = 0.0
+        # counter values already added, by (alias, stat)
+        self.counted: dict[tuple[str, str], float] = {}
+        # not registered: core.metrics reads them from the files
+        self.gauges = [
+            (
+                stat,
+                Gauge(name, doc, ["alias"], multiprocess_mode="livesum", registry=None),
+                divisor,
+            )
+            for stat, name, doc, divisor in POOL_GAUGES
+        ]
+        self.counters = [
+            (stat, Counter(name, doc, ["alias"], registry=None), divisor)
+            for stat, name, doc, divisor in POOL_COUNTERS
+        ]
+
+    def __call__(self, **kwargs) -> None:
+        if (now := time.monotonic()) - self.exported_at < self.interval:
+            return
+        self.exported_at = now
+        for alias, pool in PostgresDatabaseWrapper._connection_pools.items():
+            stats = pool.get_stats()
+            for stat, gauge, divisor in self.gauges:
+                gauge.labels(alias).set(stats.get(stat, 0) / divisor)
+            for stat, counter, divisor in self.counters:
+                value = stats.get(stat, 0) / divisor
+                counted = self.counted.get((alias, stat), 0.0)
+                # a reopened pool (e.g. after close_pool()) starts counting again
+                counter.labels(alias).inc(value - counted if value >= counted else value)
+                self.counted[alias, stat] = value
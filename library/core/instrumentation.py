@@ -0,0 +1,208 @@
+"""Where a request's time goes: the queries each view makes and the time they take, and how long
+each template takes to render.
+
+Labels are bounded by the code rather than the traffic: views by their URL name (see
+ViewQueriesMiddleware) and templates by their name, and rendered-from-string templates share
+one label. Queries taking settings.SLOW_QUERY_SECONDS or more are also kept, and logged with
+their view as the request finishes (see core.slow_queries)."""
+
+import os
+import sys
+import time
+from collections.abc import Callable, Iterator
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, NamedTuple, override
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.http import HttpRequest
+from django.template import base
+from django.template.backends import django as django_backend
+from prometheus_client import Histogram
+
+view_queries = Histogram(
+    "django_view_db_queries",
+    "Database queries made while handling a request, by view.",
+    ["view"],
+    buckets=(0, 1, 2, 3, 4, 5, 6, 8, 10, 15, 20, 30, 50, 100),
+)
+view_db_seconds = Histogram(
+    "django_view_db_seconds",
+    "Time spent running database queries while handling a request, by view.",
+    ["view"],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+)
+template_render_seconds = Histogram(
+    "django_template_render_seconds",
+    "Time taken to render a template (the queries it makes included), by name.",
+    ["template"],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5),
+)
+
+# requests that didn't resolve to a view (e.g. 404s), and templates rendered from strings
+UNRESOLVED = "<unresolved>"
+FROM_STRING = "<string>"
+# frames of the project's code kept with a slow query
+STACK_FRAMES = 8
+TEMPLATE_RENDER = base.Template.render.__code__
+
+
+class TimedQuery(NamedTuple):
+    sql: str
+    # None for executemany()
+    params: Any
+    alias: str
+    seconds: float
+    stack: str
+
+
+class QueryStats:
+    __slots__ = ("count", "seconds", "slow", "slow_seconds")
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+        self.slow: list[TimedQuery] = []
+        # read once, rather than for each query
+        self.slow_seconds = settings.SLOW_QUERY_SECONDS
+
+
+def project_stack() -> str:
+    """The innermost STACK_FRAMES frames of the project's own code on the thread's stack (not
+    Django's or this module's), outermost first. Templates being rendered count as frames, since
+    the querysets views pass them often only run as they're rendered. The async ORM runs queries
+    in another thread than the view's, so theirs only go as far as the middleware."""
+    root = f"{settings.BASE_DIR}{os.sep}"
+    frames = []
+    frame = sys._getframe(1)
+    while frame is not None and len(frames) < STACK_FRAMES:
+        code = frame.f_code
+        if code is TEMPLATE_RENDER:
+            template = frame.f_locals["self"]
+            frames.append(f"{template.origin.template_name or FROM_STRING} (template)")
+        elif (
+            code.co_filename.startswith(root)
+            and code.co_filename != __file__
+            and "site-packages" not in code.co_filename
+        ):
+            frames.append(
+                f"{code.co_filename.removeprefix(root)}:{frame.f_lineno} in {code.co_qualname}"
+            )
+        frame = frame.f_back
+    return "\n".join(reversed(frames))
+
+
+# the stats of the request being handled; a context variable, so queries that async views run in
+# threads (see catalog.async_views) are counted too
+_queries: ContextVar[QueryStats | None] = ContextVar("queries", default=None)
+# (sql, seconds) of each query, while a request is profiled (see core.profiling)
+_query_log: ContextVar[list[tuple[str, float]] | None] = ContextVar("query_log", default=None)
+
+
+def record_query(execute: Callable, sql, params, many: bool, context):
+    """Execute wrapper installed on every connection (see core.db.base.DatabaseWrapper)."""
+    stats, log = _queries.get(), _query_log.get()
+    if stats is None and log is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        seconds = time.perf_counter() - start
+        if stats is not None:
+            stats.count += 1
+            stats.seconds += seconds
+            if seconds >= stats.slow_seconds:
+                stats.slow.append(
+                    TimedQuery(
+                        sql,
+                        None if many else params,
+                        context["connection"].alias,
+                        seconds,
+                        project_stack(),
+                    )
+                )
+        if log is not None:
+            log.append((sql, seconds))
+
+
+@contextmanager
+def logged_queries() -> Iterator[list[tuple[str, float]]]:
+    """Logs the (sql, seconds) of the queries made in the block (and the threads it runs code in
+    with sync_to_async)."""
+    log: list[tuple[str, float]] = []
+    token = _query_log.set(log)
+    try:
+        yield log
+    finally:
+        _query_log.reset(token)
+
+
+class ViewQueriesMiddleware:
+    """Observes the queries made while handling each request (the middleware after this one's
+    included), labelled with the URL name of the view (e.g. "catalog:books")."""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request: HttpRequest):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        stats = QueryStats()
+        token = _queries.set(stats)
+        try:
+            return self.get_response(request)
+        finally:
+            _queries.reset(token)
+            self.observe(request, stats)
+
+    async def __acall__(self, request: HttpRequest):
+        stats = QueryStats()
+        token = _queries.set(stats)
+        try:
+            return await self.get_response(request)
+        finally:
+            _queries.reset(token)
+            self.observe(request, stats)
+
+    def observe(self, request: HttpRequest, stats: QueryStats) -> None:
+        match = getattr(request, "resolver_match", None)
+        view = match.view_name if match else UNRESOLVED
+        view_queries.labels(view).observe(stats.count)
+        view_db_seconds.labels(view).observe(stats.seconds)
+        if stats.slow:
+            # imports the models, which aren't loaded yet when this module is
+            from .slow_queries import log
+
+            log(view, stats.slow)
+
+
+class Template(django_backend.Template):
+    @override
+    def render(self, context=None, request=None):
+        start = time.perf_counter()
+        try:
+            return super().render(context, request)
+        finally:
+            template_render_seconds.labels(self.origin.template_name or FROM_STRING).observe(
+                time.perf_counter() - start
+            )
+
+
+class DjangoTemplates(django_backend.DjangoTemplates):
+    """The Django template backend, timing the templates it renders (those it's asked for, not
+    the ones they include or extend, which are part of their time)."""
+
+    @override
+    def from_string(self, template_code):
+        return Template(super().from_string(template_code).template, self)
+
+    @override
+    def get_template(self, template_name):
+        return Template(super().get_template(template_name).template, self)
@@ -0,0 +1,175 @@
+"""Logging that doesn't hold up requests: records are queued by the thread logging them, and a
+listener thread in each process formats them (as JSON lines, see JsonFormatter) and writes them
+in batches.
+
+Each batch is written to the stream (stdout) in chunks of whole lines of at most PIPE_BUF bytes,
+each with one write, so the lines of different workers don't interleave however many log at once.
+A line longer than that (e.g. with a long traceback) is written on its own, and can be split by
+another worker's write. If the queue fills up (the stream can't keep up), records are dropped and
+counted rather than blocking the request or growing without bound."""
+
+import datetime
+import json
+import logging
+import os
+import queue
+import select
+import threading
+from logging.handlers import QueueHandler as BaseQueueHandler
+from logging.handlers import QueueListener
+
+from django.http import HttpRequest
+from prometheus_client import Counter
+
+log_records_dropped = Counter(
+    "django_log_records_dropped",
+    "Log records dropped because the process's logging queue was full.",
+)
+
+# records waiting for the listener
+QUEUE_SIZE = 10000
+# most records written in one batch
+BATCH_SIZE = 500
+# writes of up to this many bytes to a pipe (or with O_APPEND) aren't interleaved with others'
+CHUNK_BYTES = select.PIPE_BUF
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record: its time, level, logger and message, the process and thread
+    that logged it, the request it's about (for django.request's records) and the traceback."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": datetime.datetime.fromtimestamp(record.created, datetime.UTC).isoformat(
+                timespec="milliseconds"
+            ),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "process": record.process,
+            "thread": record.threadName,
+        }
+        # django.server's records have the socket as their request
+        if isinstance(request := getattr(record, "request", None), HttpRequest):
+            entry["request"] = f"{request.method} {request.get_full_path()}"
+        if (status_code := getattr(record, "status_code", None)) is not None:
+            entry["status_code"] = status_code
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        if record.stack_info:
+            entry["stack"] = self.formatStack(record.stack_info)
+        return json.dumps(entry, default=str)
+
+
+class LinesHandler(logging.StreamHandler):
+    """Collects formatted records until flushed (by the listener, when it's written a batch),
+    then writes them in chunks of whole lines of at most CHUNK_BYTES (a longer line being a
+    chunk of its own)."""
+
+    def __init__(self, stream=None):
+        super().__init__(stream)
+        self.lines: list[str] = []
+
+    def emit(self, record: logging.LogRecord) -> None:
+        try:
+            self.lines.append(f"{self.format(record)}{self.terminator}")
+        except Exception:
+            self.handleError(record)
+
+    def flush(self) -> None:
+        with self.lock:  # type: ignore
+            lines, self.lines = self.lines, []
+            chunk: list[str] = []
+            size = 0
+            for line in lines:
+                # as many bytes as characters: JSON's escaped to ASCII
+                if chunk and size + len(line) > CHUNK_BYTES:
+                    self.write("".join(chunk))
+                    chunk, size = [], 0
+                chunk.append(line)
+                size += len(line)
+            if chunk:
+                self.write("".join(chunk))
+
+    def write(self, chunk: str) -> None:
+        # each chunk written and flushed on its own, so it's one write() to the file
+        self.stream.write(chunk)
+        self.stream.flush()
+
+
+class BatchingListener(QueueListener):
+    """Hands the records to the handlers as they come, flushing the handlers when the queue's
+    drained or BATCH_SIZE records have been handled since the last flush."""
+
+    def __init__(self, records: queue.Queue, *handlers: logging.Handler):
+        super().__init__(records, *handlers)
+        self.unflushed = 0
+
+    def enqueue_sentinel(self) -> None:
+        # waits for room, rather than failing to stop when the queue's full
+        self.queue.put(self._sentinel)
+
+    def dequeue(self, block: bool):
+        if self.unflushed >= BATCH_SIZE or (self.unflushed and self.queue.empty()):
+            for handler in self.handlers:
+                handler.flush()
+            self.unflushed = 0
+        self.unflushed += 1
+        return super().dequeue(block)
+
+
+class QueueHandler(BaseQueueHandler):
+    """Queues records for a BatchingListener writing them to `stream` (stderr if None), formatted
+    with this handler's formatter. Each process (e.g. gunicorn worker) starts its own listener
+    when it first logs, since threads don't survive a fork; closing the handler (as logging does
+    at exit) writes the records still queued.
+
+    Configured with "()" rather than "class": logging.config sets up the QueueHandlers given by
+    class (as of Python 3.12) with a plain QueueListener of its own."""
+
+    def __init__(self, stream=None):
+        super().__init__(queue.Queue(QUEUE_SIZE))
+        self.output = LinesHandler(stream)
+        self.listener: BatchingListener | None = None
+        self.pid: int | None = None
+        self.start_lock = threading.Lock()
+
+    def setFormatter(self, fmt: logging.Formatter | None) -> None:
+        # formats what the listener writes; records are queued as they are
+        self.output.setFormatter(fmt)
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # the listener's in the same process, so formatting (tracebacks included) is left to it;
+        # only the message is merged, in case its arguments change
+        record = logging.makeLogRecord(record.__dict__)
+        record.msg, record.args = record.getMessage(), None
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        if self.pid != os.getpid():
+            self.start()
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            log_records_dropped.inc()
+
+    def start(self) -> None:
+        with self.start_lock:
+            if self.pid == os.getpid():
+                return
+            if self.pid is not None:
+                # forked: the parent's queue and listener are left as they were at the fork
+                self.queue = queue.Queue(QUEUE_SIZE)
+            self.listener = BatchingListener(self.queue, self.output)
+            self.listener.start()
+            self.pid = os.getpid()
+
+    def close(self) -> None:
+        with self.start_lock:
+            if self.listener is not None and self.pid == os.getpid():
+                # writes what's queued, then stops
+                self.listener.stop()
+                self.output.flush()
+            self.listener = self.pid = None
+        self.output.close()
+        super().close()
@@ -0,0 +1,71 @@
+from email import message_from_bytes
+from email.message import Message
+from typing import override
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.core.mail.backends.base import BaseEmailBackend
+
+from .models import OutboxEmail
+
+
+class OutboxEmailBackend(BaseEmailBackend):
+    """Email backend that only queues messages in the OutboxEmail table (one INSERT per
+    send_messages() call), so requests that send email never wait on SMTP. The drain_outbox worker
+    delivers them through OUTBOX_DELIVERY_BACKEND.
+
+    The rows are written on the request's database connection, so mail queued inside a
+    transaction that's rolled back is never sent."""
+
+    @override
+    def send_messages(self, email_messages) -> int:
+        queued = [
+            OutboxEmail(
+                from_email=message.from_email or settings.DEFAULT_FROM_EMAIL,
+                recipients=message.recipients(),
+                message=message.message().as_bytes(linesep="\r\n"),
+            )
+            for message in email_messages
+            if message.recipients()
+        ]
+        try:
+            OutboxEmail.objects.bulk_create(queued)
+        except Exception:
+            if not self.fail_silently:
+                raise
+            return 0
+        return len(queued)
+
+
+class StoredMIMEMessage(Message):
+    """Parsed stored message that serializes back to exactly the stored bytes (as the backends
+    call it, with a `linesep` argument like Django's own SafeMIME classes)."""
+
+    raw: bytes
+
+    @override
+    def as_bytes(self, unixfrom: bool = False, linesep: str = "\n") -> bytes:  # type: ignore
+        return self.raw.replace(b"\r\n", linesep.encode())
+
+
+class QueuedEmailMessage(EmailMessage):
+    """An OutboxEmail's stored message, re-sendable through any email backend."""
+
+    def __init__(self, email: OutboxEmail):
+        super().__init__(from_email=email.from_email)
+        self.queued_recipients: list[str] = email.recipients
+        self.raw = bytes(email.message)
+
+    @override
+    def recipients(self) -> list[str]:
+        return self.queued_recipients
+
+    @override
+    def message(self) -> StoredMIMEMessage:
+        message = message_from_bytes(self.raw, _class=StoredMIMEMessage)
+        message.raw = self.raw
+        return message  # type: ignore
+
+
+def delivery_connection(**kwargs):
+    return get_connection(settings.OUTBOX_DELIVERY_BACKEND, **kwargs)
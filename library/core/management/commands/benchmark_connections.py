@@ -0,0 +1,96 @@
+import statistics
+import time
+from collections.abc import Callable
+from contextlib import contextmanager
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.test import Client
+from django.test.utils import override_settings
+from django.urls import reverse
+
+from catalog.management.commands.benchmark_search import percentile
+
+
+class Command(BaseCommand):
+    help = (
+        "Compares the per-request database overhead of opening a connection for each request "
+        "(CONN_MAX_AGE 0 without a pool) with taking one from the connection pool: once for just "
+        "connecting, running a query and closing, and once for whole requests of the home page "
+        "through the middleware stack."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--requests", type=int, default=500, help="Requests per configuration (default 500)."
+        )
+
+    def handle(self, *args, requests: int, **options):
+        connection = connections[DEFAULT_DB_ALIAS]
+        if not connection.settings_dict["OPTIONS"].get("pool"):
+            raise CommandError("The default database has no connection pool configured")
+        client = Client(HTTP_HOST="127.0.0.1")
+        # no page cache, so every request renders the page (and queries the database)
+        no_page_cache = override_settings(
+            CACHES={
+                "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"},
+                "fragments": {"BACKEND": "django.core.cache.backends.dummy.DummyCache"},
+                "pages": {"BACKEND": "django.core.cache.backends.dummy.DummyCache"},
+            }
+        )
+
+        def query():
+            connection.ensure_connection()
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            # as at the end of each request
+            connection.close()
+
+        def request():
+            client.get(reverse("catalog:index"), secure=True)
+            # the test client leaves the connection open for the next request
+            connection.close()
+
+        with no_page_cache:
+            for label, run in (("connect, query, close", query), ("home page request", request)):
+                self.stdout.write(label)
+                for pooled in (False, True):
+                    with self.pooling(pooled):
+                        self.measure("pool" if pooled else "no pool", run, requests)
+                        if pooled:
+                            stats = connection.pool.get_stats()
+                            self.stdout.write(
+                                f"{'':>9}  connections opened {stats.get('connections_num', 0)}"
+                                f"  checkouts {stats.get('requests_num', 0)}"
+                            )
+
+    @contextmanager
+    def pooling(self, enabled: bool):
+        connection = connections[DEFAULT_DB_ALIAS]
+        options = connection.settings_dict["OPTIONS"]
+        connection.close()
+        connection.close_pool()
+        connection.settings_dict["OPTIONS"] = (
+            options if enabled else {key: value for key, value in options.items() if key != "pool"}
+        )
+        try:
+            yield
+        finally:
+            connection.close()
+            connection.close_pool()
+            connection.settings_dict["OPTIONS"] = options
+
+    def measure(self, label: str, run: Callable[[], None], requests: int) -> None:
+        # warm up (the pool opens its connections in the background)
+        for _ in range(10):
+            run()
+        latencies = []
+        for _ in range(requests):
+            start = time.perf_counter()
+            run()
+            latencies.append((time.perf_counter() - start) * 1000)
+        self.stdout.write(
+            f"{label:>9}: mean {statistics.mean(latencies):7.3f} ms"
+            f"  p50 {statistics.median(latencies):7.3f} ms"
+            f"  p95 {percentile(latencies, 95):7.3f} ms"
+        )
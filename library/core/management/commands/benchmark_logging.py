@@ -0,0 +1,121 @@
+import logging
+import os
+import statistics
+import tempfile
+import threading
+import time
+
+from django.core.management.base import BaseCommand
+from django.test import RequestFactory
+
+from catalog.management.commands.benchmark_search import percentile
+from core.log import JsonFormatter, QueueHandler
+
+
+class SlowFile:
+    """A file whose writes each take `delay` seconds longer, as on a busy disk."""
+
+    def __init__(self, file, delay: float):
+        self.file = file
+        self.delay = delay
+
+    def write(self, text: str) -> int:
+        time.sleep(self.delay)
+        return self.file.write(text)
+
+    def flush(self) -> None:
+        self.file.flush()
+
+    def close(self) -> None:
+        self.file.close()
+
+
+class Command(BaseCommand):
+    help = (
+        "Measures what logging costs requests during a burst of errors: --threads threads (as "
+        "a worker's) each log --errors server errors with their traceback, as django.request "
+        "does for a 500, through a FileHandler (one write per record, from the thread logging "
+        "it) and through core.log.QueueHandler (records queued, written in batches by its "
+        "listener). Reports the time each logging call took, and how long until every record "
+        "was written. --write-delay makes each write slower, as on a busy disk."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--threads", type=int, default=8, help="Threads logging at once (default 8)."
+        )
+        parser.add_argument(
+            "--errors", type=int, default=500, help="Errors each thread logs (default 500)."
+        )
+        parser.add_argument(
+            "--write-delay",
+            type=float,
+            default=0,
+            help="Milliseconds added to each write (default 0).",
+        )
+
+    def handle(self, *args, threads: int, errors: int, write_delay: float, **options):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "errors.log")
+            handlers = (("file", self.file_handler), ("queue", self.queue_handler))
+            for label, make_handler in handlers:
+                handler = make_handler(path, write_delay / 1000)
+                handler.setLevel(logging.WARNING)
+                self.burst(label, handler, threads, errors)
+                with open(path) as file:
+                    written = sum(1 for _ in file)
+                os.remove(path)
+                if written != threads * errors:
+                    self.stderr.write(f"{label}: {written} of {threads * errors} written")
+
+    def file_handler(self, path: str, delay: float) -> logging.Handler:
+        handler = logging.FileHandler(path)
+        handler.setFormatter(JsonFormatter())
+        handler.stream = SlowFile(handler.stream, delay)  # type: ignore
+        return handler
+
+    def queue_handler(self, path: str, delay: float) -> logging.Handler:
+        handler = QueueHandler(SlowFile(open(path, "a"), delay))
+        handler.setFormatter(JsonFormatter())
+        return handler
+
+    def burst(self, label: str, handler: logging.Handler, threads: int, errors: int) -> None:
+        logger = logging.getLogger(f"benchmark_logging.{label}")
+        logger.propagate = False
+        logger.addHandler(handler)
+        request = RequestFactory().get("/catalog/books/", {"search": "burst"})
+        latencies: list[float] = []
+
+        def fail():
+            for _ in range(errors):
+                try:
+                    raise RuntimeError("Synthetic error")
+                except RuntimeError:
+                    start = time.perf_counter()
+                    logger.error(
+                        "Internal Server Error: %s",
+                        request.path,
+                        exc_info=True,
+                        extra={"status_code": 500, "request": request},
+                    )
+                    latencies.append((time.perf_counter() - start) * 1000)
+
+        workers = [threading.Thread(target=fail) for _ in range(threads)]
+        start = time.perf_counter()
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        logged = time.perf_counter() - start
+        # the queue's written out as the handler's closed
+        handler.close()
+        written = time.perf_counter() - start
+        logger.removeHandler(handler)
+
+        self.stdout.write(
+            f"{label:>5}: per error mean {statistics.mean(latencies):7.3f} ms"
+            f"  p50 {statistics.median(latencies):7.3f} ms"
+            f"  p99 {percentile(latencies, 99):7.3f} ms"
+            f"  max {max(latencies):7.3f} ms"
+            f"  burst logged in {logged:6.2f} s, written in {written:6.2f} s"
+        )
@@ -0,0 +1,189 @@
+import datetime
+import random
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from core.mail import QueuedEmailMessage, delivery_connection
+from core.models import OutboxEmail
+
+# how long a claimed message is hidden from other workers, after which a crashed worker's claim
+# lapses and the message is retried
+CLAIM_TIMEOUT = datetime.timedelta(minutes=5)
+# how often sent messages older than --keep-days are deleted
+PURGE_INTERVAL = datetime.timedelta(hours=1)
+
+
+def retry_delay(attempts: int, base: float, cap: float) -> datetime.timedelta:
+    """Delay before retry number `attempts`: exponential, capped, with jitter so messages that
+    failed together (e.g. during an SMTP outage) don't all retry together."""
+    delay = min(cap, base * 2 ** (attempts - 1))
+    return datetime.timedelta(seconds=random.uniform(delay / 2, delay))
+
+
+class Command(BaseCommand):
+    help = (
+        "Delivers the email queued by core.mail.OutboxEmailBackend through "
+        "OUTBOX_DELIVERY_BACKEND, in batches over one connection that stays open while there's "
+        "mail to send. Failed messages are retried with exponential backoff, and given up on "
+        "after --max-attempts. Runs until stopped unless --once is given; several workers can "
+        "run at once."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=100,
+            help="Messages claimed from the outbox at a time (default 100).",
+        )
+        parser.add_argument(
+            "--poll-interval",
+            type=float,
+            default=1,
+            help="Seconds to wait before checking an empty outbox again (default 1).",
+        )
+        parser.add_argument(
+            "--max-attempts",
+            type=int,
+            default=8,
+            help="Attempts before a message is marked failed (default 8).",
+        )
+        parser.add_argument(
+            "--backoff",
+            type=float,
+            default=30,
+            help="Seconds before the first retry, doubling with each further attempt "
+            "(default 30, capped at an hour).",
+        )
+        parser.add_argument(
+            "--keep-days",
+            type=int,
+            default=7,
+            help="Days sent messages are kept in the outbox before being deleted (default 7).",
+        )
+        parser.add_argument(
+            "--once",
+            action="store_true",
+            help="Exit once no messages are due, instead of polling.",
+        )
+
+    def handle(
+        self,
+        *args,
+        batch_size: int,
+        poll_interval: float,
+        max_attempts: int,
+        backoff: float,
+        keep_days: int,
+        once: bool,
+        **options,
+    ):
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.connection = delivery_connection()
+        self.opened = False
+        self.keep = datetime.timedelta(days=keep_days)
+        self.purged_at: datetime.datetime | None = None
+        self.totals = dict.fromkeys(["sent", "retried", "failed"], 0)
+        start = time.perf_counter()
+        try:
+            while True:
+                batch = self.claim(batch_size)
+                if batch:
+                    self.deliver(batch)
+                    continue
+                # don't hold an idle SMTP connection open (the server would drop it anyway)
+                self.close()
+                self.purge()
+                if once:
+                    break
+                time.sleep(poll_interval)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.close()
+
+        elapsed = time.perf_counter() - start
+        self.stdout.write(
+            f"Sent {self.totals['sent']} messages ({self.totals['sent'] / elapsed:.0f}/s), "
+            f"{self.totals['retried']} to be retried, {self.totals['failed']} failed"
+        )
+
+    def claim(self, batch_size: int) -> list[OutboxEmail]:
+        """Claims the next due messages, which other workers skip until CLAIM_TIMEOUT passes."""
+        now = timezone.now()
+        with transaction.atomic():
+            batch = list(
+                OutboxEmail.objects.select_for_update(skip_locked=True)
+                .filter(status=OutboxEmail.STATUS.Pending, next_attempt_at__lte=now)
+                .order_by("next_attempt_at")[:batch_size]
+            )
+            OutboxEmail.objects.filter(pk__in=[email.pk for email in batch]).update(
+                next_attempt_at=now + CLAIM_TIMEOUT, attempts=F("attempts") + 1
+            )
+        for email in batch:
+            email.attempts += 1
+        return batch
+
+    def deliver(self, batch: list[OutboxEmail]) -> None:
+        sent = []
+        for i, email in enumerate(batch):
+            try:
+                if not self.opened:
+                    try:
+                        self.connection.open()
+                    except Exception as e:
+                        # the server is unreachable, so the rest of the batch would fail too
+                        for unsent in batch[i:]:
+                            self.failed(unsent, e)
+                        break
+                    self.opened = True
+                # one message per call, so a failure only affects that message
+                if not self.connection.send_messages([QueuedEmailMessage(email)]):
+                    raise ValueError("not sent by the backend")
+            except Exception as e:
+                self.failed(email, e)
+                # start over with a fresh connection, in case it's the connection that broke
+                self.close()
+            else:
+                sent.append(email.pk)
+        OutboxEmail.objects.filter(pk__in=sent).update(
+            status=OutboxEmail.STATUS.Sent, sent_at=timezone.now(), last_error=""
+        )
+        self.totals["sent"] += len(sent)
+
+    def failed(self, email: OutboxEmail, error: Exception) -> None:
+        if email.attempts >= self.max_attempts:
+            changes = {"status": OutboxEmail.STATUS.Failed}
+            self.totals["failed"] += 1
+            self.stderr.write(f"Giving up on email {email.pk} after {email.attempts} attempts")
+        else:
+            changes = {
+                "next_attempt_at": timezone.now()
+                + retry_delay(email.attempts, self.backoff, cap=3600)
+            }
+            self.totals["retried"] += 1
+        OutboxEmail.objects.filter(pk=email.pk).update(
+            last_error=f"{type(error).__name__}: {error}", **changes
+        )
+
+    def purge(self) -> None:
+        now = timezone.now()
+        if self.purged_at and now - self.purged_at < PURGE_INTERVAL:
+            return
+        self.purged_at = now
+        OutboxEmail.objects.filter(
+            status=OutboxEmail.STATUS.Sent, sent_at__lt=now - self.keep
+        ).delete()
+
+    def close(self) -> None:
+        if self.opened:
+            self.opened = False
+            try:
+                self.connection.close()
+            except Exception:
+                pass
@@ -0,0 +1,81 @@
+from django.contrib.postgres.aggregates import ArrayAgg
+from django.core.management.base import BaseCommand
+from django.db.models import F, Max, Sum
+
+from core.models import SlowQuery
+
+ORDERINGS = {"total": "-total", "count": "-calls", "max": "-slowest", "mean": "-mean"}
+
+
+class Command(BaseCommand):
+    help = (
+        "Lists the slow queries logged by core.slow_queries (those taking SLOW_QUERY_SECONDS or "
+        "more) that took the most time in total, or were made most often, or were slowest, by "
+        "fingerprint, with the views that made them. --plans adds each one's latest EXPLAIN "
+        "plan and the code that made it."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--limit", type=int, default=20, help="Queries listed (default 20)."
+        )
+        parser.add_argument(
+            "--order",
+            choices=ORDERINGS,
+            default="total",
+            help="Rank by total time, count, slowest or mean time (default total).",
+        )
+        parser.add_argument("--view", help="Only the queries of this view, e.g. catalog:books.")
+        parser.add_argument(
+            "--plans", action="store_true", help="Print the plans and stacks too."
+        )
+        parser.add_argument(
+            "--reset", action="store_true", help="Forget the logged queries, and list none."
+        )
+
+    def handle(self, *args, limit: int, order: str, view: str | None, plans: bool, **options):
+        queries = SlowQuery.objects.all()
+        if view:
+            queries = queries.filter(view=view)
+        if options["reset"]:
+            deleted, _ = queries.delete()
+            self.stdout.write(f"Forgot {deleted} slow queries")
+            return
+
+        offenders = (
+            queries.values("fingerprint")
+            .annotate(
+                calls=Sum("count"),
+                total=Sum("total_ms"),
+                slowest=Max("max_ms"),
+                views=ArrayAgg("view", ordering="view"),
+                normalized=Max("sql"),
+            )
+            .annotate(mean=F("total") / F("calls"))
+            .order_by(ORDERINGS[order], "fingerprint")[:limit]
+        )
+        if not offenders:
+            self.stdout.write("No slow queries logged")
+            return
+        self.stdout.write(
+            f"{'total ms':>10} {'count':>7} {'mean ms':>9} {'max ms':>9}  fingerprint       views"
+        )
+        for offender in offenders:
+            self.stdout.write(
+                f"{offender['total']:10.1f} {offender['calls']:7d} {offender['mean']:9.1f} "
+                f"{offender['slowest']:9.1f}  {offender['fingerprint']}  "
+                f"{', '.join(offender['views'])}"
+            )
+            self.stdout.write(f"    {offender['normalized']}")
+            if plans:
+                self.print_plan(queries.filter(fingerprint=offender["fingerprint"]))
+
+    def print_plan(self, rows) -> None:
+        latest = rows.exclude(explained_at=None).order_by("-explained_at").first()
+        if latest is None:
+            return
+        for line in (latest.plan or "(not explainable)").splitlines():
+            self.stdout.write(f"      {line}")
+        self.stdout.write(f"    made at ({latest.view}):")
+        for line in latest.stack.splitlines():
+            self.stdout.write(f"      {line}")
@@ -0,0 +1,53 @@
+from django.core.management.base import BaseCommand, CommandError
+
+FIELDS = ("rss", "pss", "uss")
+
+
+def memory(pid: int) -> dict[str, int]:
+    """kB of the process's memory: resident (RSS), proportional (PSS, shared pages divided among
+    the processes sharing them) and unique (USS, pages no other process shares)."""
+    fields = {}
+    with open(f"/proc/{pid}/smaps_rollup") as smaps:
+        for line in smaps:
+            name, _, value = line.partition(":")
+            if value.strip().endswith("kB"):
+                fields[name] = int(value.split()[0])
+    return {
+        "rss": fields["Rss"],
+        "pss": fields["Pss"],
+        "uss": fields["Private_Clean"] + fields["Private_Dirty"],
+    }
+
+
+def megabytes(kb: dict[str, int]) -> str:
+    return "".join(f"{kb[field] / 1024:10.1f}" for field in FIELDS)
+
+
+def children(pid: int) -> list[int]:
+    with open(f"/proc/{pid}/task/{pid}/children") as task:
+        return [int(child) for child in task.read().split()]
+
+
+class Command(BaseCommand):
+    help = (
+        "Reports the memory of a running gunicorn master and its workers: each process's RSS, PSS "
+        "and USS, and the total PSS, which is what they take of the container's memory (summing "
+        "their RSS counts the pages they share copy-on-write once per process)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("pid", type=int, help="Process id of the gunicorn master.")
+
+    def handle(self, *args, pid: int, **options):
+        try:
+            processes = [("master", pid)] + [("worker", child) for child in children(pid)]
+            usage = [(role, process, memory(process)) for role, process in processes]
+        except FileNotFoundError:
+            raise CommandError(f"No process {pid}, or no /proc/<pid>/smaps_rollup to read")
+        except PermissionError:
+            raise CommandError(f"Not allowed to read the memory of process {pid}")
+        self.stdout.write(f"{'':8}{'pid':>8}{'RSS MB':>10}{'PSS MB':>10}{'USS MB':>10}")
+        for role, process, kb in usage:
+            self.stdout.write(f"{role:8}{process:>8}{megabytes(kb)}")
+        total = {field: sum(kb[field] for _, _, kb in usage) for field in FIELDS}
+        self.stdout.write(f"{'total':16}{megabytes(total)}")
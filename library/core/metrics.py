@@ -0,0 +1,133 @@
+"""Prometheus metrics of every gunicorn worker, served as one set from /metrics.
+
+gunicorn.conf.py points PROMETHEUS_MULTIPROC_DIR at an empty directory before the app loads, which
+makes prometheus_client keep each process's metric values in memory-mapped files there (one per
+process and metric type) instead of in the process. The /metrics view (core.views.metrics), served
+by any one worker, sums them all up, along with the collectors that query shared state (registered
+on `registry`). Collectors reading per-process state (e.g. core.db.base.PoolCollector) don't work
+in this mode, so their values are written to the files instead.
+
+When a worker exits, its counters and histograms are merged into one archive file per metric type
+(archive_process()), so the totals keep counting what it did while the number of files read by a
+scrape stays at a few per live worker, however many workers have been recycled."""
+
+import fcntl
+import glob
+import json
+import os
+from collections import defaultdict
+from collections.abc import Iterator
+from contextlib import contextmanager
+
+from prometheus_client import REGISTRY, CollectorRegistry
+from prometheus_client.metrics_core import Metric
+from prometheus_client.mmap_dict import MmapedDict, mmap_key
+from prometheus_client.multiprocess import MultiProcessCollector, mark_process_dead
+
+METRICS_DIR = os.environ.get("PROMETHEUS_MULTIPROC_DIR")
+MULTIPROCESS = bool(METRICS_DIR)
+# types whose values from dead processes still count (gauges are only of the live ones)
+ARCHIVED_TYPES = ("counter", "histogram", "summary")
+
+
+@contextmanager
+def files_lock(path: str, exclusive: bool) -> Iterator[None]:
+    """Keeps a scrape (shared) from reading the files while a dead process's values are moved
+    to the archives (exclusive), which would count them twice or not at all."""
+    with open(os.path.join(path, ".lock"), "a") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+class WorkersCollector(MultiProcessCollector):
+    """Every process's metrics, summed.
+
+    MultiProcessCollector parses every value of every file into a sample before adding them up, so
+    a scrape's cost grows with workers times series. This sums the counters, histograms and
+    summaries by their raw keys first, so each series is parsed once (and only the first time it's
+    seen) however many files it's in; gauges, whose modes combine them differently, are left to
+    MultiProcessCollector."""
+
+    def __init__(self, registry: CollectorRegistry, path: str):
+        super().__init__(registry, path)
+        self.parsed_keys: dict[str, tuple[str, str, tuple, str]] = {}
+
+    def parse_key(self, key: str) -> tuple[str, str, tuple, str]:
+        if (parsed := self.parsed_keys.get(key)) is None:
+            metric_name, name, labels, help_text = json.loads(key)
+            parsed = self.parsed_keys[key] = (
+                metric_name,
+                name,
+                tuple(sorted(labels.items())),
+                help_text,
+            )
+        return parsed
+
+    def collect(self):
+        totals: defaultdict[tuple[str, str], float] = defaultdict(float)
+        gauge_paths = []
+        with files_lock(self._path, exclusive=False):
+            for path in glob.glob(os.path.join(self._path, "*.db")):
+                metric_type = os.path.basename(path).partition("_")[0]
+                if metric_type == "gauge":
+                    gauge_paths.append(path)
+                    continue
+                for key, value, _, _ in MmapedDict.read_all_values_from_file(path):
+                    totals[metric_type, key] += value
+            gauges = self.merge(gauge_paths)
+        metrics: dict[str, Metric] = {}
+        for (metric_type, key), value in totals.items():
+            metric_name, name, labels, help_text = self.parse_key(key)
+            if (metric := metrics.get(metric_name)) is None:
+                metric = metrics[metric_name] = Metric(metric_name, help_text, metric_type)
+            metric.add_sample(name, labels, value)  # type: ignore
+        # adds up the histogram buckets
+        return [*self._accumulate_metrics(metrics, accumulate=True), *gauges]
+
+
+def archive_process(pid: int) -> None:
+    """Moves the values of a process that's exited into the archives, and drops its gauges."""
+    with files_lock(METRICS_DIR, exclusive=True):  # type: ignore
+        mark_process_dead(pid, METRICS_DIR)
+        for path in glob.glob(os.path.join(METRICS_DIR, f"gauge_*_{pid}.db")):  # type: ignore
+            os.remove(path)
+        for metric_type in ARCHIVED_TYPES:
+            path = os.path.join(METRICS_DIR, f"{metric_type}_{pid}.db")  # type: ignore
+            if not os.path.exists(path):
+                continue
+            archive = os.path.join(METRICS_DIR, f"{metric_type}_archive.db")  # type: ignore
+            merge_into(archive, [path])
+            os.remove(path)
+
+
+def merge_into(archive: str, paths: list[str]) -> None:
+    if os.path.exists(archive):
+        paths = [archive, *paths]
+    # as the values are stored, so histogram buckets aren't cumulative
+    metrics = MultiProcessCollector.merge(paths, accumulate=False)
+    merged = MmapedDict(f"{archive}.new")
+    try:
+        for metric in metrics:
+            for sample in metric.samples:
+                key = mmap_key(
+                    metric.name,
+                    sample.name,
+                    list(sample.labels),
+                    list(sample.labels.values()),
+                    metric.documentation,
+                )
+                merged.write_value(key, sample.value, 0.0)
+    finally:
+        merged.close()
+    os.replace(f"{archive}.new", archive)
+
+
+if MULTIPROCESS:
+    # the process's own registry only has the metrics of the process
+    registry = CollectorRegistry()
+    WorkersCollector(registry, METRICS_DIR)
+else:
+    registry = REGISTRY
@@ -0,0 +1,32 @@
+# Generated by Django 5.1.15 on 2026-10-18 20:14
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0003_create_admin_viewonly_user'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OutboxEmail',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('from_email', models.TextField()),
+                ('recipients', models.JSONField()),
+                ('message', models.BinaryField()),
+                ('status', models.CharField(choices=[('p', 'Pending'), ('s', 'Sent'), ('f', 'Failed')], default='p', max_length=1)),
+                ('attempts', models.PositiveSmallIntegerField(default=0)),
+                ('next_attempt_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('last_error', models.TextField(blank=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('sent_at', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'indexes': [models.Index(condition=models.Q(('status', 'p')), fields=['next_attempt_at'], name='outboxemail_pending_idx')],
+            },
+        ),
+    ]
@@ -1,6 +1,103 @@
 # Create your models here.
 from django.contrib.auth.models import AbstractUser
+from django.db import models
+from django.db.models import Q
+from django.utils import timezone
 
 
 class User(AbstractUser):
     pass
+
+
+class OutboxEmail(models.Model):
+    """Email queued by core.mail.OutboxEmailBackend, stored as the rendered MIME message plus its
+    envelope, until the drain_outbox worker delivers it."""
+
+    class STATUS(models.TextChoices):
+        Pending = ("p", "Pending")
+        Sent = ("s", "Sent")
+        Failed = ("f", "Failed")
+
+    from_email = models.TextField()
+    recipients = models.JSONField()
+    message = models.BinaryField()
+    status = models.CharField(
+        max_length=1, choices=STATUS, default=STATUS.Pending  # type: ignore
+    )
+    attempts = models.PositiveSmallIntegerField(default=0)
+    # when the message is next due to be (re)tried; also pushed out while a worker holds it
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            # the worker's queue: pending messages in the order they come due
+            models.Index(
+                fields=["next_attempt_at"],
+                name="outboxemail_pending_idx",
+                condition=Q(status="p"),
+            ),
+        ]
+
+    def __str__(self):
+        return f"Email to {', '.join(self.recipients)} ({self.get_status_display()})"  # type: ignore
+
+
+class RequestProfile(models.Model):
+    """A sampled call-stack profile of one request and the queries it made (see core.profiling)."""
+
+    class TRIGGER(models.TextChoices):
+        Requested = ("r", "Requested")
+        Sampled = ("s", "Sampled")
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    method = models.CharField(max_length=10)
+    path = models.TextField()
+    # URL name of the view, e.g. "catalog:books"
+    view = models.CharField(max_length=200, blank=True)
+    status_code = models.PositiveSmallIntegerField()
+    duration_ms = models.FloatField()
+    user = models.ForeignKey(User, null=True, blank=True, on_delete=models.SET_NULL)
+    trigger = models.CharField(max_length=1, choices=TRIGGER)
+    # folded stacks ("outer;...;inner count" lines), as flamegraph.pl and speedscope read them
+    stacks = models.TextField()
+    samples = models.PositiveIntegerField()
+    # [sql, milliseconds] of each query, in order
+    queries = models.JSONField()
+
+    class Meta:
+        permissions = [("profile_requests", "Can profile requests")]
+
+    def __str__(self):
+        return f"{self.method} {self.path} ({self.duration_ms:.0f} ms)"
+
+
+class SlowQuery(models.Model):
+    """The queries a view made that took SLOW_QUERY_SECONDS or more, counted by fingerprint (see
+    core.slow_queries), with the latest stack and plan."""
+
+    fingerprint = models.CharField(max_length=16)
+    # URL name of the view, e.g. "catalog:books"
+    view = models.CharField(max_length=200)
+    # the SQL with its values, and lists of them, replaced by "?"
+    sql = models.TextField()
+    count = models.PositiveIntegerField(default=0)
+    total_ms = models.FloatField(default=0)
+    max_ms = models.FloatField(default=0)
+    first_seen = models.DateTimeField(auto_now_add=True)
+    last_seen = models.DateTimeField(default=timezone.now)
+    # the project's frames that made the latest one, outermost first
+    stack = models.TextField(blank=True)
+    plan = models.TextField(blank=True)
+    explained_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        verbose_name_plural = "slow queries"
+        constraints = [
+            models.UniqueConstraint(fields=["fingerprint", "view"], name="slowquery_per_view"),
+        ]
+
+    def __str__(self):
+        return f"{self.fingerprint} in {self.view} ({self.count}x, max {self.max_ms:.0f} ms)"
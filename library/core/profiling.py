@@ -0,0 +1,162 @@
+"""Sampled call-stack profiles of production requests, with the queries they made.
+
+A request is profiled when a user with the core.profile_requests permission asks for it (a
+`profile` query parameter or an X-Profile header), or at random for a fraction of all requests
+(settings.REQUEST_PROFILE_SAMPLE_RATE). Requests that aren't profiled only pay for the check.
+
+While a request is profiled, a thread samples the stack of the thread handling it every
+settings.REQUEST_PROFILE_INTERVAL seconds. Under ASGI, where the request's code runs in both the
+event loop and sync_to_async threads (alongside other requests'), every thread is sampled, each
+under its own root frame. The profiles are kept as folded stacks (which flamegraph.pl and
+speedscope read) in RequestProfile rows, browsable and downloadable in the admin, and the newest
+settings.REQUEST_PROFILE_KEEP are kept."""
+
+import random
+import sys
+import threading
+import time
+from collections import Counter
+from types import FrameType
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.http import HttpRequest
+from django.urls import reverse
+
+from .instrumentation import logged_queries
+from .models import RequestProfile
+
+PROFILE_PARAM = "profile"
+PROFILE_HEADER = "HTTP_X_PROFILE"
+PERMISSION = "core.profile_requests"
+
+
+def fold(frame: FrameType | None, thread_name: str) -> str:
+    """The stack from the thread's root down to `frame`, as a folded stack."""
+    names = []
+    while frame is not None:
+        names.append(f"{frame.f_globals.get('__name__', '?')}.{frame.f_code.co_qualname}")
+        frame = frame.f_back
+    names.append(f"thread:{thread_name}")
+    return ";".join(reversed(names))
+
+
+class StackSampler(threading.Thread):
+    """Counts the stacks of the threads `thread_ids` (all but its own if None) every `interval`
+    seconds, until stopped."""
+
+    def __init__(self, interval: float, thread_ids: set[int] | None = None):
+        super().__init__(name="request-profiler", daemon=True)
+        self.interval = interval
+        self.thread_ids = thread_ids
+        self.stacks: Counter[str] = Counter()
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == self.ident or (
+                    self.thread_ids is not None and thread_id not in self.thread_ids
+                ):
+                    continue
+                self.stacks[fold(frame, names.get(thread_id, str(thread_id)))] += 1
+
+    def stop(self) -> Counter[str]:
+        self.stopped.set()
+        self.join()
+        return self.stacks
+
+
+class RequestProfilingMiddleware:
+    """Profiles the requests asked for by permitted users, and a sample of the rest (see the module
+    docstring). Must come after AuthenticationMiddleware; what comes before it isn't profiled."""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.sample_rate = settings.REQUEST_PROFILE_SAMPLE_RATE
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request: HttpRequest):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if (trigger := self.trigger(request)) is None:
+            return self.get_response(request)
+        user = None
+        if trigger == RequestProfile.TRIGGER.Requested:
+            if not request.user.has_perm(PERMISSION):
+                return self.get_response(request)
+            user = request.user
+        sampler = StackSampler(settings.REQUEST_PROFILE_INTERVAL, {threading.get_ident()})
+        with logged_queries() as queries:
+            start = time.perf_counter()
+            sampler.start()
+            try:
+                response = self.get_response(request)
+            finally:
+                stacks = sampler.stop()
+                duration = time.perf_counter() - start
+        profile = RequestProfile.objects.create(
+            **self.profile(request, user, response, trigger, stacks, queries, duration)
+        )
+        self.stale_profiles(profile).delete()
+        return self.link(response, profile)
+
+    async def __acall__(self, request: HttpRequest):
+        if (trigger := self.trigger(request)) is None:
+            return await self.get_response(request)
+        user = None
+        if trigger == RequestProfile.TRIGGER.Requested:
+            user = await request.auser()
+            if not await sync_to_async(user.has_perm)(PERMISSION):
+                return await self.get_response(request)
+        sampler = StackSampler(settings.REQUEST_PROFILE_INTERVAL)
+        with logged_queries() as queries:
+            start = time.perf_counter()
+            sampler.start()
+            try:
+                response = await self.get_response(request)
+            finally:
+                stacks = sampler.stop()
+                duration = time.perf_counter() - start
+        profile = await RequestProfile.objects.acreate(
+            **self.profile(request, user, response, trigger, stacks, queries, duration)
+        )
+        await self.stale_profiles(profile).adelete()
+        return self.link(response, profile)
+
+    def trigger(self, request: HttpRequest) -> str | None:
+        if PROFILE_PARAM in request.GET or PROFILE_HEADER in request.META:
+            return RequestProfile.TRIGGER.Requested
+        if self.sample_rate and random.random() < self.sample_rate:
+            return RequestProfile.TRIGGER.Sampled
+        return None
+
+    def profile(self, request, user, response, trigger, stacks, queries, duration) -> dict:
+        match = getattr(request, "resolver_match", None)
+        return {
+            "method": request.method,
+            "path": request.get_full_path(),
+            "view": match.view_name if match else "",
+            "status_code": response.status_code,
+            "duration_ms": duration * 1000,
+            # only known for requested profiles; sampled ones don't load the user
+            "user": user,
+            "trigger": trigger,
+            "stacks": "\n".join(f"{stack} {count}" for stack, count in stacks.items()),
+            "samples": stacks.total(),
+            "queries": [[sql, seconds * 1000] for sql, seconds in queries],
+        }
+
+    def stale_profiles(self, profile: RequestProfile):
+        return RequestProfile.objects.filter(pk__lte=profile.pk - settings.REQUEST_PROFILE_KEEP)
+
+    def link(self, response, profile: RequestProfile):
+        response["X-Request-Profile"] = reverse(
+            "admin:core_requestprofile_change", args=[profile.pk]
+        )
+        return response
@@ -0,0 +1,159 @@
+"""Read replicas (settings.DATABASE_REPLICAS) for the read-only views.
+
+Views wrapped in read_from_replicas() run their queries against a random replica, except for users
+who wrote something in the last DATABASE_REPLICA_STICKY_SECONDS (marked with a cookie by
+PrimaryStickinessMiddleware), who keep reading from the primary so they see their own writes.
+Everything else, including the session and user lookups done by middleware, uses the primary.
+
+The sticky window is also the most replica lag tolerated, which caches of rendered pages allow for
+(see staleness()). Each replica's lag is exported to Prometheus by ReplicaLagCollector."""
+
+import random
+from collections.abc import Callable, Iterator
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.db import DatabaseError, connections
+from django.http import HttpRequest
+from prometheus_client.core import GaugeMetricFamily
+from prometheus_client.registry import Collector
+
+# present (until it expires) for users who've just written something
+STICKY_COOKIE = "db_primary_sticky"
+SAFE_METHODS = ("GET", "HEAD", "OPTIONS")
+# 0 when the replica has replayed everything it has received (e.g. the primary is idle), rather
+# than the growing time since the last replayed transaction, and on a primary (e.g. a stand-in)
+LAG_SQL = """
+SELECT CASE
+    WHEN NOT pg_is_in_recovery() OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+    ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp())
+END
+"""
+
+_replica: ContextVar[str | None] = ContextVar("replica", default=None)
+
+
+class ReplicaRouter:
+    """Sends reads to the replica chosen for the current read_from_replicas() view, and everything
+    else to the primary."""
+
+    def db_for_read(self, model, **hints) -> str | None:
+        return _replica.get()
+
+    def db_for_write(self, model, **hints) -> str:
+        return "default"
+
+    def allow_relation(self, obj1, obj2, **hints) -> bool:
+        # the replicas hold the same rows as the primary
+        return True
+
+    def allow_migrate(self, db: str, app_label: str, **hints) -> bool:
+        return db not in settings.DATABASE_REPLICAS
+
+
+@contextmanager
+def replica_reads() -> Iterator[str | None]:
+    """Routes reads to one of the replicas (if any) for the duration of the block."""
+    alias = random.choice(settings.DATABASE_REPLICAS) if settings.DATABASE_REPLICAS else None
+    token = _replica.set(alias)
+    try:
+        yield alias
+    finally:
+        _replica.reset(token)
+
+
+def staleness() -> float:
+    """How far behind the primary the current reads may be, in seconds."""
+    return settings.DATABASE_REPLICA_STICKY_SECONDS if _replica.get() else 0
+
+
+def read_from_replicas(view: Callable) -> Callable:
+    """Runs a read-only (sync or async) view, template rendering included, against a replica."""
+    if iscoroutinefunction(view):
+
+        @wraps(view)
+        async def async_wrapper(request: HttpRequest, *args, **kwargs):
+            if request.method not in SAFE_METHODS or STICKY_COOKIE in request.COOKIES:
+                return await view(request, *args, **kwargs)
+            # the session and user come from the primary, where they're written (and are then
+            # usable from async code)
+            request.user = await request.auser()  # type: ignore
+            with replica_reads():
+                response = await view(request, *args, **kwargs)
+                if hasattr(response, "render"):
+                    await sync_to_async(response.render)()
+            return response
+
+        return async_wrapper
+
+    @wraps(view)
+    def wrapper(request: HttpRequest, *args, **kwargs):
+        if request.method not in SAFE_METHODS or STICKY_COOKIE in request.COOKIES:
+            return view(request, *args, **kwargs)
+        # the session and user (loaded lazily) come from the primary, where they're written
+        request.user.is_authenticated
+        with replica_reads():
+            response = view(request, *args, **kwargs)
+            # template responses query as they render
+            if hasattr(response, "render"):
+                response.render()
+        return response
+
+    return wrapper
+
+
+class PrimaryStickinessMiddleware:
+    """Keeps a user who's written something reading from the primary until the replicas have
+    caught up."""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request: HttpRequest):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        return self.stick(request, self.get_response(request))
+
+    async def __acall__(self, request: HttpRequest):
+        return self.stick(request, await self.get_response(request))
+
+    def stick(self, request: HttpRequest, response):
+        if settings.DATABASE_REPLICAS and request.method not in SAFE_METHODS:
+            response.set_cookie(
+                STICKY_COOKIE,
+                "1",
+                max_age=settings.DATABASE_REPLICA_STICKY_SECONDS,
+                secure=settings.SESSION_COOKIE_SECURE,
+                httponly=True,
+                samesite="Lax",
+            )
+        return response
+
+
+class ReplicaLagCollector(Collector):
+    """Replay lag of each replica, queried when /metrics is scraped."""
+
+    def collect(self):
+        lag = GaugeMetricFamily(
+            "django_db_replica_lag_seconds",
+            "Seconds the replica's replayed data is behind the primary.",
+            labels=["alias"],
+        )
+        for alias in settings.DATABASE_REPLICAS:
+            try:
+                with connections[alias].cursor() as cursor:
+                    cursor.execute(LAG_SQL)
+                    (seconds,) = cursor.fetchone()
+            except DatabaseError:
+                # an unreachable replica has no lag to report (its absence can be alerted on)
+                continue
+            lag.add_metric([alias], float(seconds))
+        yield lag
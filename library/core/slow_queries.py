@@ -0,0 +1,140 @@
+"""The slow query log: the queries taking settings.SLOW_QUERY_SECONDS or more while a view handles
+a request, counted by fingerprint and view in SlowQuery rows and Prometheus counters.
+
+A query's fingerprint is a hash of its SQL with the values, and lists of them, replaced by "?", so
+the same ORM query counts as one whatever it's filtered on and however many rows it inserts.
+core.instrumentation.record_query keeps each slow query with the project frames that made it; as
+the request finishes, they're queued for a thread that counts them and runs EXPLAIN on the
+fingerprint's latest query (at most every SLOW_QUERY_EXPLAIN_INTERVAL seconds), so the request
+doesn't wait on either. The slow_queries command lists the top offenders."""
+
+import datetime
+import hashlib
+import logging
+import queue
+import re
+import threading
+
+from django.conf import settings
+from django.db import DatabaseError, connections, transaction
+from django.db.models import F, Value
+from django.db.models.functions import Greatest
+from django.utils import timezone
+from prometheus_client import Counter
+
+from .instrumentation import TimedQuery
+from .models import SlowQuery
+
+logger = logging.getLogger(__name__)
+
+slow_queries = Counter(
+    "django_slow_queries",
+    "Queries taking SLOW_QUERY_SECONDS or more, by view and fingerprint (see SlowQuery.sql).",
+    ["view", "fingerprint"],
+)
+slow_query_seconds = Counter(
+    "django_slow_query_seconds",
+    "Time taken by queries taking SLOW_QUERY_SECONDS or more, by view and fingerprint.",
+    ["view", "fingerprint"],
+)
+slow_queries_dropped = Counter(
+    "django_slow_queries_dropped",
+    "Slow queries not logged because the log's queue was full.",
+)
+
+# slow queries waiting for the writer thread; past this, more are dropped rather than kept in
+# memory while the database is struggling
+QUEUE_SIZE = 1000
+# statements EXPLAIN takes
+EXPLAINABLE = {"SELECT", "WITH", "INSERT", "UPDATE", "DELETE"}
+
+VALUES = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b|%s")
+VALUE_LISTS = re.compile(r"\?(?:\s*,\s*\?)+")
+ROW_LISTS = re.compile(r"\(\?, \.\.\.\)(?:\s*,\s*\(\?, \.\.\.\))+")
+
+_queue: queue.Queue[tuple[str, TimedQuery]] = queue.Queue(QUEUE_SIZE)
+_writer: threading.Thread | None = None
+_writer_lock = threading.Lock()
+
+
+def normalize(sql: str) -> str:
+    sql = VALUES.sub("?", sql)
+    sql = VALUE_LISTS.sub("?, ...", sql)
+    sql = ROW_LISTS.sub("(?, ...), ...", sql)
+    return " ".join(sql.split())
+
+
+def fingerprint(normalized: str) -> str:
+    return hashlib.md5(normalized.encode(), usedforsecurity=False).hexdigest()[:16]
+
+
+def log(view: str, queries: list[TimedQuery]) -> None:
+    """Queues the slow queries a request to `view` made for the writer thread."""
+    start_writer()
+    for query in queries:
+        try:
+            _queue.put_nowait((view, query))
+        except queue.Full:
+            slow_queries_dropped.inc()
+
+
+def start_writer() -> None:
+    # started by the first slow query, so each gunicorn worker starts its own (threads don't
+    # survive a fork)
+    global _writer
+    with _writer_lock:
+        if _writer is None or not _writer.is_alive():
+            _writer = threading.Thread(target=write_forever, name="slow-query-log", daemon=True)
+            _writer.start()
+
+
+def write_forever() -> None:
+    while True:
+        view, query = _queue.get()
+        try:
+            save(view, query)
+        except Exception:
+            logger.exception("Couldn't log a slow query in %s", view)
+        if _queue.empty():
+            # back to the pool until there's more to write
+            connections.close_all()
+
+
+def save(view: str, query: TimedQuery) -> SlowQuery:
+    normalized = normalize(query.sql)
+    key = fingerprint(normalized)
+    slow_queries.labels(view, key).inc()
+    slow_query_seconds.labels(view, key).inc(query.seconds)
+
+    now = timezone.now()
+    ms = query.seconds * 1000
+    row, _ = SlowQuery.objects.get_or_create(
+        fingerprint=key, view=view, defaults={"sql": normalized}
+    )
+    updates = {
+        "count": F("count") + 1,
+        "total_ms": F("total_ms") + ms,
+        "max_ms": Greatest("max_ms", Value(ms)),
+        "last_seen": now,
+        "stack": query.stack,
+    }
+    interval = datetime.timedelta(seconds=settings.SLOW_QUERY_EXPLAIN_INTERVAL)
+    if row.explained_at is None or now - row.explained_at >= interval:
+        updates.update(plan=explain(query), explained_at=now)
+    SlowQuery.objects.filter(pk=row.pk).update(**updates)
+    return row
+
+
+def explain(query: TimedQuery) -> str:
+    """The plan of `query` (not run: EXPLAIN without ANALYZE), on the database it ran on."""
+    statement = query.sql.lstrip().partition(" ")[0].upper()
+    # executemany()'s have no one set of parameters to plan with
+    if (query.params is None and "%s" in query.sql) or statement not in EXPLAINABLE:
+        return ""
+    try:
+        # a savepoint, should it be asked for in a transaction
+        with transaction.atomic(using=query.alias), connections[query.alias].cursor() as cursor:
+            cursor.execute(f"EXPLAIN {query.sql}", query.params)
+            return "\n".join(line for line, in cursor.fetchall())
+    except DatabaseError as error:
+        return f"EXPLAIN failed: {error}"
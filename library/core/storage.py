@@ -1,11 +1,20 @@
 import importlib
 import logging
 import os
+import time
 from typing import override
 from uuid import uuid4
 
 from django.contrib.staticfiles.storage import ManifestStaticFilesStorage as Base
 from django.core.files.storage import Storage
+from prometheus_client import Histogram
+
+storage_save_seconds = Histogram(
+    "django_storage_save_seconds",
+    "Time taken to save an uploaded file (e.g. a book cover) to media storage, by backend.",
+    ["backend"],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30),
+)
 
 # forces hashed filenames to be used for statics even if in debug mode
 class UseHashUrlManifestStaticFilesStorage(Base):
@@ -41,12 +50,20 @@ class UuidNameStorage:
         module, name = class_name.rsplit(".", 1)
         class_ref = getattr(importlib.import_module(module), name)
         self.__base: Storage = class_ref(**settings)
+        self.__backend = name
 
     # only called when attr is not found, which is why this class doesn't extend Storage (so all
     # attributes are passed through to __base)
     def __getattr__(self, attr, **kwargs):
         return getattr(self.__base, attr, **kwargs)
 
+    def save(self, name, content, max_length=None) -> str:
+        start = time.perf_counter()
+        try:
+            return self.__base.save(name, content, max_length=max_length)
+        finally:
+            storage_save_seconds.labels(self.__backend).observe(time.perf_counter() - start)
+
     def generate_filename(self, filename: str) -> str:
         filename = self.__base.generate_filename(filename)
         try:
@@ -1,3 +1,539 @@
-from django.test import TestCase
+import datetime
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth import get_user_model
+from django.core import mail
+from django.conf import settings
+from django.core.management import call_command
+from django.db import connection, router
+from django.template import engines
+from django.http import HttpResponse
+from django.test import RequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from prometheus_client import REGISTRY, CollectorRegistry, generate_latest
+from prometheus_client.mmap_dict import MmapedDict, mmap_key
+from prometheus_client.multiprocess import MultiProcessCollector
+
+from catalog.management.smtp_stub import SMTPStub
+from catalog.models import Book
+from core.db.base import PoolCollector, PoolStatsExporter
+from core.metrics import WorkersCollector, archive_process
+from core import log, slow_queries
+from core.models import OutboxEmail, RequestProfile, SlowQuery
+from core.profiling import StackSampler
+from core.replicas import (
+    STICKY_COOKIE,
+    ReplicaLagCollector,
+    read_from_replicas,
+    replica_reads,
+    staleness,
+)
+from core.slow_queries import fingerprint, normalize
+from core.warmup import warm_templates
+
+
+@override_settings(
+    EMAIL_BACKEND="core.mail.OutboxEmailBackend",
+    OUTBOX_DELIVERY_BACKEND="django.core.mail.backends.locmem.EmailBackend",
+)
+class OutboxEmailTest(TestCase):
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            username="reader", email="reader@example.com", password="1X<ISRUkw+tuK"
+        )
+
+    def drain(self, *args):
+        out, err = StringIO(), StringIO()
+        call_command("drain_outbox", "--once", *args, stdout=out, stderr=err)
+        return out.getvalue()
+
+    def test_requests_only_queue_mail(self):
+        response = self.client.post(
+            reverse("account_reset_password"), {"email": self.user.email}, secure=True
+        )
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(mail.outbox, [])
+        queued = OutboxEmail.objects.get()
+        self.assertEqual(queued.recipients, ["reader@example.com"])
+        self.assertEqual(queued.status, OutboxEmail.STATUS.Pending)
+
+        self.assertIn("Sent 1 messages", self.drain())
+        (message,) = mail.outbox
+        self.assertEqual(message.recipients(), ["reader@example.com"])
+        self.assertIn("Password Reset", message.message()["Subject"])
+        queued.refresh_from_db()
+        self.assertEqual(queued.status, OutboxEmail.STATUS.Sent)
+
+    def test_delivers_over_one_smtp_connection(self):
+        for i in range(3):
+            mail.send_mail(f"Message {i}", "Body", None, [f"reader{i}@example.com"])
+        with SMTPStub() as stub, self.settings(
+            OUTBOX_DELIVERY_BACKEND="django.core.mail.backends.smtp.EmailBackend",
+            EMAIL_HOST="127.0.0.1",
+            EMAIL_PORT=stub.port,
+            EMAIL_HOST_USER="",
+            EMAIL_USE_TLS=False,
+        ):
+            self.assertIn("Sent 3 messages", self.drain("--batch-size", "2"))
+        self.assertEqual(
+            sorted(message["Subject"] for message in stub.messages),
+            ["Message 0", "Message 1", "Message 2"],
+        )
+        self.assertEqual(stub.connections, 1)
+
+    def test_failures_back_off_then_give_up(self):
+        mail.send_mail("Hello", "Body", None, ["reader@example.com"])
+        with SMTPStub() as stub:
+            port = stub.port
+        # nothing listens on the port any more
+        unreachable = self.settings(
+            OUTBOX_DELIVERY_BACKEND="django.core.mail.backends.smtp.EmailBackend",
+            EMAIL_HOST="127.0.0.1",
+            EMAIL_PORT=port,
+            EMAIL_HOST_USER="",
+            EMAIL_USE_TLS=False,
+        )
+        with unreachable:
+            self.assertIn("1 to be retried", self.drain("--max-attempts", "2"))
+            queued = OutboxEmail.objects.get()
+            self.assertEqual(queued.attempts, 1)
+            self.assertGreater(queued.next_attempt_at, timezone.now())
+            self.assertIn("ConnectionRefusedError", queued.last_error)
+
+            # not due again yet
+            self.assertIn("Sent 0 messages (0/s), 0 to be retried", self.drain())
+            queued.next_attempt_at = timezone.now()
+            queued.save()
+            self.assertIn("1 failed", self.drain("--max-attempts", "2"))
+        queued.refresh_from_db()
+        self.assertEqual(queued.status, OutboxEmail.STATUS.Failed)
+
+    def test_purges_old_sent_messages(self):
+        mail.send_mail("Hello", "Body", None, ["reader@example.com"])
+        self.drain()
+        OutboxEmail.objects.update(sent_at=timezone.now() - datetime.timedelta(days=8))
+        self.drain()
+        self.assertFalse(OutboxEmail.objects.exists())
+
+
+@read_from_replicas
+def reading_view(request):
+    return HttpResponse(router.db_for_read(Book))
+
+
+@override_settings(DATABASE_REPLICAS=["replica1", "replica2"], DATABASE_REPLICA_STICKY_SECONDS=5)
+class ReplicaRouterTest(TestCase):
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            username="reader", email="reader@example.com", password="1X<ISRUkw+tuK"
+        )
+
+    def get(self, **cookies):
+        request = RequestFactory().get("/")
+        request.user = self.user
+        request.COOKIES.update(cookies)
+        return reading_view(request).content.decode()
+
+    def test_reads_from_replicas_only_in_read_only_views(self):
+        self.assertEqual(router.db_for_read(Book), "default")
+        self.assertEqual(staleness(), 0)
+        with replica_reads() as alias:
+            self.assertIn(alias, ["replica1", "replica2"])
+            self.assertEqual(router.db_for_read(Book), alias)
+            self.assertEqual(router.db_for_write(Book), "default")
+            self.assertEqual(staleness(), 5)
+        self.assertEqual(router.db_for_read(Book), "default")
+
+        self.assertIn(self.get(), ["replica1", "replica2"])
+        self.assertEqual(self.get(**{STICKY_COOKIE: "1"}), "default")
+        self.assertFalse(router.allow_migrate("replica1", "catalog"))
+        self.assertTrue(router.allow_migrate("default", "catalog"))
+
+    def test_writes_stick_to_the_primary(self):
+        self.client.force_login(self.user)
+        response = self.client.get(reverse("account_email"), secure=True)
+        self.assertNotIn(STICKY_COOKIE, response.cookies)
+        response = self.client.post(reverse("account_logout"), secure=True)
+        cookie = response.cookies[STICKY_COOKIE]
+        self.assertEqual(cookie["max-age"], 5)
+        self.assertTrue(cookie["httponly"])
+
+        with self.settings(DATABASE_REPLICAS=[]):
+            response = self.client.post(reverse("account_logout"), secure=True)
+            self.assertNotIn(STICKY_COOKIE, response.cookies)
+
+    @override_settings(DATABASE_REPLICAS=["default"])
+    def test_lag_collector(self):
+        # the primary, standing in for a replica, is never behind
+        (lag,) = ReplicaLagCollector().collect()
+        self.assertEqual(lag.name, "django_db_replica_lag_seconds")
+        self.assertEqual([(s.labels, s.value) for s in lag.samples], [({"alias": "default"}, 0.0)])
+
+
+class PoolCollectorTest(TestCase):
+    def test_exports_pool_stats(self):
+        connection.ensure_connection()
+        families = {family.name: family for family in PoolCollector().collect()}
+        (max_size,) = [
+            sample.value
+            for sample in families["django_db_pool_max_size"].samples
+            if sample.labels == {"alias": "default"}
+        ]
+        self.assertEqual(max_size, settings.DATABASES["default"]["OPTIONS"]["pool"]["max_size"])
+        opened = {
+            sample.labels["alias"]: sample.value
+            for sample in families["django_db_pool_connections_created"].samples
+        }
+        self.assertGreaterEqual(opened["default"], 1)
+
+    def test_exporter_adds_what_the_pool_counted_since_the_last_export(self):
+        connection.ensure_connection()
+        export = PoolStatsExporter(interval=0)
+        export()
+        counters = {counter._name: counter for _, counter, _ in export.counters}
+        requests = counters["django_db_pool_requests"].labels("default")
+        exported = requests._value.get()
+        self.assertGreaterEqual(exported, 1)
+        with connection.pool.connection():
+            pass
+        export()
+        self.assertEqual(requests._value.get(), exported + 1)
+
+
+class WarmUpTest(TestCase):
+    def test_templates_are_compiled_into_the_cached_loader(self):
+        (loader,) = engines["django"].engine.template_loaders
+        loader.reset()
+        self.assertGreater(warm_templates(), 0)
+        self.assertIn("catalog/book_list.html", loader.get_template_cache)
+        self.assertIn("account/login.html", loader.get_template_cache)
+
+
+class WorkersCollectorTest(TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.path = self.directory.name
+
+    def write(self, file: str, values: list[tuple[str, str, dict, float]]):
+        metrics = MmapedDict(os.path.join(self.path, file))
+        for metric, name, labels, value in values:
+            metrics.write_value(
+                mmap_key(metric, name, list(labels), list(labels.values()), "Help."), value, 0.0
+            )
+        metrics.close()
+
+    def write_worker(self, pid: int, requests: float, fast: float, slow: float):
+        self.write(f"counter_{pid}.db", [("requests", "requests_total", {"view": "a"}, requests)])
+        self.write(
+            f"histogram_{pid}.db",
+            [
+                ("latency", "latency_bucket", {"le": "0.1"}, fast),
+                ("latency", "latency_bucket", {"le": "+Inf"}, slow),
+                ("latency", "latency_sum", {}, fast * 0.05 + slow),
+            ],
+        )
+        self.write(f"gauge_livesum_{pid}.db", [("connections", "connections", {}, 1)])
+
+    def scrape(self, collector_class) -> list[bytes]:
+        registry = CollectorRegistry()
+        collector_class(registry, self.path)
+        return sorted(generate_latest(registry).splitlines())
+
+    def test_sums_the_workers_as_multiprocess_collector_does(self):
+        self.write_worker(101, requests=3, fast=2, slow=1)
+        self.write_worker(102, requests=5, fast=5, slow=0)
+        scraped = self.scrape(WorkersCollector)
+        self.assertEqual(scraped, self.scrape(MultiProcessCollector))
+        self.assertIn(b"requests_total{view=\"a\"} 8.0", scraped)
+        self.assertIn(b"latency_count 8.0", scraped)
+        self.assertIn(b"connections 2.0", scraped)
+
+    def test_exited_workers_are_archived(self):
+        self.write_worker(101, requests=3, fast=2, slow=1)
+        self.write_worker(102, requests=5, fast=5, slow=0)
+        self.write_worker(103, requests=1, fast=1, slow=0)
+        before = self.scrape(WorkersCollector)
+        with mock.patch("core.metrics.METRICS_DIR", self.path):
+            archive_process(101)
+            archive_process(102)
+        self.assertEqual(
+            sorted(os.listdir(self.path)),
+            [
+                ".lock",
+                "counter_103.db",
+                "counter_archive.db",
+                "gauge_livesum_103.db",
+                "histogram_103.db",
+                "histogram_archive.db",
+            ],
+        )
+        after = self.scrape(WorkersCollector)
+        # only the live worker's gauge is left
+        self.assertEqual(
+            [line for line in before if not line.startswith(b"connections ")],
+            [line for line in after if not line.startswith(b"connections ")],
+        )
+        self.assertIn(b"connections 1.0", after)
+
+
+class InstrumentationTest(TestCase):
+    def sample(self, name: str, labels: dict) -> float:
+        return REGISTRY.get_sample_value(name, labels) or 0
+
+    def test_queries_are_observed_by_view(self):
+        view = {"view": "catalog:index"}
+        count = self.sample("django_view_db_queries_count", view)
+        queries = self.sample("django_view_db_queries_sum", view)
+        with CaptureQueriesContext(connection) as captured:
+            self.client.get(reverse("catalog:index"), secure=True)
+        self.assertEqual(self.sample("django_view_db_queries_count", view), count + 1)
+        made = len(captured.captured_queries)
+        self.assertEqual(self.sample("django_view_db_queries_sum", view), queries + made)
+        self.assertGreater(self.sample("django_view_db_seconds_sum", view), 0)
+
+    def test_templates_are_timed_by_name(self):
+        template = {"template": "catalog/index.html"}
+        count = self.sample("django_template_render_seconds_count", template)
+        self.client.get(reverse("catalog:index"), secure=True)
+        self.assertEqual(self.sample("django_template_render_seconds_count", template), count + 1)
+
+
+def busy(seconds: float) -> None:
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        pass
+
+
+class RequestProfilingTest(TestCase):
+    def setUp(self):
+        self.staff = get_user_model().objects.create_superuser(
+            username="profiler", email="profiler@example.com", password="1X<ISRUkw+tuK"
+        )
+        self.member = get_user_model().objects.create_user(
+            username="member", email="member@example.com", password="1X<ISRUkw+tuK"
+        )
+
+    def test_sampler_counts_the_stacks_of_the_thread(self):
+        sampler = StackSampler(0.001, {threading.get_ident()})
+        sampler.start()
+        busy(0.1)
+        stacks = sampler.stop()
+        self.assertGreater(stacks.total(), 0)
+        stack = max(stacks, key=stacks.__getitem__)
+        self.assertTrue(stack.startswith("thread:MainThread;"), stack)
+        self.assertTrue(stack.endswith(";core.tests.busy"), stack)
+
+    def test_permitted_users_can_profile_requests(self):
+        self.client.force_login(self.staff)
+        response = self.client.get(reverse("catalog:index"), {"profile": ""}, secure=True)
+        profile = RequestProfile.objects.get()
+        self.assertEqual(
+            response["X-Request-Profile"],
+            reverse("admin:core_requestprofile_change", args=[profile.pk]),
+        )
+        self.assertEqual(profile.trigger, RequestProfile.TRIGGER.Requested)
+        self.assertEqual(profile.user, self.staff)
+        self.assertEqual((profile.view, profile.status_code), ("catalog:index", 200))
+        self.assertTrue(any("catalog_librarystats" in sql for sql, _ in profile.queries))
+
+        self.client.get(reverse("catalog:index"), HTTP_X_PROFILE="1", secure=True)
+        self.assertEqual(RequestProfile.objects.count(), 2)
+
+        response = self.client.get(
+            reverse("admin:core_requestprofile_change", args=[profile.pk]), secure=True
+        )
+        self.assertContains(response, "catalog_librarystats")
+        response = self.client.get(
+            reverse("admin:core_requestprofile_stacks", args=[profile.pk]), secure=True
+        )
+        self.assertEqual(response.content.decode(), profile.stacks)
+
+    async def test_requests_are_profiled_under_asgi(self):
+        await self.async_client.aforce_login(self.staff)
+        response = await self.async_client.get(
+            reverse("catalog:index"), {"profile": ""}, secure=True
+        )
+        profile = await RequestProfile.objects.select_related("user").aget()
+        self.assertEqual(profile.user, self.staff)
+        self.assertEqual(profile.status_code, 200)
+        self.assertIn(str(profile.pk), response["X-Request-Profile"])
+
+    def test_other_requests_are_not_profiled(self):
+        self.client.force_login(self.member)
+        response = self.client.get(reverse("catalog:index"), {"profile": ""}, secure=True)
+        self.assertNotIn("X-Request-Profile", response)
+        self.client.force_login(self.staff)
+        self.client.get(reverse("catalog:index"), secure=True)
+        self.assertFalse(RequestProfile.objects.exists())
+
+    @override_settings(REQUEST_PROFILE_SAMPLE_RATE=1, REQUEST_PROFILE_KEEP=2)
+    def test_sampled_requests_are_profiled_and_old_profiles_dropped(self):
+        for _ in range(3):
+            self.client.get(reverse("catalog:index"), secure=True)
+        profiles = RequestProfile.objects.order_by("pk")
+        self.assertEqual(len(profiles), 2)
+        self.assertEqual(
+            [(profile.trigger, profile.user) for profile in profiles],
+            [(RequestProfile.TRIGGER.Sampled, None)] * 2,
+        )
+
+
+def log_now(view, queries):
+    # as the slow query log's writer thread would, but in the test's transaction
+    for query in queries:
+        slow_queries.save(view, query)
+
+
+@override_settings(SLOW_QUERY_SECONDS=0)
+class SlowQueryLogTest(TestCase):
+    def setUp(self):
+        # signed in, so the page isn't cached
+        self.client.force_login(
+            get_user_model().objects.create_user(username="reader", password="1X<ISRUkw+tuK")
+        )
+
+    def test_queries_differing_in_values_share_a_fingerprint(self):
+        self.assertEqual(
+            normalize("SELECT *\n FROM t WHERE id IN (%s, %s, %s) AND name = 'it''s' LIMIT 21"),
+            "SELECT * FROM t WHERE id IN (?, ...) AND name = ? LIMIT ?",
+        )
+        self.assertEqual(
+            normalize('INSERT INTO "t" ("a", "b") VALUES (%s, %s), (%s, %s), (%s, %s)'),
+            'INSERT INTO "t" ("a", "b") VALUES (?, ...), ...',
+        )
+        self.assertEqual(
+            fingerprint(normalize("SELECT * FROM t1 WHERE id IN (%s, %s)")),
+            fingerprint(normalize("SELECT * FROM t1 WHERE id IN (1, 2, 3)")),
+        )
+
+    @mock.patch("core.slow_queries.log", log_now)
+    def test_slow_queries_are_logged_with_their_view_plan_and_stack(self):
+        Book.objects.create(title="Book Title", summary="Summary", isbn="1234567890123")
+        for _ in range(2):
+            self.client.get(reverse("catalog:books"), secure=True)
+        # the page of books
+        query = SlowQuery.objects.get(
+            view="catalog:books", sql__startswith='SELECT "catalog_book"."id"'
+        )
+        self.assertEqual(query.count, 2)
+        self.assertGreater(query.total_ms, query.max_ms)
+        self.assertIn("Scan", query.plan)
+        self.assertIn("catalog/", query.stack)
+        self.assertEqual(
+            REGISTRY.get_sample_value(
+                "django_slow_queries_total",
+                {"view": "catalog:books", "fingerprint": query.fingerprint},
+            ),
+            2,
+        )
+
+        out = StringIO()
+        call_command("slow_queries", "--plans", "--view", "catalog:books", stdout=out)
+        self.assertIn(f"{query.fingerprint}  catalog:books", out.getvalue())
+        self.assertIn(query.sql, out.getvalue())
+        self.assertIn(query.plan.splitlines()[0], out.getvalue())
+
+        call_command("slow_queries", "--reset", stdout=StringIO())
+        self.assertFalse(SlowQuery.objects.exists())
+
+    def test_fast_queries_are_not_logged(self):
+        with override_settings(SLOW_QUERY_SECONDS=60), mock.patch("core.slow_queries.log") as log:
+            self.client.get(reverse("catalog:books"), secure=True)
+        log.assert_not_called()
+
+
+class BlockingStream(StringIO):
+    """Records each write, which waits until `unblocked` is set."""
+
+    def __init__(self):
+        super().__init__()
+        self.writes: list[str] = []
+        self.writing = threading.Event()
+        self.unblocked = threading.Event()
+        self.unblocked.set()
+
+    def write(self, text):
+        self.writing.set()
+        self.unblocked.wait()
+        self.writes.append(text)
+        return super().write(text)
+
+
+class QueueLoggingTest(TestCase):
+    def setUp(self):
+        self.stream = BlockingStream()
+        self.handler = log.QueueHandler(self.stream)
+        self.handler.setFormatter(log.JsonFormatter())
+        self.addCleanup(self.handler.close)
+        self.logger = logging.getLogger("core.tests.queue")
+        self.logger.addHandler(self.handler)
+        self.logger.propagate = False
+        self.addCleanup(self.logger.removeHandler, self.handler)
+
+    def lines(self) -> list[dict]:
+        return [json.loads(line) for line in self.stream.getvalue().splitlines()]
+
+    def test_records_are_written_as_json_lines_in_whole_chunks(self):
+        request = RequestFactory().get("/catalog/books/?page=2")
+        words = ["before"]
+        for i in range(200):
+            try:
+                raise ValueError(i)
+            except ValueError:
+                self.logger.error(
+                    "Failed %s %s", i, words, exc_info=True, extra={"request": request}
+                )
+        # merged as logged, not as the listener gets to it
+        words.append("after")
+        self.handler.close()
+
+        lines = self.lines()
+        self.assertEqual(
+            [line["message"] for line in lines],
+            [f"Failed {i} ['before']" for i in range(200)],
+        )
+        self.assertEqual(lines[0]["request"], "GET /catalog/books/?page=2")
+        self.assertEqual(lines[0]["level"], "ERROR")
+        self.assertIn("ValueError: 0", lines[0]["exception"])
+        # batched, and never splitting a line
+        self.assertLess(len(self.stream.writes), 200)
+        for chunk in self.stream.writes:
+            self.assertLessEqual(len(chunk), log.CHUNK_BYTES)
+            self.assertTrue(chunk.endswith("\n"))
+
+    @mock.patch("core.log.QUEUE_SIZE", 5)
+    def test_records_are_dropped_rather_than_blocking_when_the_queue_is_full(self):
+        handler = log.QueueHandler(self.stream)
+        handler.setFormatter(log.JsonFormatter())
+        self.logger.removeHandler(self.handler)
+        self.logger.addHandler(handler)
+        self.addCleanup(self.logger.removeHandler, handler)
+        self.stream.unblocked.clear()
+        self.logger.error("first")
+        self.assertTrue(self.stream.writing.wait(5))
+        dropped = REGISTRY.get_sample_value("django_log_records_dropped_total")
+
+        start = time.perf_counter()
+        for i in range(8):
+            self.logger.error("queued %s", i)
+        self.assertLess(time.perf_counter() - start, 1)
+        self.assertEqual(
+            REGISTRY.get_sample_value("django_log_records_dropped_total"), dropped + 3
+        )
+
+        self.stream.unblocked.set()
+        handler.close()
+        self.assertEqual(
+            [line["message"] for line in self.lines()],
+            ["first", *(f"queued {i}" for i in range(5))],
+        )
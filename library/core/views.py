@@ -3,7 +3,10 @@ from typing import override
 from allauth.account.forms import SignupForm
 from allauth.account.views import SignupView
 from django.contrib.auth.models import Group
+from django.http import HttpRequest, HttpResponse
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
 
+from .metrics import registry
 from .models import User
 
 
@@ -18,3 +21,8 @@ class LibraryMemberSignupView(SignupView):
             return user
 
     form_class = LibraryMemberSignupForm
+
+
+def metrics(request: HttpRequest) -> HttpResponse:
+    """The metrics of every worker process (see core.metrics), for Prometheus to scrape."""
+    return HttpResponse(generate_latest(registry), content_type=CONTENT_TYPE_LATEST)
@@ -0,0 +1,61 @@
+"""Startup work the gunicorn master does once, after preloading the app and before forking the
+workers (see gunicorn.conf.py), so the workers share the result copy-on-write instead of each doing
+it again on their first requests."""
+
+import importlib
+import os
+
+from django.conf import settings
+from django.core.files.storage import storages
+from django.template import TemplateDoesNotExist, TemplateSyntaxError, engines
+from django.urls import URLResolver, get_resolver
+from django.utils import translation
+
+
+def warm_up() -> None:
+    warm_url_resolvers(get_resolver())
+    warm_templates()
+    # storage backends (boto3 for S3), and Pillow, which image fields import on first use
+    for alias in settings.STORAGES:
+        storages[alias]
+    importlib.import_module("PIL.Image")
+    translation.activate(settings.LANGUAGE_CODE)
+    translation.deactivate()
+
+
+def warm_url_resolvers(resolver: URLResolver) -> None:
+    """Imports every URLconf (and so every view module) and builds the reverse() lookups of each
+    resolver, namespaced ones included."""
+    resolver.reverse_dict
+    for pattern in resolver.url_patterns:
+        if isinstance(pattern, URLResolver):
+            warm_url_resolvers(pattern)
+
+
+def warm_templates() -> int:
+    """Compiles every template the engines can find into their cached loaders, returning how many
+    there were."""
+    compiled = 0
+    for engine in engines.all():
+        names = set()
+        for directory in template_dirs(engine):
+            for root, _, files in os.walk(directory):
+                for file in files:
+                    names.add(os.path.relpath(os.path.join(root, file), directory))
+        for name in names:
+            try:
+                engine.get_template(name)
+            except (TemplateDoesNotExist, TemplateSyntaxError, UnicodeDecodeError):
+                # e.g. templates of apps that aren't installed, which are never rendered
+                continue
+            compiled += 1
+    return compiled
+
+
+def template_dirs(engine) -> list:
+    dirs = []
+    for loader in engine.engine.template_loaders:
+        # the cached loader wraps the filesystem and app directories loaders
+        for wrapped in getattr(loader, "loaders", [loader]):
+            dirs.extend(wrapped.get_dirs())
+    return dirs
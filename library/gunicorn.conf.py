@@ -1,9 +1,113 @@
+import gc
 import multiprocessing
+import os
+import shutil
+import signal
+import threading
+import time
+
+# GUNICORN_SERVER=asgi serves the site through library.asgi with uvicorn workers, whose event loops
+# keep many (e.g. slow) connections open at once, and with async versions of the read-only catalog
+# pages (see catalog.async_views); the default is library.wsgi with sync workers, which each serve
+# one connection at a time
+ASGI = os.environ.get("GUNICORN_SERVER", "wsgi") == "asgi"
+
+if ASGI:
+    wsgi_app = "library.asgi:application"
+    worker_class = "uvicorn_worker.UvicornWorker"
+    # a worker is never blocked waiting on a connection, so there's no need for more than the
+    # cores
+    workers = multiprocessing.cpu_count() + 1
+    # each worker serves several requests at once, each with its own database connection while
+    # it queries (see DATABASES)
+    os.environ.setdefault("POSTGRES_POOL_MAX_SIZE", "10")
+else:
+    wsgi_app = "library.wsgi:application"
+    # limit to one worker when debugging templates in preprod since you get some weird caching issues across workers
+    # otherwise (even though the cache loader is disabled in settings.py *shrug*)
+    workers = multiprocessing.cpu_count() * 2 + 1
+
+# in production the master loads the app, and warms it up (see core.warmup), once before forking
+# the workers, which then share those pages of memory copy-on-write rather than each loading its
+# own copy. Collections are disabled until gc.freeze() moves everything loaded out of their reach:
+# a collection writes to every object it visits (and so copies the page it's on into the worker).
+PRODUCTION = os.environ.get("DJANGO_ENV") in ("prod", "preprod")
+preload_app = PRODUCTION
+if preload_app:
+    gc.disable()
+
+
+def memory_mb() -> int:
+    """The memory the master and workers share: the container's cgroup limit if it has one, else
+    the machine's (e.g. a fly.io VM's)."""
+    try:
+        with open("/sys/fs/cgroup/memory.max") as limit:
+            return int(limit.read()) // 2**20
+    except (OSError, ValueError):  # no cgroup v2, or no limit ("max")
+        return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES") // 2**20
+
+
+# a worker whose resident memory grows past this (e.g. through fragmentation, or a leak) finishes
+# its current requests and is replaced by a fresh one. By default that's the workers' share of the
+# memory, so they're replaced before the machine runs out; RSS includes the pages shared with the
+# master, so the shares overlap. It must stay well above a fresh worker's RSS, ~60 MB, or workers
+# are replaced as they boot.
+MAX_WORKER_RSS_MB = int(
+    os.environ.get("GUNICORN_MAX_WORKER_RSS_MB", max(memory_mb() // workers, 100))
+)
+RSS_CHECK_SECONDS = 10
+
+# the workers' Prometheus metrics are kept in files here, to be served together (see core.metrics);
+# a tmpfs, since they're written on every request. It's emptied when gunicorn starts (and not when
+# the config is reloaded, when the env var is already set), before the app is loaded.
+METRICS_DIR = os.environ.get(
+    "GUNICORN_METRICS_DIR",
+    "/dev/shm/library-metrics" if os.path.isdir("/dev/shm") else "/tmp/library-metrics",
+)
+if "PROMETHEUS_MULTIPROC_DIR" not in os.environ:
+    shutil.rmtree(METRICS_DIR, ignore_errors=True)
+    os.makedirs(METRICS_DIR)
+    os.environ["PROMETHEUS_MULTIPROC_DIR"] = METRICS_DIR
 
-# limit to one worker when debugging templates in preprod since you get some weird caching issues across workers
-# otherwise (even though the cache loader is disabled in settings.py *shrug*)
-workers = multiprocessing.cpu_count() * 2 + 1
 accesslog = "/app/library/log/gunicorn-access.log"
-errorlog = "/app/library/log/gunicorn-error.log"
-# Whether to send Django output to the console to the error log
-capture_output = True
+# gunicorn's own log goes to stderr, and the workers' JSON log lines (see core.log) to stdout, both
+# straight to the container's output
+errorlog = "-"
+
+
+def when_ready(server):
+    if not preload_app:
+        return
+    from core.warmup import warm_up
+
+    warm_up()
+    gc.freeze()
+    gc.enable()
+    server.log.info("Warmed up, %d objects frozen before forking", gc.get_freeze_count())
+
+
+def post_worker_init(worker):
+    def recycle_when_grown():
+        page_size = os.sysconf("SC_PAGE_SIZE")
+        while worker.alive:
+            with open("/proc/self/statm") as statm:
+                rss_mb = int(statm.read().split()[1]) * page_size / 2**20
+            if rss_mb > MAX_WORKER_RSS_MB:
+                worker.log.warning(
+                    "Worker %s uses %.0f MB (over %d MB), recycling it",
+                    worker.pid,
+                    rss_mb,
+                    MAX_WORKER_RSS_MB,
+                )
+                # a graceful shutdown for both sync and uvicorn workers; the master forks another
+                os.kill(worker.pid, signal.SIGTERM)
+                return
+            time.sleep(RSS_CHECK_SECONDS)
+
+    threading.Thread(target=recycle_when_grown, name="rss-check", daemon=True).start()
+
+
+def child_exit(server, worker):
+    from core.metrics import archive_process
+
+    archive_process(worker.pid)
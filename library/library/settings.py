@@ -100,6 +100,8 @@ INSTALLED_APPS = [
     "django.contrib.contenttypes",
     "django.contrib.sessions",
     "django.contrib.messages",
+    # Postgres-specific fields, indexes and lookups (full-text search)
+    "django.contrib.postgres",
     "catalog.apps.CatalogConfig",
     "core.apps.CoreConfig",
     "crispy_forms",
@@ -128,6 +130,8 @@ def middleware_list():
     middleware = []
 
     middleware.append("django_prometheus.middleware.PrometheusBeforeMiddleware")
+    # counts the queries of everything after it
+    middleware.append("core.instrumentation.ViewQueriesMiddleware")
 
     # debug_toolbar must come as soon as possible in the middleware list, but behind any encoding
     # middleware (like gzip)
@@ -143,8 +147,10 @@ def middleware_list():
         [
             "django.contrib.sessions.middleware.SessionMiddleware",
             "django.middleware.common.CommonMiddleware",
+            "core.replicas.PrimaryStickinessMiddleware",
             "django.middleware.csrf.CsrfViewMiddleware",
             "django.contrib.auth.middleware.AuthenticationMiddleware",
+            "core.profiling.RequestProfilingMiddleware",
             "django.contrib.messages.middleware.MessageMiddleware",
             "django.middleware.clickjacking.XFrameOptionsMiddleware",
             "django.contrib.admindocs.middleware.XViewMiddleware",
@@ -257,7 +263,10 @@ ACCOUNT_USERNAME_REQUIRED = True  # default
 # path to a list of validators
 ACCOUNT_USERNAME_VALIDATORS = None  # default
 
-EMAIL_BACKEND = (
+# mail is queued in the database during the request and delivered by the 'drain_outbox' worker
+# through OUTBOX_DELIVERY_BACKEND, so requests never wait on SMTP
+EMAIL_BACKEND = "core.mail.OutboxEmailBackend"
+OUTBOX_DELIVERY_BACKEND = (
     # can use console for development if don't want to use up email allowance
     # "django.core.mail.backends.console.EmailBackend"
     "django.core.mail.backends.smtp.EmailBackend"
@@ -268,6 +277,9 @@ EMAIL_HOST_USER = "apikey"
 EMAIL_HOST_PASSWORD = os.environ.get("SENDGRID_API_KEY")
 EMAIL_PORT = 587  # TLS port
 EMAIL_USE_TLS = True
+# seconds before a stalled SMTP connection errors (and the outbox worker retries), rather than
+# blocking forever
+EMAIL_TIMEOUT = 30
 # has to match configured domain in SendGrid
 DEFAULT_FROM_EMAIL = "Local Library Assistant <email@cshock.tech>"
 
@@ -276,8 +288,10 @@ ROOT_URLCONF = "library.urls"
 
 TEMPLATES = [
     {
-        # engine for template rendering
-        "BACKEND": "django.template.backends.django.DjangoTemplates",
+        # engine for template rendering (Django's, timing each template's rendering)
+        "BACKEND": "core.instrumentation.DjangoTemplates",
+        # the alias it would have as Django's backend
+        "NAME": "django",
         # look in the project dir for anything app-agnostic
         "DIRS": [BASE_DIR / "templates"],
         # do not set APP_DIRS when providing OPTIONS.loaders
@@ -296,6 +310,10 @@ TEMPLATES = [
 
 
 WSGI_APPLICATION = "library.wsgi.application"
+ASGI_APPLICATION = "library.asgi.application"
+# serve the read-only catalog pages with async views (catalog.async_views); set when the site runs
+# under ASGI, see library.asgi
+ASYNC_VIEWS = os.environ.get("DJANGO_ASYNC_VIEWS", "False") == "True"
 
 
 # Database
@@ -303,22 +321,76 @@ WSGI_APPLICATION = "library.wsgi.application"
 
 DATABASES = {
     "default": {
-        "ENGINE": "django_prometheus.db.backends.postgresql",
+        # django_prometheus's backend, exporting the connection pool's stats too
+        "ENGINE": "core.db",
         "NAME": os.environ.get("POSTGRES_DB_NAME"),
         "USER": os.environ.get("POSTGRES_USER"),
         "PASSWORD": os.environ.get("POSTGRES_PASSWORD"),
         "HOST": os.environ.get("POSTGRES_HOST"),
         "PORT": os.environ.get("POSTGRES_PORT"),
-        # defaults to 0; set to something or None if you want connection reuse (not needed for our low traffic site)
+        # must be 0 with the pool, which keeps the connections instead of each request opening its
+        # own
         "CONN_MAX_AGE": 0,
-        # usually set this to True if you want to use persistent connections, but check for performance penalties
-        "CONN_HEALTH_CHECKS": False,
+        # the pool checks connections before handing them out, so a request never gets one the
+        # server has dropped (e.g. on a restart)
+        "CONN_HEALTH_CHECKS": True,
         "OPTIONS": {
             "sslmode": "disable",
+            # a pool per worker process; a sync gunicorn worker only uses one connection at a
+            # time, so a small pool is enough, which also keeps the workers' connections (workers *
+            # max_size in total) well under Postgres's max_connections (ASGI workers serve several
+            # requests at once and get a bigger one, see gunicorn.conf.py)
+            "pool": {
+                "min_size": int(os.environ.get("POSTGRES_POOL_MIN_SIZE", "1")),
+                "max_size": int(os.environ.get("POSTGRES_POOL_MAX_SIZE", "4")),
+                # seconds a request waits for a connection before failing
+                "timeout": float(os.environ.get("POSTGRES_POOL_TIMEOUT", "10")),
+                # idle connections above min_size are closed after this many seconds
+                "max_idle": 300,
+                "name": "default",
+            },
         },
     }
 }
 
+# read replicas, as comma-separated "host[:port]"s with the primary's credentials; the read-only
+# catalog views read from them through core.replicas.ReplicaRouter. Locally, the primary's own host
+# works as a stand-in replica.
+DATABASE_REPLICAS = []
+for number, replica in enumerate(
+    filter(None, os.environ.get("POSTGRES_REPLICA_HOSTS", "").split(",")), start=1
+):
+    host, _, port = replica.strip().partition(":")
+    DATABASES[f"replica{number}"] = {
+        **DATABASES["default"],
+        "HOST": host,
+        "PORT": port or DATABASES["default"]["PORT"],
+        "OPTIONS": {
+            **DATABASES["default"]["OPTIONS"],
+            "pool": {**DATABASES["default"]["OPTIONS"]["pool"], "name": f"replica{number}"},
+        },
+        # tests read the test database through the replica aliases
+        "TEST": {"MIRROR": "default"},
+    }
+    DATABASE_REPLICAS.append(f"replica{number}")
+DATABASE_ROUTERS = ["core.replicas.ReplicaRouter"]
+# seconds a user keeps reading from the primary after writing, so they see their own writes before
+# the replicas catch up (which is also the most replica lag the page caches allow for)
+DATABASE_REPLICA_STICKY_SECONDS = int(os.environ.get("DATABASE_REPLICA_STICKY_SECONDS", "5"))
+
+# fraction of requests profiled at random (see core.profiling); users with the profile_requests
+# permission can have any request profiled with ?profile or an X-Profile header
+REQUEST_PROFILE_SAMPLE_RATE = float(os.environ.get("REQUEST_PROFILE_SAMPLE_RATE", "0"))
+# seconds between stack samples of a profiled request
+REQUEST_PROFILE_INTERVAL = 0.005
+# how many of the latest profiles are kept
+REQUEST_PROFILE_KEEP = 1000
+
+# queries a view makes taking this long or longer are logged (see core.slow_queries)
+SLOW_QUERY_SECONDS = float(os.environ.get("SLOW_QUERY_SECONDS", "0.1"))
+# seconds before a slow query's plan is captured again, in case the data has changed it
+SLOW_QUERY_EXPLAIN_INTERVAL = 3600
+
 USE_REDIS_CACHE = os.environ.get("USE_REDIS_CACHE", "") == "True"
 
 if USE_REDIS_CACHE:
@@ -347,6 +419,18 @@ if USE_REDIS_CACHE:
             # reads
         }
     }
+else:
+    CACHES = {
+        "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"},
+    }
+
+# catalog.cards' fragments and catalog.page_cache's pages, which are invalidated by whichever process
+# saves a change, so they are only cached where every worker sees the invalidations
+CACHES["fragments"] = CACHES["pages"] = (
+    CACHES["default"]
+    if USE_REDIS_CACHE
+    else {"BACKEND": "django.core.cache.backends.dummy.DummyCache"}
+)
 
 
 def static_files_storage():
@@ -460,6 +544,14 @@ MEDIA_ROOT = BASE_DIR / "user-media"
 #   manually construct URLs by using 'settings.MEDIA_URL + File/ImageField.name')
 MEDIA_URL = os.environ.get("MEDIA_URL", "user-media/")
 
+# pre-generated catalog exports (written by the 'export_snapshots' command)
+EXPORT_SNAPSHOT_ROOT = Path(
+    os.environ.get("EXPORT_SNAPSHOT_ROOT", BASE_DIR / "export-snapshots")
+)
+# internal nginx location aliasing EXPORT_SNAPSHOT_ROOT (see nginx/exports.conf); when set, snapshot
+# downloads are handed off to nginx with X-Accel-Redirect instead of being sent by django
+EXPORT_SNAPSHOT_ACCEL_PREFIX = os.environ.get("EXPORT_SNAPSHOT_ACCEL_PREFIX", "")
+
 # crispy forms settings
 CRISPY_ALLOWED_TEMPLATE_PACKS = "bootstrap5"
 CRISPY_TEMPLATE_PACK = "bootstrap5"
@@ -480,15 +572,14 @@ LOGGING = {
     # them and can prevent propagation
     "disable_existing_loggers": False,
     "formatters": {
-        "verbose": {
-            "format": "{levelname} {asctime} process:{process:d} {message}",
-            # f-string formatting
-            "style": "{",
-        },
         "simple": {
             "format": "{levelname} {asctime} {message}",
+            # f-string formatting
             "style": "{",
         },
+        "json": {
+            "()": "core.log.JsonFormatter",
+        },
     },
     "filters": {
         "require_debug_true": {
@@ -512,27 +603,32 @@ LOGGING = {
             "class": "logging.StreamHandler",
             "formatter": "simple",
         },
-        "file": {
+        # requests only queue the records; a thread in each process writes them to stdout as JSON
+        # lines, in batches (see core.log)
+        "queue": {
             "level": "WARNING",
-            # technically shouldn't log to a file like this when using gunicon due to the multiple
-            # processes, but leaving it for simplicity
-            "class": "logging.FileHandler",
-            # note that this is relative to the directory where the Django project start script is
-            # called, NOT the settings file
-            "filename": "./log/django-errors.log",
-            "formatter": "verbose",
+            "()": "core.log.QueueHandler",
+            "stream": "ext://sys.stdout",
+            "formatter": "json",
         },
         # "mail_admins": {
         #     "level": "ERROR",
         #     "class": "django.utils.log.AdminEmailHandler",
         # },
     },
+    # the project's own loggers (e.g. core.slow_queries')
+    "root": {
+        "handlers": ["queue"],
+        "level": "WARNING",
+    },
     # top-level logging object (name does not have any relation to module, so make sure to propagate
     # any log you don't consider completely "handled")
     "loggers": {
         # this is the name of the logger you need to provide when calling 'logger.getLogger([name])'
         "django": {
-            "handlers": ["console", "file"],
+            "handlers": ["console", "queue"],
+            # not to the root logger too
+            "propagate": False,
         },
         # BEWARE: failing email logging appears to prevent propagation??? (DON'T USE EMAIL LOGGING)
         #
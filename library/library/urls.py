@@ -23,6 +23,8 @@ from django.urls import include, path, re_path
 from django.views.decorators.cache import never_cache
 from django.views.generic import RedirectView
 
+from core import views as core_views
+
 urlpatterns = [
     # put this first to intercept the admin/doc/ URL
     path("admin/doc/", include("django.contrib.admindocs.urls")),
@@ -31,8 +33,8 @@ urlpatterns = [
     path("catalog/", include("catalog.urls")),
     # "" instead of "/" since django always computes urls from the project root
     path("", RedirectView.as_view(url="/catalog/", permanent=True)),
-    # metrics URL for prometheus scraping
-    path("", include("django_prometheus.urls")),
+    # metrics URL for prometheus scraping, aggregated over the gunicorn workers
+    path("metrics", core_views.metrics, name="prometheus-django-metrics"),
 ]
 if settings.DEBUG:
     # werid prependend slash in STATIC_URL once it gets set